@@ -2,44 +2,40 @@ import logging
 from timeit import default_timer
 
 import hydra
-import quiver
 import torch
 from ogb.nodeproppred import Evaluator
 from omegaconf import OmegaConf
 from torch_geometric.loader import NeighborSampler
-from utils import get_model
+from utils import get_feature, get_model, get_sampler
 
-from microGNN import History
+from microGNN import GlobalHistory, HistoryPool, MmapHistory
 from microGNN.models import criterion
-from microGNN.utils import cal_metrics, get_dataset, get_nano_batch_histories
+from microGNN.utils import (cal_metrics, get_dataset, get_nano_batch,
+                            get_nano_batch_histories)
 
 log = logging.getLogger(__name__)
 
 
 @hydra.main(config_path="../conf", config_name="config", version_base="1.1")
 def train(conf):
-    torch.cuda.reset_peak_memory_stats()
+    if torch.cuda.is_available():
+        torch.cuda.reset_peak_memory_stats()
     dataset_name = conf.dataset.name
     params = conf.model.params[dataset_name]
     print(OmegaConf.to_yaml(conf))
     dataset = get_dataset(dataset_name, conf.root)
     data = dataset[0]
     rank = torch.device("cuda:1" if torch.cuda.is_available() else "cpu")
-    torch.cuda.set_device(rank)
+    if torch.cuda.is_available():
+        torch.cuda.set_device(rank)
     torch.manual_seed(12345)
-    csr_topo = quiver.CSRTopo(data.edge_index)
-    quiver_sampler = quiver.pyg.GraphSageSampler(csr_topo,
-                                                 sizes=params.hop,
-                                                 device=1,
-                                                 mode="GPU")
-    x = quiver.Feature(rank=1,
-                       device_list=[1],
-                       device_cache_size="4G",
-                       cache_policy="device_replicate",
-                       csr_topo=csr_topo)
-    feature = torch.zeros(data.x.shape)
-    feature[:] = data.x
-    x.from_cpu_tensor(feature)
+    # quiver on GPU hosts, CSRSampler and CPU features otherwise
+    sampler, csr_topo = get_sampler(data.edge_index,
+                                    params.hop,
+                                    device=1,
+                                    kind=conf.sampler,
+                                    num_threads=conf.sample_threads)
+    x = get_feature(data.x, csr_topo, rank=1)
 
     if dataset_name == "ogbn-products" or dataset_name == "papers100M":
         split_idx = dataset.get_idx_split()
@@ -83,33 +79,73 @@ def train(conf):
     y = data.y.to(rank)
     epochtimes = []
     acc3 = -1
+    # reused by every mini batch, reset only clears the touched entries
+    history_pool = HistoryPool(layers - 1,
+                               emb_dim,
+                               rank,
+                               conf.compact_history,
+                               dtype=getattr(torch, conf.history_dtype),
+                               async_push=conf.history_async)
+    global_histories = None
+    if conf.history_staleness is not None and conf.history_path is not None:
+        global_histories = [  # on disk, beyond host memory
+            MmapHistory(data.num_nodes, emb_dim,
+                        f"{conf.history_path}/history{i}.bin",
+                        conf.history_staleness) for i in range(layers - 1)
+        ]
+    elif conf.history_staleness is not None:  # reuse across mini batches
+        global_histories = [
+            GlobalHistory(data.num_nodes,
+                          emb_dim,
+                          conf.history_staleness,
+                          conf.history_budget,
+                          conf.history_policy,
+                          rank,
+                          dtype=getattr(torch, conf.history_dtype))
+            for _ in range(layers - 1)
+        ]
 
     for epoch in range(1, conf.num_epoch + 1):
         model.train()
         epoch_start = default_timer()
         for seeds in train_loader:
             optimizer.zero_grad()
-            n_id, batch_size, adjs = quiver_sampler.sample(seeds)
+            n_id, batch_size, adjs = sampler.sample(seeds)
             target_node = n_id[:batch_size]
-            nano_batchs, cached_id = get_nano_batch_histories(
-                adjs, n_id, batch_size)
-            histories = torch.nn.ModuleList([
-                History(cacheid, len(n_id), emb_dim, rank)
-                for cacheid in cached_id
-            ])
-            for i, nb in enumerate(nano_batchs):
-                adjs = [adj.to(rank) for adj in nb.adjs]
+            if global_histories is None:
+                # pruning is planned here, forward does no graph work
+                nano_batchs, cached_id = get_nano_batch_histories(
+                    adjs, n_id, batch_size, return_plans=True)
+                histories = history_pool.reset(cached_id, len(n_id))
+            else:
+                nano_batchs = get_nano_batch(adjs, n_id, batch_size)
+                histories = [h.bind(n_id) for h in global_histories]
+                for h in global_histories:
+                    h.tick()
+            for nb in nano_batchs:
                 nbid = nb.n_id.to(rank)
-                out = model(x[n_id][nb.n_id], nbid, adjs, histories)
-                loss = criterion(
-                    out, y[target_node][i * (nb.size):(i + 1) * (nb.size)],
-                    dataset_name)
+                if global_histories is None:
+                    # only the inputs kept by the plan are gathered
+                    out = model(x[n_id[nb.n_id]].to(rank),
+                                nbid,
+                                None,
+                                histories,
+                                plan=nb.to(rank))
+                else:
+                    adjs = [adj.to(rank) for adj in nb.adjs]
+                    out = model(x[n_id][nb.n_id].to(rank), nbid, adjs,
+                                histories)
+                loss = criterion(out, y[target_node][nb.n_id[:nb.size]],
+                                 dataset_name)
                 loss.backward()
             optimizer.step()
         epochtime = default_timer() - epoch_start
         if epoch > 1:
             epochtimes.append(epochtime)
         print(f"Epoch: {epoch:03d}, Loss: {loss:.4f}, Epoch Time: {epochtime}")
+        if global_histories is not None:
+            print(", ".join(f"layer {i} hits {h.hits} misses {h.misses}"
+                            for i, h in enumerate(global_histories)))
     maxgpu = torch.cuda.max_memory_allocated() / 10**9
     metric = cal_metrics(epochtimes)
     log.log(
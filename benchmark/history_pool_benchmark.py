@@ -0,0 +1,72 @@
+"""
+compare the per mini batch setup cost of the histories: a fresh
+torch.nn.ModuleList of History against HistoryPool.reset, for mini batches
+whose node count varies like sampled ones.
+"""
+from timeit import default_timer
+
+import torch
+
+from microGNN import History, HistoryPool
+from microGNN.utils import cal_metrics
+
+
+def mini_batches(num_nodes, cached_ratio, num_histories, iters):
+    # the number of sampled nodes varies by +-10% between mini batches
+    for _ in range(iters):
+        num_embeddings = int(num_nodes * (0.9 + 0.2 * torch.rand(1).item()))
+        num_cached = int(num_embeddings * cached_ratio)
+        cached_id = [
+            torch.randint(0, num_embeddings, (num_cached, ))
+            for _ in range(num_histories)
+        ]
+        yield cached_id, num_embeddings
+
+
+def sync(device):
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+
+
+def bench_fresh(batches, embedding_dim, device, compact):
+    times = []
+    for cached_id, num_embeddings in batches:
+        start = default_timer()
+        torch.nn.ModuleList([
+            History(ids, num_embeddings, embedding_dim, device, compact)
+            for ids in cached_id
+        ])
+        sync(device)
+        times.append(default_timer() - start)
+    return cal_metrics(times[1:])
+
+
+def bench_pool(batches, embedding_dim, device, compact):
+    pool = HistoryPool(len(batches[0][0]), embedding_dim, device, compact)
+    times = []
+    for cached_id, num_embeddings in batches:
+        start = default_timer()
+        pool.reset(cached_id, num_embeddings)
+        sync(device)
+        times.append(default_timer() - start)
+    return cal_metrics(times[1:])
+
+
+def main():
+    torch.manual_seed(12345)
+    device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+    embedding_dim, num_histories, iters = 256, 2, 20
+    print("nodes, cached ratio, compact, fresh, pool (mean seconds)")
+    for num_nodes in [10**5, 10**6, 4 * 10**6]:
+        for cached_ratio in [0.01, 0.1]:
+            batches = list(
+                mini_batches(num_nodes, cached_ratio, num_histories, iters))
+            for compact in [False, True]:
+                fresh = bench_fresh(batches, embedding_dim, device, compact)
+                pool = bench_pool(batches, embedding_dim, device, compact)
+                print(f"{num_nodes}, {cached_ratio}, {compact}, "
+                      f"{fresh['mean']:.5f}, {pool['mean']:.5f}")
+
+
+if __name__ == "__main__":
+    main()
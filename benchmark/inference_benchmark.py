@@ -0,0 +1,60 @@
+"""
+compare full graph inference through a NeighborSampler(sizes=[-1]) loader
+per layer, as model.inference, with LayerwiseInference on a random graph.
+"""
+import tempfile
+from timeit import default_timer
+
+import torch
+from torch_geometric.loader import NeighborSampler
+from torch_geometric.utils import coalesce
+
+from microGNN import LayerwiseInference
+from microGNN.models import SAGE
+
+
+def best_of(fn, repeat=3):
+    times = []
+    for _ in range(repeat):
+        start = default_timer()
+        fn()
+        times.append(default_timer() - start)
+    return min(times)
+
+
+def main():
+    torch.manual_seed(12345)
+    num_nodes, num_edges, chunk_size = 200000, 2000000, 65536
+    edge_index = coalesce(torch.randint(0, num_nodes, (2, num_edges)),
+                          num_nodes=num_nodes)
+    x = torch.randn(num_nodes, 128)
+    model = SAGE(128, 128, 47, 3).eval()
+    loader = NeighborSampler(edge_index,
+                             sizes=[-1],
+                             batch_size=chunk_size,
+                             shuffle=False)
+    print("method, seconds")
+    print(f"loader, {best_of(lambda: model.inference(x, 'cpu', loader)):.3f}")
+    engine = LayerwiseInference(edge_index, num_nodes, chunk_size)
+    setup = best_of(
+        lambda: LayerwiseInference(edge_index, num_nodes, chunk_size).chunks,
+        1)
+    print(f"layerwise setup, {setup:.3f}")
+    print(f"layerwise, {best_of(lambda: engine.run(model, x)):.3f}")
+    for num_threads in [2, 4]:
+        engine.num_threads = num_threads
+        print(f"layerwise {num_threads} threads, "
+              f"{best_of(lambda: engine.run(model, x)):.3f}")
+    with tempfile.TemporaryDirectory() as out_dir:
+        engine.num_threads, engine.out_dir = 1, out_dir
+        print(f"layerwise memmap, {best_of(lambda: engine.run(model, x)):.3f}")
+    with tempfile.TemporaryDirectory() as cache_dir:
+        engine.out_dir, engine.cache_dir = None, cache_dir
+        print(f"layerwise cache cold, "
+              f"{best_of(lambda: engine.run(model, x), 1):.3f}")
+        print(f"layerwise cache warm, "
+              f"{best_of(lambda: engine.run(model, x)):.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+pick the number of nano batches from a memory budget and compare the
+estimated activation footprint of the largest nano batch with the peak
+resident memory measured during its forward and backward pass on CPU.
+"""
+import ctypes
+import os
+import threading
+from timeit import default_timer
+
+import torch
+
+from microGNN.models import SAGE
+from microGNN.utils import (estimate_memory, get_nano_batch, nano_batch_memory,
+                            sage_memory_model)
+from microGNN.utils.common_class import Adj
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+def rss() -> int:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * PAGE_SIZE
+
+
+def fixed_mmap_threshold():
+    # glibc raises its mmap threshold as big chunks are freed and then keeps
+    # freed tensors in the heap, pin it so large tensors leave the RSS
+    try:
+        ctypes.CDLL("libc.so.6").mallopt(-3, 128 * 1024)  # M_MMAP_THRESHOLD
+    except OSError:
+        pass
+
+
+def peak_rss(fn) -> int:
+    r"""Runs :obj:`fn` and returns its peak RSS increase, sampled on a
+    thread, torch ops release the GIL."""
+    before, peak, done = rss(), [0], threading.Event()
+
+    def sample():
+        while not done.is_set():
+            peak[0] = max(peak[0], rss())
+            done.wait(0.0005)
+
+    sampler = threading.Thread(target=sample)
+    sampler.start()
+    try:
+        fn()
+    finally:
+        done.set()
+        sampler.join()
+    return max(peak[0], rss()) - before
+
+
+def train_step(model, x, nb):
+    out = model(x[nb.n_id], nb.adjs)
+    out.sum().backward()
+
+
+def random_adjs(sizes, degree):
+    # from the outer layer inward, like the samplers return them
+    adjs = []
+    for target_size, source_size in zip(sizes[:-1], sizes[1:]):
+        target = torch.arange(target_size).repeat_interleave(degree)
+        source = torch.randint(0, source_size, (target.size(0), ))
+        adjs.append(
+            Adj(torch.stack([source, target]), None,
+                (source_size, target_size)))
+    return adjs[::-1]
+
+
+def main():
+    fixed_mmap_threshold()
+    torch.manual_seed(12345)
+    channels = [602, 256, 41]
+    sizes, degree = (1024, 9000, 70000), 10
+    model = SAGE(channels[0], channels[1], channels[2])
+    memory_model = sage_memory_model(channels)
+    adjs = random_adjs(sizes, degree)
+    x = torch.randn(sizes[-1], channels[0])
+    whole = estimate_memory([(adj.size[0], adj.size[1], adj.edge_index.size(1))
+                             for adj in adjs], memory_model)
+    print(f"mini batch estimate {whole / 2**20:.1f}MB")
+    print("budget MB, nano batches, pick seconds, "
+          "largest estimate MB, largest measured MB")
+    for ratio in [2, 1, 1 / 2, 1 / 4, 1 / 8, 1 / 16]:
+        budget = whole * ratio
+        start = default_timer()
+        nano_batchs = get_nano_batch(list(adjs),
+                                     torch.arange(sizes[-1]),
+                                     sizes[0],
+                                     1,
+                                     memory_budget=budget,
+                                     memory_model=memory_model)
+        pick = default_timer() - start
+        estimates, measured = [], []
+        for nb in nano_batchs:
+            estimates.append(nano_batch_memory(nb, memory_model))
+            measured.append(peak_rss(lambda: train_step(model, x, nb)))
+        print(f"{budget / 2**20:.1f}, {len(nano_batchs)}, {pick:.3f}, "
+              f"{max(estimates) / 2**20:.1f}, {max(measured) / 2**20:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,43 +2,39 @@ import logging
 from timeit import default_timer
 
 import hydra
-import quiver
 import torch
 from ogb.nodeproppred import Evaluator
 from omegaconf import OmegaConf
 from torch_geometric.loader import NeighborSampler
-from utils import get_model
+from utils import get_feature, get_model, get_sampler
 
 from microGNN.models import criterion
-from microGNN.utils import cal_metrics, get_dataset, get_nano_batch
+from microGNN.utils import (cal_metrics, gat_memory_model, get_dataset,
+                            iter_nano_batches, sage_memory_model)
 
 log = logging.getLogger(__name__)
 
 
 @hydra.main(config_path="../conf", config_name="config", version_base="1.1")
 def train(conf):
-    torch.cuda.reset_peak_memory_stats()
+    if torch.cuda.is_available():
+        torch.cuda.reset_peak_memory_stats()
     dataset_name = conf.dataset.name
     params = conf.model.params[dataset_name]
     print(OmegaConf.to_yaml(conf))
     dataset = get_dataset(dataset_name, conf.root)
     data = dataset[0]
     rank = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
-    torch.cuda.set_device(rank)
+    if torch.cuda.is_available():
+        torch.cuda.set_device(rank)
     torch.manual_seed(12345)
-    csr_topo = quiver.CSRTopo(data.edge_index)
-    quiver_sampler = quiver.pyg.GraphSageSampler(csr_topo,
-                                                 sizes=params.hop,
-                                                 device=0,
-                                                 mode="GPU")
-    x = quiver.Feature(rank=0,
-                       device_list=[0],
-                       device_cache_size="4G",
-                       cache_policy="device_replicate",
-                       csr_topo=csr_topo)
-    feature = torch.zeros(data.x.shape)
-    feature[:] = data.x
-    x.from_cpu_tensor(feature)
+    # quiver on GPU hosts, CSRSampler and CPU features otherwise
+    sampler, csr_topo = get_sampler(data.edge_index,
+                                    params.hop,
+                                    device=0,
+                                    kind=conf.sampler,
+                                    num_threads=conf.sample_threads)
+    x = get_feature(data.x, csr_topo, rank=0)
     if dataset_name == "ogbn-products" or dataset_name == "papers100M":
         split_idx = dataset.get_idx_split()
         train_idx, valid_idx, test_idx = (
@@ -76,6 +72,13 @@ def train(conf):
         model_params['num_heads'] = params.heads
 
     model = get_model(conf.model.name, model_params, scale=False).to(rank)
+    channels = [
+        data.num_features
+    ] + [params.hidden_channels] * (layers - 1) + [dataset.num_classes]
+    if conf.model.name == "gat":
+        memory_model = gat_memory_model(channels, params.heads)
+    else:
+        memory_model = sage_memory_model(channels)
     optimizer = torch.optim.Adam(model.parameters(), lr=0.01)
     y = data.y.to(rank)
     epochtimes = []
@@ -85,17 +88,22 @@ def train(conf):
         epoch_start = default_timer()
         for seeds in train_loader:
             optimizer.zero_grad()
-            n_id, batch_size, adjs = quiver_sampler.sample(seeds)
+            n_id, batch_size, adjs = sampler.sample(seeds)
             target_node = n_id[:batch_size]
-            nano_batchs = get_nano_batch(adjs, n_id, batch_size,
-                                         gpu_num * per_gpu)
-            for i, nano_batch in enumerate(nano_batchs):
+            # slice nano batch i+1 while nano batch i runs forward/backward
+            nano_batchs = iter_nano_batches(adjs,
+                                            n_id,
+                                            batch_size,
+                                            gpu_num * per_gpu,
+                                            prefetch=1,
+                                            memory_budget=conf.memory_budget,
+                                            memory_model=memory_model)
+            for nano_batch in nano_batchs:
                 nano_batch_adjs = [adj.to(rank) for adj in nano_batch.adjs]
-                out = model(x[n_id][nano_batch.n_id], nano_batch_adjs)
+                out = model(x[n_id][nano_batch.n_id].to(rank), nano_batch_adjs)
                 loss = criterion(
                     out,
-                    y[target_node][i * (nano_batch.size):(i + 1) *
-                                   (nano_batch.size)],
+                    y[target_node][nano_batch.n_id[:nano_batch.size]],
                     dataset_name,
                 )
                 loss.backward()
@@ -9,8 +9,8 @@ import torch.nn.functional as F
 from omegaconf import OmegaConf
 from torch.nn.parallel import DistributedDataParallel
 from torch_geometric.loader import NeighborSampler
+from utils import get_feature, get_sampler
 
-import quiver
 from microGNN.models import SAGE
 from microGNN.utils import cal_metrics, get_dataset, get_nano_batch
 from microGNN.utils.common_config import gpu
@@ -45,8 +45,11 @@ def run_sample(worker_id, params, conf, data, quiver_sampler, nano_queues):
         epoch_start = default_timer()
         for seeds in train_loader:
             n_id, batch_size, adjs = quiver_sampler.sample(seeds)
-            nano_batchs = get_nano_batch(adjs, n_id, batch_size,
-                                         num_train_worker * per_gpu)
+            nano_batchs = get_nano_batch(adjs,
+                                         n_id,
+                                         batch_size,
+                                         num_train_worker * per_gpu,
+                                         vectorized=True)
             for i in range(num_train_worker):
                 nano_queues[i].put(
                     (n_id, nano_batchs[i * per_gpu:(i + 1) * per_gpu]))
@@ -114,19 +117,15 @@ def run_train(worker_id, params, conf, x, dataset, queue):
             (n_id, nano_batchs) = queue.get()
             epoch_start = default_timer()
             optimizer.zero_grad()
-            target_node = n_id[:batch_size][worker_id *
-                                            params.batch_size:(worker_id + 1) *
-                                            params.batch_size]
-            for i, nano_batch in enumerate(nano_batchs):
+            for nano_batch in nano_batchs:
+                # nano batch sizes may differ by one
+                target_node = n_id[nano_batch.n_id[:nano_batch.size]]
                 nano_batch_adjs = [
                     adj.to(train_device) for adj in nano_batch.adjs
                 ]
-                out = model(x[n_id][nano_batch.n_id], nano_batch_adjs)
-                loss = F.nll_loss(
-                    out,
-                    y[target_node][i * (nano_batch.size):(i + 1) *
-                                   (nano_batch.size)],
-                )
+                out = model(x[n_id][nano_batch.n_id].to(train_device),
+                            nano_batch_adjs)
+                loss = F.nll_loss(out, y[target_node])
                 loss.backward()
             optimizer.step()
             epoch_end = default_timer()
@@ -172,20 +171,19 @@ def main(conf):
     dataset_name = conf.dataset.name
     dataset = get_dataset(dataset_name, conf.root)
     data = dataset[0]
-    csr_topo = quiver.CSRTopo(data.edge_index)
-
-    quiver_sampler = quiver.pyg.GraphSageSampler(
-        csr_topo, sizes=[25, 10], device=0,
-        mode="GPU")  # 这里是0, 但是spawn之后会变成fake,然后再lazy init 赋值
-
-    quiver_feature = quiver.Feature(
-        rank=0,
-        device_list=list(range(num_train_workers)),
-        device_cache_size="2G",
-        cache_policy="device_replicate",
-        csr_topo=csr_topo,
-    )
-    quiver_feature.from_cpu_tensor(data.x)
+    # quiver on GPU hosts, CSRSampler and CPU features otherwise
+    quiver_sampler, csr_topo = get_sampler(
+        data.edge_index, [25, 10],
+        device=0,
+        kind=conf.sampler,
+        num_threads=conf.sample_threads
+    )  # 这里是0, 但是spawn之后会变成fake,然后再lazy init 赋值
+
+    quiver_feature = get_feature(data.x,
+                                 csr_topo,
+                                 rank=0,
+                                 device_list=list(range(num_train_workers)),
+                                 cache_size="2G")
 
     workers = []
     mp.set_start_method("spawn")
@@ -75,7 +75,12 @@ def run_sample(worker_id, run_config, quiver_sampler):
         for seeds in train_loader:
             mq_sem.release()
             n_id, batch_size, adjs = quiver_sampler.sample(seeds)
-            nano_batchs = get_nano_batch(adjs, n_id, batch_size, num_nano)
+            # equalize the edges of the nano batches across train workers
+            nano_batchs = get_nano_batch(adjs,
+                                         n_id,
+                                         batch_size,
+                                         num_nano,
+                                         partition="balanced")
             nano_queues.put((n_id, nano_batchs))
         sampler_stop_event.set()
         toc = default_timer()
@@ -156,19 +161,14 @@ def run_train(worker_id, run_config, x, trainer_type):
             (n_id, nano_batchs) = queue.get()  #
             epoch_start = default_timer()
             optimizer.zero_grad()
-            target_node = n_id[:batch_size][worker_id *
-                                            params.batch_size:(worker_id + 1) *
-                                            params.batch_size]
-            for i, nano_batch in enumerate(nano_batchs):
+            for nano_batch in nano_batchs:
+                # balanced nano batches do not hold contiguous targets
+                target_node = n_id[nano_batch.n_id[:nano_batch.size]]
                 nano_batch_adjs = [
                     adj.to(train_device) for adj in nano_batch.adjs
                 ]
                 out = model(x[n_id][nano_batch.n_id], nano_batch_adjs)
-                loss = F.nll_loss(
-                    out,
-                    y[target_node][i * (nano_batch.size):(i + 1) *
-                                   (nano_batch.size)],
-                )
+                loss = F.nll_loss(out, y[target_node])
                 loss.backward()
 
             optimizer.step()
@@ -0,0 +1,56 @@
+"""
+compare the nano batch partition strategies: total sliced nodes per layer
+and partition time on synthetic mini batches whose nodes belong to
+communities, with node ids shuffled so contiguous ranges ignore them.
+"""
+from timeit import default_timer
+
+import torch
+
+from microGNN.utils import (PARTITIONERS, cal_metrics, count_sliced_nodes,
+                            partition_targets)
+from microGNN.utils.common_class import Adj
+
+
+def community_adjs(sizes, degree=10, num_communities=64, p_in=0.9):
+    # from the target layer outward, a neighbor is in the community of its
+    # target with probability p_in
+    community = [torch.randint(0, num_communities, (s, )) for s in sizes]
+    adjs = []
+    for j, (target_size, source_size) in enumerate(zip(sizes[:-1], sizes[1:])):
+        target = torch.arange(target_size).repeat_interleave(degree)
+        source = torch.randint(0, source_size, (target.size(0), ))
+        # sources sorted by community, pick one inside the target community
+        order = torch.argsort(community[j + 1])
+        counts = torch.bincount(community[j + 1], minlength=num_communities)
+        start = torch.cumsum(counts, 0) - counts
+        c = community[j][target]
+        offset = (torch.rand(target.size(0)) * counts[c]).long()
+        inside = torch.rand(target.size(0)) < p_in
+        source[inside] = order[(start[c] + offset)[inside]]
+        adjs.append(
+            Adj(torch.stack([source, target]), None,
+                (source_size, target_size)))
+    return adjs
+
+
+def main():
+    torch.manual_seed(12345)
+    num_nano_batch = 8
+    for sizes in [(1024, 8000, 40000), (1024, 8000, 40000, 150000)]:
+        adjs = community_adjs(sizes)
+        print(f"layer sizes {sizes}, {num_nano_batch} nano batches")
+        for strategy in PARTITIONERS:
+            times = []
+            for _ in range(3):
+                start = default_timer()
+                seeds = partition_targets(adjs, sizes[0], num_nano_batch,
+                                          strategy)
+                times.append(default_timer() - start)
+            nodes = count_sliced_nodes(adjs, seeds, sizes[-1])
+            print(f"{strategy}, {cal_metrics(times)['mean']:.4f}s, "
+                  f"sliced nodes per layer {nodes}")
+
+
+if __name__ == "__main__":
+    main()
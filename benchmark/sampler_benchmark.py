@@ -0,0 +1,45 @@
+"""
+mini batch sampling time of CSRSampler against PyG's NeighborSampler on a
+random graph, both on CPU, for the fanouts of the benchmarks.
+"""
+from timeit import default_timer
+
+import torch
+from torch_geometric.loader import NeighborSampler
+
+from microGNN import CSRSampler
+from microGNN.utils import cal_metrics
+
+
+def bench(sample, batches):
+    times = []
+    for seeds in batches:
+        start = default_timer()
+        sample(seeds)
+        times.append(default_timer() - start)
+    return cal_metrics(times[1:])
+
+
+def main():
+    torch.manual_seed(12345)
+    num_nodes, num_edges, batch_size, iters = 1000000, 20000000, 1024, 10
+    edge_index = torch.randint(0, num_nodes, (2, num_edges))
+    batches = [torch.randperm(num_nodes)[:batch_size] for _ in range(iters)]
+    print("sizes, sampler, p50 ms, mini batches/s")
+    for sizes in [[25, 10], [15, 10, 5]]:
+        loader = NeighborSampler(edge_index,
+                                 sizes=sizes,
+                                 num_nodes=num_nodes,
+                                 batch_size=batch_size)
+        samplers = {"pyg": loader.sample}
+        for num_threads in [1, 4]:
+            sampler = CSRSampler(edge_index, sizes, num_nodes, num_threads)
+            samplers[f"csr {num_threads} threads"] = sampler.sample
+        for name, sample in samplers.items():
+            m = bench(sample, batches)
+            print(f"{sizes}, {name}, {m['p50'] * 1e3:.1f}, "
+                  f"{1 / m['mean']:.1f}")
+
+
+if __name__ == "__main__":
+    main()
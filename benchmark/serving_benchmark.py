@@ -0,0 +1,59 @@
+"""
+latency and throughput of EmbeddingServer on a random graph: concurrent
+clients each send requests of a few nodes, with and without micro-batching.
+then the latency of NodePredictor queries on a hot set of nodes, without
+and with the kept embeddings.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from timeit import default_timer
+
+import torch
+from torch_geometric.utils import coalesce
+
+from microGNN import EmbeddingServer, LayerwiseInference, NodePredictor
+from microGNN.models import SAGE
+from microGNN.utils import cal_metrics
+
+
+def client(server, num_nodes, num_requests, request_size):
+    for _ in range(num_requests):
+        server.predict(torch.randint(0, num_nodes, (request_size, )))
+
+
+def main():
+    torch.manual_seed(12345)
+    num_nodes, num_edges = 200000, 2000000
+    edge_index = coalesce(torch.randint(0, num_nodes, (2, num_edges)),
+                          num_nodes=num_nodes)
+    x = torch.randn(num_nodes, 128)
+    model = SAGE(128, 128, 47, 3)
+    engine = LayerwiseInference(edge_index, num_nodes)
+    num_clients, num_requests, request_size = 16, 50, 8
+    print("max wait, p50 ms, p99 ms, requests/s, nodes per pass")
+    for max_wait in [0, 0.001, 0.005]:
+        with EmbeddingServer(model, x, engine, max_wait=max_wait) as server:
+            with ThreadPoolExecutor(max_workers=num_clients) as pool:
+                for _ in range(num_clients):
+                    pool.submit(client, server, num_nodes, num_requests,
+                                request_size)
+            m = server.metrics()
+        print(f"{max_wait}, {m['p50'] * 1e3:.2f}, {m['p99'] * 1e3:.2f}, "
+              f"{m['throughput']:.0f}, {m['mean_batch_size']:.1f}")
+
+    print("memory budget, p50 ms, p99 ms")
+    hot = torch.randint(0, num_nodes, (200, ))
+    queries = [hot[torch.randint(0, hot.size(0), (8, ))] for _ in range(200)]
+    for memory_budget in [0, 2**24]:
+        predictor = NodePredictor(model, x, edge_index, num_nodes,
+                                  memory_budget)
+        times = []
+        for node_ids in queries:
+            start = default_timer()
+            predictor.predict_nodes(node_ids)
+            times.append(default_timer() - start)
+        m = cal_metrics(times[len(times) // 2:])  # warm
+        print(f"{memory_budget}, {m['p50'] * 1e3:.2f}, {m['p99'] * 1e3:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+compare the seed removal + dedup modes of slice_adj on synthetic power-law
+graphs with 1e5 - 1e7 edges.
+"""
+from timeit import default_timer
+
+import torch
+
+from microGNN.utils import cal_metrics, slice_adj
+
+
+def power_law_graph(num_nodes: int, num_edges: int, alpha: float = 1.5):
+    # node i is picked as a source with probability ~ (i + 1)^-alpha
+    weight = torch.arange(1, num_nodes + 1, dtype=torch.float).pow(-alpha)
+    source = torch.multinomial(weight, num_edges, replacement=True)
+    source = torch.randperm(num_nodes)[source]  # hubs are not the small ids
+    target = torch.randint(0, num_nodes, (num_edges, ))
+    return torch.stack([source, target])
+
+
+def bench(edge_index, num_nodes, seeds, repeat=5, **kwargs):
+    times = []
+    for _ in range(repeat):
+        start = default_timer()
+        slice_adj(seeds,
+                  edge_index,
+                  relabel_nodes=True,
+                  num_nodes=num_nodes,
+                  **kwargs)
+        times.append(default_timer() - start)
+    return cal_metrics(times)
+
+
+def main():
+    torch.manual_seed(12345)
+    modes = {
+        "isin": dict(dedup="isin"),
+        "mask": dict(dedup="mask"),
+        "mask+first": dict(dedup="mask", keep_order=True),
+    }
+    print("edges, seeds, " + ", ".join(modes) + " (mean seconds)")
+    for num_edges in [10**5, 10**6, 10**7]:
+        num_nodes = num_edges // 10
+        edge_index = power_law_graph(num_nodes, num_edges)
+        for num_seeds in [num_nodes // 100, num_nodes // 4]:
+            seeds = torch.randperm(num_nodes)[:num_seeds]
+            times = [
+                bench(edge_index, num_nodes, seeds, **kwargs)["mean"]
+                for kwargs in modes.values()
+            ]
+            print(f"{num_edges}, {num_seeds}, " + ", ".join(f"{t:.4f}"
+                                                            for t in times))
+
+
+if __name__ == "__main__":
+    main()
@@ -6,9 +6,8 @@ import torch
 from ogb.nodeproppred import Evaluator
 from omegaconf import OmegaConf
 from torch_geometric.loader import NeighborSampler
-from utils import get_model
+from utils import get_feature, get_model, get_sampler
 
-import quiver
 from microGNN.models import criterion
 from microGNN.utils import cal_metrics, get_dataset
 
@@ -17,7 +16,8 @@ log = logging.getLogger(__name__)
 
 @hydra.main(config_path="../conf", config_name="config", version_base="1.1")
 def train(conf):
-    torch.cuda.reset_peak_memory_stats()
+    if torch.cuda.is_available():
+        torch.cuda.reset_peak_memory_stats()
     dataset_name = conf.dataset.name
     params = conf.model.params[dataset_name]
     print(OmegaConf.to_yaml(conf))
@@ -25,7 +25,8 @@ def train(conf):
     data = dataset[0]
 
     rank = torch.device("cuda:1" if torch.cuda.is_available() else "cpu")
-    torch.cuda.set_device(rank)
+    if torch.cuda.is_available():
+        torch.cuda.set_device(rank)
     torch.manual_seed(12345)
     gpu_num, per_gpu, layers = conf.num_train_worker, conf.nano_pergpu, len(
         params.hop)
@@ -39,19 +40,13 @@ def train(conf):
         model_params['num_heads'] = params.heads
 
     model = get_model(conf.model.name, model_params, scale=False).to(rank)
-    csr_topo = quiver.CSRTopo(data.edge_index)
-    quiver_sampler = quiver.pyg.GraphSageSampler(csr_topo,
-                                                 sizes=params.hop,
-                                                 device=1,
-                                                 mode="GPU")
-    x = quiver.Feature(rank=1,
-                       device_list=[1],
-                       device_cache_size="4G",
-                       cache_policy="device_replicate",
-                       csr_topo=csr_topo)
-    feature = torch.zeros(data.x.shape)
-    feature[:] = data.x
-    x.from_cpu_tensor(feature)
+    # quiver on GPU hosts, CSRSampler and CPU features otherwise
+    sampler, csr_topo = get_sampler(data.edge_index,
+                                    params.hop,
+                                    device=1,
+                                    kind=conf.sampler,
+                                    num_threads=conf.sample_threads)
+    x = get_feature(data.x, csr_topo, rank=1)
     y = data.y.to(rank)
 
     if dataset_name == "ogbn-products" or dataset_name == "papers100M":
@@ -87,7 +82,7 @@ def train(conf):
         traintimes = []
         for seeds in train_loader:
             epoch_start = default_timer()
-            n_id, batch_size, adjs = quiver_sampler.sample(seeds)
+            n_id, batch_size, adjs = sampler.sample(seeds)
             sampletime = default_timer()
             optimizer.zero_grad()
             target_node = n_id[:batch_size]
@@ -1 +1 @@
-from .utils import get_model
+from .utils import get_feature, get_model, get_sampler, use_quiver
@@ -1,5 +1,13 @@
+import torch
+
+from microGNN import CSRSampler
 from microGNN.models import GAT, SAGE, ScaleGAT, ScaleSAGE
 
+try:
+    import quiver
+except ImportError:  # CPU hosts sample with CSRSampler
+    quiver = None
+
 models_dict = {'gat': GAT, 'sage': SAGE}
 scale_models_dict = {'sage': ScaleSAGE, 'gat': ScaleGAT}
 
@@ -20,3 +28,40 @@ def get_model(name, params, scale=False):
 
     return Model(params['inputs_channels'], params['hidden_channels'],
                  params['output_channels'], params['num_layers'])
+
+
+def use_quiver(kind="auto"):
+    assert kind in ("auto", "quiver", "csr"), f'Sampler {kind} not supported!'
+    if kind == "auto":
+        return quiver is not None and torch.cuda.is_available()
+    return kind == "quiver"
+
+
+def get_sampler(edge_index, sizes, device=0, kind="auto", num_threads=1):
+    """quiver GPU sampler and feature store, or CSRSampler and the CPU
+    features when quiver or CUDA is missing. Returns the sampler and the
+    csr_topo to pass to get_feature."""
+    if not use_quiver(kind):
+        return CSRSampler(edge_index, sizes, num_threads=num_threads), None
+    csr_topo = quiver.CSRTopo(edge_index)
+    sampler = quiver.pyg.GraphSageSampler(csr_topo,
+                                          sizes=sizes,
+                                          device=device,
+                                          mode="GPU")
+    return sampler, csr_topo
+
+
+def get_feature(x, csr_topo, rank=0, device_list=None, cache_size="4G"):
+    """quiver feature store on GPU rank, or x itself without quiver: the
+    gathered rows stay on CPU, move them to the model device."""
+    if csr_topo is None:
+        return x
+    feature = quiver.Feature(rank=rank,
+                             device_list=device_list or [rank],
+                             device_cache_size=cache_size,
+                             cache_policy="device_replicate",
+                             csr_topo=csr_topo)
+    cpu_feature = torch.zeros(x.shape)
+    cpu_feature[:] = x
+    feature.from_cpu_tensor(cpu_feature)
+    return feature
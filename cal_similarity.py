@@ -1,5 +1,5 @@
 """
-sample : quiver
+sample : quiver, CSRSampler without quiver or GPU
 getmicrobatch : yes
 """
 
@@ -10,9 +10,14 @@ import hydra
 import torch
 from omegaconf import OmegaConf
 
-import quiver
+from microGNN import CSRSampler
 from microGNN.utils import cal_metrics, get_dataset, get_nano_batch_withlayer
 
+try:
+    import quiver
+except ImportError:
+    quiver = None
+
 log = logging.getLogger(__name__)
 
 
@@ -23,11 +28,14 @@ def onebyone(conf):
     print(OmegaConf.to_yaml(conf))
     dataset = get_dataset(dataset_name, conf.root)
     data = dataset[0]
-    csr_topo = quiver.CSRTopo(data.edge_index)
-    quiver_sampler = quiver.pyg.GraphSageSampler(csr_topo,
-                                                 sizes=params.hop,
-                                                 device=0,
-                                                 mode="GPU")
+    if quiver is not None and torch.cuda.is_available():
+        csr_topo = quiver.CSRTopo(data.edge_index)
+        sampler = quiver.pyg.GraphSageSampler(csr_topo,
+                                              sizes=params.hop,
+                                              device=0,
+                                              mode="GPU")
+    else:
+        sampler = CSRSampler(data.edge_index, params.hop)
     gpu_num = params.num_train_worker
     if dataset_name == "ogbn-products" or dataset_name == "papers100M":
         split_idx = dataset.get_idx_split()
@@ -50,8 +58,7 @@ def onebyone(conf):
     minrate = [[] for i in range(layer_num)]
     random = True
     for seeds in train_loader:
-        n_id, batch_size, adjs = quiver_sampler.sample(
-            seeds)  # there is gloabl n_id
+        n_id, batch_size, adjs = sampler.sample(seeds)  # there is gloabl n_id
         nano_batchs = get_nano_batch_withlayer(adjs, n_id, batch_size,
                                                nanobatch_num)
         layernode_num, max_sum_common_nodes, min_sum_common_nodes = (
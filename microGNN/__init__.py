@@ -1,8 +1,18 @@
 __version__ = "0.0.0"
 
-from .history import History  # noqa
+from .history import GlobalHistory, History, HistoryPool, MmapHistory  # noqa
+from .inference import LayerwiseInference  # noqa
+from .sampler import CSRSampler  # noqa
+from .serving import EmbeddingServer, NodePredictor  # noqa
 
 __all__ = [
+    "CSRSampler",
+    "EmbeddingServer",
+    "GlobalHistory",
     "History",
+    "HistoryPool",
+    "LayerwiseInference",
+    "MmapHistory",
+    "NodePredictor",
     "__version__",
 ]
@@ -1,72 +1,302 @@
-from typing import List
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Optional, Union
 
+import numpy as np
 import torch
 from torch import Tensor
 
+from microGNN.utils.common_class import LayerPlan
+
+# quantized storage types and their largest magnitude
+QUANTIZED_DTYPES = {torch.int8: 127}
+
+
+def _read_rows(emb: Tensor, scale: Optional[Tensor], slot: Tensor,
+               dtype: torch.dtype) -> Tensor:
+    # rows of emb as dtype, dequantized when emb is quantized
+    rows = emb.index_select(0, slot)
+    if emb.dtype in QUANTIZED_DTYPES:
+        scale = scale.index_select(0, slot).unsqueeze(1)
+        return (rows.to(scale.dtype) * scale).to(dtype)
+    return rows.to(dtype)
+
+
+def _write_rows(emb: Tensor, scale: Optional[Tensor], slot: Tensor, x: Tensor):
+    # x into the rows of emb, quantized with one scale per row if needed
+    if emb.dtype in QUANTIZED_DTYPES:
+        qmax = QUANTIZED_DTYPES[emb.dtype]
+        x = x.to(scale.dtype)
+        row_scale = x.abs().amax(dim=1) / qmax
+        scale.index_copy_(0, slot, row_scale)
+        x = torch.round(x / row_scale.clamp(min=1e-12).unsqueeze(1))
+        x = x.clamp_(-qmax, qmax)
+    emb.index_copy_(0, slot, x.to(emb.dtype))
+
 
 class History(torch.nn.Module):
-    r"""A historical embedding storage module."""
+    r"""A historical embedding storage module.
+
+    Args:
+        cached_id (Tensor): the nodes whose embedding is stored.
+        num_embeddings (int): number of nodes of the mini batch.
+        embedding_dim (int): embedding size.
+        device: device of the storage.
+        compact (bool): if set to :obj:`True`, index the stored nodes with a
+            sorted :obj:`cached_id` array and :meth:`torch.searchsorted`
+            instead of two :obj:`num_embeddings` sized arrays, so memory
+            is proportional to the cached nodes. The array is int32 when
+            :obj:`num_embeddings` permits. (default: :obj:`False`)
+        growth (float): capacity multiplier when :meth:`reset` needs
+            bigger buffers. (default: :obj:`2.0`)
+        dtype (torch.dtype): storage type of the embeddings,
+            :obj:`torch.float16` and :obj:`torch.bfloat16` are cast,
+            :obj:`torch.int8` is quantized with one float scale per row.
+            Reads return the type of the input. (default: :obj:`torch.float`)
+        async_push (bool): if set to :obj:`True`, the embedding writes of
+            :meth:`push` and :meth:`pull_push` run on a side CUDA stream,
+            or a background thread on CPU, and reads wait for them, see
+            :meth:`synchronize`. Pushed tensors must not be modified in
+            place afterwards. (default: :obj:`False`)
+    """
 
     def __init__(self,
                  cached_id: Tensor,
                  num_embeddings: int,
                  embedding_dim: int,
-                 device=None):
+                 device=None,
+                 compact: bool = False,
+                 growth: float = 2.0,
+                 dtype: torch.dtype = torch.float,
+                 async_push: bool = False):
         super().__init__()
 
-        self.num_embeddings = num_embeddings
+        assert growth >= 1.0, "growth must be at least 1"
+        assert dtype in QUANTIZED_DTYPES or dtype.is_floating_point, (
+            f"unsupported history dtype {dtype}")
         self.embedding_dim = embedding_dim
+        self.compact = compact
+        self.device = device
+        self.growth = growth
+        self.dtype = dtype
+        self._pin_memory = torch.cuda.is_available() and (device is None or
+                                                          str(device) == "cpu")
+        # storage is a view of the first entries of these, see reset
+        self._emb_idx = self._cached_nodes = self._pushed = self._emb = None
+        self._scale = None
+        self._cached_id = None
+        self.async_push = async_push
+        self._stream = None  # side stream of the CUDA writes
+        self._writer = None  # thread of the CPU writes
+        self._pending: List[Future] = []
 
-        pin_memory = device is None or str(device) == "cpu"
-        self.emb_idx = torch.full(
-            (num_embeddings, ),
-            -1,
-            dtype=torch.long,
-            device=device,
-            pin_memory=pin_memory)  # corrsponding index in self.emb
-
-        cached_id = cached_id.to(device)
-        values = torch.arange(len(cached_id), device=device)
-        self.emb_idx.scatter_(0, cached_id, values)
-
-        self.emb = torch.empty(len(cached_id),
-                               embedding_dim,
-                               device=device,
-                               pin_memory=pin_memory)
+        self.reset(cached_id, num_embeddings)
+        self.reset_parameters()
 
-        self.cached_nodes = torch.full(
-            (num_embeddings, ),
-            False,
-            dtype=torch.bool,
-            device=device,
-            pin_memory=pin_memory)  # pushed embedding or not
+    def _fit(self,
+             buf: Tensor,
+             size: int,
+             dtype: torch.dtype,
+             fill=None,
+             dim: int = 0) -> Tensor:
+        # a buffer of at least size rows, new buffers grow geometrically
+        if buf is not None and buf.size(0) >= size:
+            return buf
+        capacity = size
+        if buf is not None:
+            capacity = max(size, int(buf.size(0) * self.growth))
+        shape = (capacity, dim) if dim else (capacity, )
+        buf = torch.empty(shape,
+                          dtype=dtype,
+                          device=self.device,
+                          pin_memory=self._pin_memory)
+        if fill is not None:
+            buf.fill_(fill)
+        return buf
 
-        self.reset_parameters()
+    def reset(self, cached_id: Tensor, num_embeddings: int):
+        r"""Reuses the storage for a new mini batch storing :obj:`cached_id`.
+        Only the entries of the previous cached nodes are cleared, the
+        buffers are reallocated only when too small. The rows of
+        :obj:`self.emb` are not cleared, a row is only read once pushed.
+        Assumes :obj:`self.cached_nodes` was only set by :meth:`push`."""
+        self.synchronize()
+        self.num_embeddings = num_embeddings
+        cached_id = cached_id.to(self.device)
+        if self.compact:
+            dtype = torch.int32 if num_embeddings <= 2**31 else torch.long
+            self.cached_id = torch.unique(cached_id).to(dtype)  # sorted
+            num_slots = len(self.cached_id)
+            self._pushed = self._fit(self._pushed, num_slots, torch.bool,
+                                     False)
+            # pushed embedding or not, per slot
+            self.pushed = self._pushed[:num_slots]
+            self.pushed.fill_(False)
+        else:
+            if self._cached_id is not None:  # sparse reset
+                self._emb_idx.index_fill_(0, self._cached_id, -1)
+                self._cached_nodes.index_fill_(0, self._cached_id, False)
+            self._emb_idx = self._fit(self._emb_idx, num_embeddings,
+                                      torch.long, -1)
+            self._cached_nodes = self._fit(self._cached_nodes, num_embeddings,
+                                           torch.bool, False)
+            # corrsponding index in self.emb
+            self.emb_idx = self._emb_idx[:num_embeddings]
+            values = torch.arange(len(cached_id), device=self.device)
+            self.emb_idx.scatter_(0, cached_id, values)
+            # pushed embedding or not
+            self.cached_nodes = self._cached_nodes[:num_embeddings]
+            self._cached_id = cached_id
+            num_slots = len(cached_id)
+        self._emb = self._fit(self._emb,
+                              num_slots,
+                              self.dtype,
+                              dim=self.embedding_dim)
+        self.emb = self._emb[:num_slots]
+        if self.dtype in QUANTIZED_DTYPES:
+            self._scale = self._fit(self._scale, num_slots, torch.float)
+            self.scale = self._scale[:num_slots]  # dequantized = emb * scale
 
     def reset_parameters(self):
+        self.synchronize()
         self.emb.fill_(0)
-        self.cached_nodes.fill_(False)
+        if self.dtype in QUANTIZED_DTYPES:
+            self.scale.fill_(0)
+        if self.compact:
+            self.pushed.fill_(False)
+        else:
+            self.cached_nodes.fill_(False)
+
+    def lookup(self, node_id: Tensor) -> Tensor:
+        r"""Returns the slot in :obj:`self.emb` of each node, :obj:`-1` for
+        nodes which are not stored."""
+        if not self.compact:
+            return self.emb_idx[node_id]
+        if self.cached_id.numel() == 0:
+            return torch.full_like(node_id, -1, dtype=torch.long)
+        slot = torch.searchsorted(self.cached_id, node_id)
+        slot.clamp_(max=self.cached_id.numel() - 1)
+        return slot.masked_fill_(self.cached_id[slot] != node_id, -1)
+
+    def is_cached(self, node_id: Tensor) -> Tensor:
+        r"""Returns whether an embedding of each node was pushed."""
+        if not self.compact:
+            return self.cached_nodes[node_id]
+        slot = self.lookup(node_id)
+        found = slot >= 0
+        if self.pushed.numel() == 0:
+            return found
+        return found & self.pushed[slot.clamp(min=0)]
+
+    def _read(self, slot: Tensor, dtype: torch.dtype) -> Tensor:
+        self.synchronize()
+        return _read_rows(self.emb, getattr(self, "scale", None), slot, dtype)
+
+    def _write_now(self, slot: Tensor, x: Tensor, rows: Tensor):
+        _write_rows(self.emb, getattr(self, "scale", None), slot,
+                    x.index_select(0, rows))
+
+    def _write(self, slot: Tensor, x: Tensor, rows: Tensor):
+        # writes the rows of x, later on the writer when async_push is set
+        if not self.async_push:
+            self._write_now(slot, x, rows)
+        elif self.emb.is_cuda:
+            if self._stream is None:
+                self._stream = torch.cuda.Stream(self.emb.device)
+            self._stream.wait_stream(torch.cuda.current_stream(
+                self.emb.device))  # x is ready
+            with torch.cuda.stream(self._stream):
+                self._write_now(slot, x, rows)
+            for tensor in (slot, x, rows):  # keep alive for the stream
+                tensor.record_stream(self._stream)
+        else:
+            if self._writer is None:
+                self._writer = ThreadPoolExecutor(max_workers=1)
+            # one worker, so writes land in push order
+            self._pending.append(
+                self._writer.submit(self._write_now, slot, x, rows))
+
+    def synchronize(self):
+        r"""Fence of :obj:`async_push`: the reads after it see every
+        earlier push. On CUDA the current stream waits for the writes
+        without blocking the host."""
+        if self._stream is not None:
+            torch.cuda.current_stream(self.emb.device).wait_stream(
+                self._stream)
+        pending, self._pending = self._pending, []
+        for future in pending:
+            future.result()
 
-    def pull_push(self, x: Tensor, inter_id: Tensor):
-        self.pull(x, inter_id)
-        self.push(x, inter_id)
+    def _mark_pushed(self, node_id: Tensor, slot: Tensor):
+        if self.compact:
+            self.pushed[slot] = True
+        else:
+            self.cached_nodes[node_id] = True
+
+    def pull_push(self,
+                  x: Tensor,
+                  target_id: Tensor,
+                  computed: Optional[Tensor] = None) -> Tensor:
+        r"""Fused :meth:`pull` then :meth:`push`: returns :obj:`x` with the
+        cached rows read from the history, and writes the rows which have a
+        slot back. The slots are looked up once, then one
+        :meth:`index_select` reads the cached rows and one
+        :meth:`index_copy_` writes the rows. With :obj:`computed`, from
+        :meth:`prune_computation_graph`, the rows which are not set are
+        not written, pruning left their embedding incomplete."""
+        slot = self.lookup(target_id)
+        rows = (slot >= 0).nonzero().view(-1)  # only these can be cached
+        slot = slot[rows]
+        node_id = target_id[rows]
+        if self.compact:
+            cached = self.pushed[slot].nonzero().view(-1)
+        else:
+            cached = self.cached_nodes[node_id].nonzero().view(-1)
+        out = x
+        if cached.numel() > 0:
+            # out of place, x may be saved for backward
+            out = x.index_copy(0, rows[cached],
+                               self._read(slot[cached], x.dtype))
+        if computed is not None:
+            push = computed.to(rows.device)[rows].nonzero().view(-1)
+            rows, slot, node_id = rows[push], slot[push], node_id[push]
+        with torch.no_grad():
+            self._write(slot, out.detach(), rows)
+            self._mark_pushed(node_id, slot)
+        return out
+
+    def pull_push_plan(self, x: Tensor, plan: LayerPlan,
+                       n_id: Tensor) -> Tensor:
+        r"""The :meth:`pull_push` of one layer of a :class:`PrunedPlan`,
+        whose rows and slots are precomputed: one :meth:`index_copy` reads
+        the pulled rows and one :meth:`index_copy_` writes the pushed rows,
+        :obj:`n_id` are the nodes of the nano batch."""
+        out = x
+        if plan.pull_rows.numel() > 0:
+            # out of place, x may be saved for backward
+            out = x.index_copy(0, plan.pull_rows,
+                               self._read(plan.pull_slots, x.dtype))
+        with torch.no_grad():
+            self._write(plan.push_slots, out.detach(), plan.push_rows)
+            self._mark_pushed(n_id[plan.push_rows], plan.push_slots)
+        return out
 
     def pull(self, x: Tensor, target_id: Tensor) -> Tensor:
-        is_cached = self.cached_nodes[target_id]
+        is_cached = self.is_cached(target_id)
         cached_id = target_id[is_cached]  # bottleneck
-        emb_indices = self.emb_idx[cached_id]
-        embeddings = self.emb[emb_indices]
+        emb_indices = self.lookup(cached_id)
+        embeddings = self._read(emb_indices, x.dtype)
         out = x.clone()
         out[is_cached] = embeddings
         return out
 
     @torch.no_grad()
     def push(self, x: Tensor, target_id: Tensor) -> Tensor:
-        should_cache = (self.emb_idx[target_id] != -1)
+        slot = self.lookup(target_id)
+        should_cache = (slot != -1)
         tocacheid = target_id[should_cache]
-        emb_indices = self.emb_idx[tocacheid]
-        self.emb[emb_indices] = x[should_cache]
-        self.cached_nodes[tocacheid] = True
+        emb_indices = slot[should_cache]
+        self._write(emb_indices, x.detach(), should_cache.nonzero().view(-1))
+        self._mark_pushed(tocacheid, emb_indices)
 
     def forward(self, *args, **kwargs):
         """"""
@@ -75,5 +305,420 @@ class History(torch.nn.Module):
     def __repr__(self) -> str:
         return (f"{self.__class__.__name__}({self.num_embeddings}, "
                 f"{self.embedding_dim}, emb_device={self.emb.device}, "
-                f"device={self._device})"
+                f"device={self.device})"
                 f"{self.emb}")
+
+
+class HistoryPool(torch.nn.ModuleList):
+    r"""One :class:`History` per hidden layer, kept across mini batches:
+    :meth:`reset` reuses the buffers of the previous mini batch instead of
+    building a new :class:`torch.nn.ModuleList` of :class:`History`.
+
+    Args:
+        num_histories (int): number of histories, one per hidden layer.
+        embedding_dim (int): embedding size.
+        device: device of the storage.
+        compact (bool): see :class:`History`. (default: :obj:`False`)
+        growth (float): see :class:`History`. (default: :obj:`2.0`)
+        dtype (torch.dtype): see :class:`History`.
+            (default: :obj:`torch.float`)
+        async_push (bool): see :class:`History`. (default: :obj:`False`)
+    """
+
+    def __init__(self,
+                 num_histories: int,
+                 embedding_dim: int,
+                 device=None,
+                 compact: bool = False,
+                 growth: float = 2.0,
+                 dtype: torch.dtype = torch.float,
+                 async_push: bool = False):
+        super().__init__([
+            History(torch.empty(0, dtype=torch.long), 0, embedding_dim, device,
+                    compact, growth, dtype, async_push)
+            for _ in range(num_histories)
+        ])
+
+    def reset(self, cached_id: List[Tensor],
+              num_embeddings: int) -> "HistoryPool":
+        r"""Resets every history for a new mini batch, :obj:`cached_id` as
+        returned by :meth:`get_nano_batch_histories`."""
+        assert len(cached_id) == len(self), "one cached_id per history"
+        for history, ids in zip(self, cached_id):
+            history.reset(ids, num_embeddings)
+        return self
+
+
+class GlobalHistory(torch.nn.Module):
+    r"""A graph level historical embedding storage, keyed by global node id
+    and kept across mini batches as in GNNAutoScale. An embedding pushed
+    at step :obj:`s` is read back until step :obj:`s + max_staleness`, call
+    :meth:`tick` once per mini batch. With :obj:`max_staleness=0` the
+    embeddings are only reused between the nano batches of a mini batch.
+    When the store is full, the least recently (:obj:`"lru"`) or least
+    frequently (:obj:`"lfu"`) read embeddings are evicted, expired ones
+    first. :obj:`hits` and :obj:`misses` count the rows read.
+
+    Args:
+        num_nodes (int): number of nodes of the graph.
+        embedding_dim (int): embedding size.
+        max_staleness (int): steps an embedding stays valid.
+            (default: :obj:`0`)
+        memory_budget (int, optional): bytes of the stored embeddings,
+            all nodes fit if not set. (default: :obj:`None`)
+        policy (str): :obj:`"lru"` or :obj:`"lfu"`. (default: :obj:`"lru"`)
+        device: device of the storage.
+        dtype (torch.dtype): see :class:`History`.
+            (default: :obj:`torch.float`)
+    """
+
+    def __init__(self,
+                 num_nodes: int,
+                 embedding_dim: int,
+                 max_staleness: int = 0,
+                 memory_budget: Optional[int] = None,
+                 policy: str = "lru",
+                 device=None,
+                 dtype: torch.dtype = torch.float):
+        super().__init__()
+        assert policy in ("lru", "lfu"), f"unknown policy {policy}"
+        assert max_staleness >= 0, "max_staleness must be non negative"
+        self.num_nodes = num_nodes
+        self.embedding_dim = embedding_dim
+        self.max_staleness = max_staleness
+        self.policy = policy
+        self.device = device
+        self.dtype = dtype
+
+        row_bytes = embedding_dim * torch.empty((), dtype=dtype).element_size()
+        if dtype in QUANTIZED_DTYPES:
+            row_bytes += 4  # float scale
+        self.capacity = num_nodes
+        if memory_budget is not None:
+            self.capacity = min(num_nodes, int(memory_budget // row_bytes))
+
+        def full(size, fill):
+            return torch.full((size, ), fill, dtype=torch.long, device=device)
+
+        self.emb_idx = full(num_nodes, -1)  # slot of each node
+        self.slot_node = full(self.capacity, -1)  # node of each slot
+        self.written = full(self.capacity, 0)  # step of the push
+        self.last_used = full(self.capacity, 0)  # step of the last read
+        self.freq = full(self.capacity, 0)  # reads since the push
+        self.emb = torch.empty(self.capacity,
+                               embedding_dim,
+                               dtype=dtype,
+                               device=device)
+        self.scale = None
+        if dtype in QUANTIZED_DTYPES:
+            self.scale = torch.empty(self.capacity, device=device)
+        self.reset_parameters()
+
+    def reset_parameters(self):
+        self.emb_idx.fill_(-1)
+        self.slot_node.fill_(-1)
+        self.emb.fill_(0)
+        self.num_used = 0  # slots [0, num_used) hold a node
+        self.step = 0
+        self.hits = self.misses = 0
+
+    def tick(self):
+        r"""Starts the next step, usually the next mini batch."""
+        self.step += 1
+
+    def lookup(self, node_id: Tensor) -> Tensor:
+        r"""Returns the slot in :obj:`self.emb` of each node, :obj:`-1` for
+        nodes which are not stored or expired."""
+        slot = self.emb_idx[node_id]
+        if self.capacity == 0:
+            return slot
+        expired = self.written[slot.clamp(min=0)] < (self.step -
+                                                     self.max_staleness)
+        return slot.masked_fill_(expired, -1)
+
+    def is_cached(self, node_id: Tensor) -> Tensor:
+        return self.lookup(node_id) >= 0
+
+    def _touch(self, slot: Tensor):
+        self.last_used[slot] = self.step
+        self.freq[slot] += 1
+
+    def _evict(self, num_slots: int, keep: Tensor) -> Tensor:
+        # never used slots first, then expired ones, then by policy; keep
+        # stays. The policy only runs once the store is full.
+        num_used = self.num_used
+        num_free = min(num_slots, self.capacity - num_used)
+        slot = torch.arange(num_used, num_used + num_free, device=keep.device)
+        self.num_used += num_free
+        num_slots = min(num_slots - num_free, num_used - keep.numel())
+        if num_slots <= 0:
+            return slot
+        key = self.last_used[:num_used].clone()
+        if self.policy == "lfu":  # ties go to the least recent
+            key += self.freq[:num_used] * (self.step + 1)
+        key[self.written[:num_used] < self.step - self.max_staleness] = -1
+        key[keep] = torch.iinfo(key.dtype).max
+        evicted = torch.topk(key, num_slots, largest=False, sorted=False)[1]
+        self.emb_idx[self.slot_node[evicted]] = -1
+        return torch.cat([slot, evicted])
+
+    @torch.no_grad()
+    def push(self, x: Tensor, node_id: Tensor):
+        r"""Stores the embeddings :obj:`x` of the unique nodes
+        :obj:`node_id` at the current step, evicting if needed."""
+        if self.capacity == 0 or node_id.numel() == 0:
+            return
+        slot = self.emb_idx[node_id]
+        stored = slot >= 0
+        new = (~stored).nonzero().view(-1)
+        if new.numel() > 0:
+            new_slot = self._evict(new.numel(), slot[stored])
+            # without room the remaining nodes are not stored
+            rows = torch.cat([stored.nonzero().view(-1), new[:len(new_slot)]])
+            slot[new[:len(new_slot)]] = new_slot
+            node_id, slot, x = node_id[rows], slot[rows], x[rows]
+            self.freq[new_slot] = 0
+        self.emb_idx[node_id] = slot
+        self.slot_node[slot] = node_id
+        self.written[slot] = self.step
+        self.last_used[slot] = self.step
+        _write_rows(self.emb, self.scale, slot, x)
+
+    def pull(self, x: Tensor, node_id: Tensor) -> Tensor:
+        r"""Returns :obj:`x` with the rows of the stored nodes replaced."""
+        return self._pull(x, node_id)[0]
+
+    def _pull(self, x: Tensor, node_id: Tensor):
+        slot = self.lookup(node_id)
+        hit = slot >= 0
+        rows = hit.nonzero().view(-1)
+        self.hits += rows.numel()
+        self.misses += node_id.numel() - rows.numel()
+        if rows.numel() == 0:
+            return x, hit
+        self._touch(slot[rows])
+        # out of place, x may be saved for backward
+        return x.index_copy(
+            0, rows, _read_rows(self.emb, self.scale, slot[rows],
+                                x.dtype)), hit
+
+    def pull_push(self,
+                  x: Tensor,
+                  node_id: Tensor,
+                  computed: Optional[Tensor] = None) -> Tensor:
+        r"""Fused :meth:`pull` then :meth:`push` of the rows which were not
+        stored: reused embeddings keep their push step, so they expire.
+        With :obj:`computed`, see :meth:`History.pull_push`, only the
+        computed rows are pushed."""
+        out, hit = self._pull(x, node_id)
+        push = ~hit
+        if computed is not None:
+            push &= computed.to(push.device)
+        push = push.nonzero().view(-1)
+        self.push(out.detach().index_select(0, push), node_id[push])
+        return out
+
+    def bind(self, n_id: Tensor) -> "BoundHistory":
+        r"""Returns a view taking the mini batch local ids of :obj:`n_id`,
+        to pass to :class:`ScaleSAGE` and :class:`ScaleGAT` as a history."""
+        return BoundHistory(self, n_id)
+
+    def forward(self, *args, **kwargs):
+        """"""
+        raise NotImplementedError  # history is not model, only use for storage
+
+    def __repr__(self) -> str:
+        return (f"{self.__class__.__name__}({self.num_nodes}, "
+                f"{self.embedding_dim}, capacity={self.capacity}, "
+                f"max_staleness={self.max_staleness}, policy={self.policy}, "
+                f"hits={self.hits}, misses={self.misses})")
+
+
+class BoundHistory:
+    r"""A :class:`GlobalHistory` seen through the global ids :obj:`n_id`
+    of one mini batch, with the interface of :class:`History`."""
+
+    def __init__(self, history: Union["GlobalHistory", "MmapHistory"],
+                 n_id: Tensor):
+        self.history = history
+        self.n_id = n_id.to(history.device)
+
+    def _global_id(self, node_id: Tensor) -> Tensor:
+        return self.n_id[node_id.to(self.n_id.device)]
+
+    def is_cached(self, node_id: Tensor) -> Tensor:
+        return self.history.is_cached(self._global_id(node_id)).to(
+            node_id.device)
+
+    def pull(self, x: Tensor, target_id: Tensor) -> Tensor:
+        return self.history.pull(x, self._global_id(target_id))
+
+    def push(self, x: Tensor, target_id: Tensor):
+        self.history.push(x, self._global_id(target_id))
+
+    def pull_push(self,
+                  x: Tensor,
+                  target_id: Tensor,
+                  computed: Optional[Tensor] = None) -> Tensor:
+        return self.history.pull_push(x, self._global_id(target_id), computed)
+
+
+class MmapHistory(torch.nn.Module):
+    r"""A graph level history like :class:`GlobalHistory` whose embeddings
+    live in a file mapped with :class:`numpy.memmap`, for graphs whose
+    histories do not fit in memory. Row :obj:`i` of the file is node
+    :obj:`i`, only the push step of each node (int32) stays in memory.
+    Pushes go to an in memory write-back buffer of :obj:`buffer_size` rows
+    which is written in ascending node order when full or on :meth:`flush`,
+    reads are sorted by node as well, so the file is accessed sequentially.
+    Nothing is evicted, embeddings expire after :obj:`max_staleness` steps.
+
+    Args:
+        num_nodes (int): number of nodes of the graph.
+        embedding_dim (int): embedding size.
+        path (str): file of the embeddings, created or overwritten.
+        max_staleness (int): steps an embedding stays valid, see
+            :class:`GlobalHistory`. (default: :obj:`0`)
+        buffer_size (int): rows of the write-back buffer.
+            (default: :obj:`65536`)
+        dtype (torch.dtype): :obj:`torch.float` or :obj:`torch.float16`.
+            (default: :obj:`torch.float`)
+    """
+
+    def __init__(self,
+                 num_nodes: int,
+                 embedding_dim: int,
+                 path: str,
+                 max_staleness: int = 0,
+                 buffer_size: int = 65536,
+                 dtype: torch.dtype = torch.float):
+        super().__init__()
+        assert dtype in (torch.float,
+                         torch.float16), (f"unsupported history dtype {dtype}")
+        assert buffer_size > 0, "buffer_size must be positive"
+        assert max_staleness >= 0, "max_staleness must be non negative"
+        self.num_nodes = num_nodes
+        self.embedding_dim = embedding_dim
+        self.path = path
+        self.max_staleness = max_staleness
+        self.buffer_size = buffer_size
+        self.device = torch.device("cpu")
+
+        np_dtype = np.float32 if dtype == torch.float else np.float16
+        self._memmap = np.memmap(path,
+                                 dtype=np_dtype,
+                                 mode="w+",
+                                 shape=(num_nodes, embedding_dim))
+        self.emb = torch.from_numpy(self._memmap)  # shares the mapping
+        self.written = torch.full((num_nodes, ), -1, dtype=torch.int32)
+        self._buf_emb = torch.empty(buffer_size, embedding_dim, dtype=dtype)
+        self._buf_node = torch.empty(buffer_size, dtype=torch.long)
+        self._buf_len = 0
+        self._buf_index = None  # see _buffered
+        self.step = 0
+        self.hits = self.misses = 0
+
+    def tick(self):
+        r"""Starts the next step, usually the next mini batch."""
+        self.step += 1
+
+    def is_cached(self, node_id: Tensor) -> Tensor:
+        written = self.written[node_id.cpu()]
+        return (written >= 0) & (written >= self.step - self.max_staleness)
+
+    def _buffered(self):
+        # sorted unique nodes of the buffer and the row of their last push
+        if self._buf_index is None:
+            node = self._buf_node[:self._buf_len]
+            node, order = torch.sort(node, stable=True)
+            node, counts = torch.unique_consecutive(node, return_counts=True)
+            self._buf_index = (node, order[torch.cumsum(counts, 0) - 1])
+        return self._buf_index
+
+    def _read(self, node_id: Tensor) -> Tensor:
+        out = torch.empty(len(node_id),
+                          self.embedding_dim,
+                          dtype=self.emb.dtype)
+        node, row = self._buffered()
+        in_buf = torch.zeros(len(node_id), dtype=torch.bool)
+        if node.numel() > 0:
+            pos = torch.searchsorted(node, node_id)
+            pos.clamp_(max=node.numel() - 1)
+            in_buf = node[pos] == node_id
+            out[in_buf] = self._buf_emb[row[pos[in_buf]]]
+        disk = (~in_buf).nonzero().view(-1)
+        if disk.numel() > 0:
+            disk = disk[torch.argsort(node_id[disk])]  # ascending offsets
+            out[disk] = self.emb.index_select(0, node_id[disk])
+        return out
+
+    def flush(self):
+        r"""Writes the buffered embeddings to the file mapping."""
+        if self._buf_len == 0:
+            return
+        node, row = self._buffered()
+        self.emb.index_copy_(0, node, self._buf_emb[row])
+        self._buf_len = 0
+        self._buf_index = None
+
+    @torch.no_grad()
+    def push(self, x: Tensor, node_id: Tensor):
+        r"""Stores the embeddings :obj:`x` of the nodes :obj:`node_id` at
+        the current step."""
+        node_id = node_id.cpu()
+        x = x.detach().cpu()
+        self.written[node_id] = self.step
+        start = 0
+        while start < len(node_id):
+            num = min(self.buffer_size - self._buf_len, len(node_id) - start)
+            end = self._buf_len + num
+            self._buf_node[self._buf_len:end] = node_id[start:start + num]
+            self._buf_emb[self._buf_len:end] = x[start:start + num]
+            self._buf_len, self._buf_index = end, None
+            start += num
+            if self._buf_len == self.buffer_size:
+                self.flush()
+
+    def _pull(self, x: Tensor, node_id: Tensor):
+        hit = self.is_cached(node_id).to(x.device)
+        rows = hit.nonzero().view(-1)
+        self.hits += rows.numel()
+        self.misses += node_id.numel() - rows.numel()
+        if rows.numel() == 0:
+            return x, hit
+        emb = self._read(node_id.cpu()[rows.cpu()])
+        # out of place, x may be saved for backward
+        return x.index_copy(0, rows, emb.to(x.device, x.dtype)), hit
+
+    def pull(self, x: Tensor, node_id: Tensor) -> Tensor:
+        r"""Returns :obj:`x` with the rows of the stored nodes replaced."""
+        return self._pull(x, node_id)[0]
+
+    def pull_push(self,
+                  x: Tensor,
+                  node_id: Tensor,
+                  computed: Optional[Tensor] = None) -> Tensor:
+        r"""See :meth:`GlobalHistory.pull_push`. With :obj:`computed`, from
+        :meth:`prune_computation_graph`, only the computed rows are pushed,
+        pruning left the others incomplete."""
+        out, hit = self._pull(x, node_id)
+        push = ~hit
+        if computed is not None:
+            push &= computed.to(push.device)
+        push = push.nonzero().view(-1)
+        self.push(out.detach().index_select(0, push), node_id[push])
+        return out
+
+    def bind(self, n_id: Tensor) -> "BoundHistory":
+        r"""See :meth:`GlobalHistory.bind`."""
+        return BoundHistory(self, n_id)
+
+    def forward(self, *args, **kwargs):
+        """"""
+        raise NotImplementedError  # history is not model, only use for storage
+
+    def __repr__(self) -> str:
+        return (f"{self.__class__.__name__}({self.num_nodes}, "
+                f"{self.embedding_dim}, path={self.path}, "
+                f"max_staleness={self.max_staleness}, "
+                f"buffered={self._buf_len}/{self.buffer_size})")
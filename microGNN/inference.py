@@ -0,0 +1,241 @@
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+import numpy as np
+import torch
+from torch import Tensor
+from torch_geometric.utils.num_nodes import maybe_num_nodes
+
+from microGNN.utils.get_nano_batch import to_csr
+
+Chunk = Tuple[Tensor, Tensor, Tuple[int, int]]
+
+
+def _digest(*tensors: Tensor) -> bytes:
+    h = hashlib.sha1()
+    for t in tensors:
+        h.update(str((t.dtype, tuple(t.shape))).encode())
+        h.update(t.detach().contiguous().cpu().view(-1).view(
+            torch.uint8).numpy())
+    return h.digest()
+
+
+def layer_state(model: torch.nn.Module, i: int) -> List[Tensor]:
+    r"""The parameters and buffers of layer :obj:`i` of :obj:`model`, the
+    entries :obj:`i` of its :class:`torch.nn.ModuleList` (:obj:`convs`,
+    :obj:`skips`) as in :obj:`microGNN.models`."""
+    return [
+        t for name, t in sorted(model.state_dict().items())
+        if name.split(".")[1:2] == [str(i)]
+    ]
+
+
+class LayerwiseInference:
+    r"""Full graph inference computing the model layer by layer, every
+    layer on all the nodes, in chunks of :obj:`chunk_size` target nodes.
+    The graph is grouped into CSR once, and the bipartite graph of each
+    chunk (the chunk targets first, then their unique neighbors) is built
+    once and reused by every layer. Each layer writes its chunks into one
+    preallocated output, kept in memory or in a :class:`numpy.memmap` file
+    of :obj:`out_dir` for graphs whose embeddings do not fit, in place of
+    a list of chunk outputs concatenated at the end.
+
+    The model computes layer :obj:`i` of a chunk with
+    :obj:`model.inference_layer(i, x, edge_index, size)`, :obj:`x` holding
+    the chunk inputs with the targets first, as in :meth:`forward`.
+
+    Args:
+        edge_index (LongTensor): edges of the graph.
+        num_nodes (int, optional): number of nodes of the graph.
+            (default: :obj:`None`)
+        chunk_size (int): target nodes per chunk. (default: :obj:`65536`)
+        num_threads (int): chunks computed concurrently on a pool of
+            threads when computing on CPU. (default: :obj:`1`)
+        out_dir (str, optional): directory of the memory mapped outputs,
+            :obj:`layer{i}.bin` for layer :obj:`i`, overwritten.
+            (default: :obj:`None`)
+        cache_dir (str, optional): directory caching the outputs of the
+            layers below :obj:`cache_layers` as :obj:`.npy` files, keyed by a
+            hash of the graph, the input and the parameters of the layers up
+            to it. :meth:`run` starts after the deepest cached layer, so
+            re-evaluating a model whose lower layers did not change only
+            computes the changed ones. (default: :obj:`None`)
+        cache_layers (int, optional): number of lower layers cached.
+            Defaults to every layer but the last one.
+    """
+
+    def __init__(self,
+                 edge_index: Tensor,
+                 num_nodes: Optional[int] = None,
+                 chunk_size: int = 65536,
+                 num_threads: int = 1,
+                 out_dir: Optional[str] = None,
+                 cache_dir: Optional[str] = None,
+                 cache_layers: Optional[int] = None):
+        assert chunk_size > 0, "chunk_size must be positive"
+        self.num_nodes = maybe_num_nodes(edge_index, num_nodes)
+        self.chunk_size = chunk_size
+        self.num_threads = num_threads
+        self.out_dir = out_dir
+        self.csr = to_csr(edge_index.cpu(), self.num_nodes)
+        self._chunks: Optional[List[Chunk]] = None
+        self._memmap: Optional[np.memmap] = None
+        self.cache_dir = cache_dir
+        self.cache_layers = cache_layers
+        self._graph_digest: Optional[bytes] = None
+        self.cache_hits = self.cache_misses = 0
+
+    @property
+    def chunks(self) -> List[Chunk]:
+        r"""The :obj:`(n_id, edge_index, size)` of every chunk, built on
+        first use."""
+        if self._chunks is None:
+            self._chunks = [
+                self._chunk(start, min(start + self.chunk_size,
+                                       self.num_nodes))
+                for start in range(0, self.num_nodes, self.chunk_size)
+            ]
+        return self._chunks
+
+    def _chunk(self, start: int, end: int) -> Chunk:
+        rowptr = self.csr.rowptr
+        sources = self.csr.col[int(rowptr[start]):int(rowptr[end])]
+        # neighbors inside the chunk read the target rows, the others are
+        # relabeled after them
+        inside = (sources >= start) & (sources < end)
+        neighbors, inverse = torch.unique(sources[~inside],
+                                          return_inverse=True)
+        local = sources - start
+        local[~inside] = inverse + (end - start)
+        n_id = torch.cat((torch.arange(start, end), neighbors))
+        deg = rowptr[start + 1:end + 1] - rowptr[start:end]
+        target = torch.repeat_interleave(torch.arange(end - start), deg)
+        return n_id, torch.stack((local, target)), (n_id.size(0), end - start)
+
+    def _output(self, layer: int, embedding_dim: int,
+                dtype: torch.dtype) -> Tensor:
+        shape = (self.num_nodes, embedding_dim)
+        if self.out_dir is None:
+            return torch.empty(shape, dtype=dtype)
+        assert dtype in (torch.float,
+                         torch.float16), (f"unsupported output dtype {dtype}")
+        os.makedirs(self.out_dir, exist_ok=True)
+        self._memmap = np.memmap(
+            os.path.join(self.out_dir, f"layer{layer}.bin"),
+            dtype=np.float32 if dtype == torch.float else np.float16,
+            mode="w+",
+            shape=shape)
+        return torch.from_numpy(self._memmap)  # shares the mapping
+
+    @torch.no_grad()
+    def layer(self,
+              model: torch.nn.Module,
+              i: int,
+              x: Tensor,
+              device: Optional[torch.device] = None) -> Tensor:
+        r"""Computes layer :obj:`i` of :obj:`model` on every node.
+
+        Args:
+            model (torch.nn.Module): model with :meth:`inference_layer`.
+            i (int): layer to compute.
+            x (Tensor): input of the layer for every node.
+            device (torch.device, optional): device the chunks are
+                computed on. Defaults to the device of :obj:`x`.
+        """
+        device = x.device if device is None else torch.device(device)
+
+        @torch.no_grad()  # grad mode is per thread
+        def compute(chunk: Chunk) -> Tensor:
+            n_id, edge_index, size = chunk
+            return model.inference_layer(i, x[n_id.to(x.device)].to(device),
+                                         edge_index.to(device), size)
+
+        chunks = self.chunks
+        first = compute(chunks[0])  # the output shape is known from here
+        out = self._output(i, first.size(1), first.dtype)
+        out[:chunks[0][2][1]] = first
+
+        def write(start: int, chunk: Chunk):
+            out[start:start + chunk[2][1]] = compute(chunk)
+
+        starts = range(self.chunk_size, self.num_nodes, self.chunk_size)
+        if device.type == "cpu" and self.num_threads > 1:
+            with ThreadPoolExecutor(max_workers=self.num_threads) as pool:
+                list(pool.map(write, starts, chunks[1:]))
+        else:
+            for start, chunk in zip(starts, chunks[1:]):
+                write(start, chunk)
+        if self._memmap is not None:
+            self._memmap.flush()
+            self._memmap = None
+        return out
+
+    @torch.no_grad()
+    def run(self,
+            model: torch.nn.Module,
+            x: Tensor,
+            device: Optional[torch.device] = None,
+            start: int = 0,
+            end: Optional[int] = None) -> Tensor:
+        r"""Computes layers :obj:`start` to :obj:`end - 1` of :obj:`model`
+        on every node and returns the output of the last one, on CPU.
+        Dropout follows :obj:`model.training`, call :meth:`eval` first.
+
+        Args:
+            model (torch.nn.Module): model with :meth:`inference_layer`.
+            x (Tensor): input of layer :obj:`start` for every node.
+            device (torch.device, optional): device the chunks are
+                computed on. Defaults to the device of :obj:`x`, the
+                outputs stay on CPU.
+            start (int): first layer. (default: :obj:`0`)
+            end (int, optional): layer to stop before. Defaults to
+                :obj:`model.num_layers`.
+        """
+        end = model.num_layers if end is None else end
+        device = x.device if device is None else device
+        assert 0 <= start <= end <= model.num_layers, "invalid layer range"
+        keys = self._cache_keys(model, x, start, end)
+        for i in reversed(range(len(keys))):  # the deepest cached layer
+            path = self._cache_path(keys[i])
+            if os.path.exists(path):
+                self.cache_hits += 1
+                x = torch.from_numpy(np.load(path, mmap_mode="c"))
+                start += i + 1
+                keys = keys[i + 1:]
+                break
+        for i in range(start, end):
+            x = self.layer(model, i, x, device)
+            if i - start < len(keys):
+                self.cache_misses += 1
+                self._save(keys[i - start], x)
+        return x
+
+    def _cache_keys(self, model: torch.nn.Module, x: Tensor, start: int,
+                    end: int) -> List[str]:
+        # keys of the outputs of the cached layers from start
+        if self.cache_dir is None:
+            return []
+        num_cached = model.num_layers - 1 if self.cache_layers is None else (
+            self.cache_layers)
+        if self._graph_digest is None:
+            self._graph_digest = _digest(self.csr.rowptr, self.csr.col)
+        h = hashlib.sha1(self._graph_digest)
+        h.update(_digest(x))
+        h.update(f"{type(model).__name__}:{start}".encode())
+        keys = []
+        for i in range(start, min(end, num_cached)):
+            h.update(_digest(*layer_state(model, i)))
+            keys.append(h.hexdigest())
+        return keys
+
+    def _cache_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.npy")
+
+    def _save(self, key: str, x: Tensor):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._cache_path(key)
+        with open(path + ".tmp", "wb") as f:  # no partial file on failure
+            np.save(f, x.numpy())
+        os.replace(path + ".tmp", path)
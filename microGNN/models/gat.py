@@ -1,4 +1,4 @@
-from typing import List
+from typing import List, Optional
 
 import torch
 import torch.nn.functional as F
@@ -8,6 +8,7 @@ from torch_geometric.nn import GATConv
 
 from microGNN import History
 from microGNN.prune import prune_computation_graph
+from microGNN.utils.common_class import PrunedPlan
 
 
 class GAT(torch.nn.Module):
@@ -51,6 +52,16 @@ class GAT(torch.nn.Module):
                 x = F.dropout(x, p=0.5, training=self.training)
         return x.log_softmax(dim=-1)
 
+    def inference_layer(self, i: int, x: Tensor, edge_index: Tensor,
+                        size) -> Tensor:
+        r"""Layer :obj:`i` on a chunk, for :class:`LayerwiseInference`."""
+        x_target = x[:size[1]]
+        x = self.convs[i]((x, x_target), edge_index)
+        x = x + self.skips[i](x_target)
+        if i != self.num_layers - 1:
+            x = F.elu(x)
+        return x
+
     def inference(self, x_all, device, subgraph_loader):
 
         # Compute representations of nodes layer by layer, using *all*
@@ -106,22 +117,43 @@ class ScaleGAT(torch.nn.Module):
         for skip in self.skips:
             skip.reset_parameters()
 
-    def forward(self, x: Tensor, n_id: Tensor, adjs: List,
-                histories: torch.nn.ModuleList):
-        pruned_adjs = prune_computation_graph(n_id, adjs, histories)  # 12%用时
+    def forward(self,
+                x: Tensor,
+                n_id: Tensor,
+                adjs: List,
+                histories: torch.nn.ModuleList,
+                plan: Optional[PrunedPlan] = None):
+        r"""See :meth:`ScaleSAGE.forward`."""
+        if plan is None:
+            pruned_adjs, computed = prune_computation_graph(
+                n_id, adjs, histories, return_computed=True)
+        else:
+            pruned_adjs = plan.layers
         for i, adj in enumerate(pruned_adjs):
-            batch_size = adjs[i].size[1]  # original batch size
+            batch_size = adj.size[1]  # original batch size
             x_target = x[:batch_size]  # Target nodes are always placed first.
             x = self.convs[i]((x, x_target), adj.edge_index)
             x = x + self.skips[i](x_target)
             if i != self.num_layers - 1:
                 x = F.elu(x)
                 history: History = histories[i]
-                x = history.pull(x, n_id[:batch_size])
-                history.push(x, n_id[:batch_size])
+                if plan is None:
+                    x = history.pull_push(x, n_id[:batch_size], computed[i])
+                else:
+                    x = history.pull_push_plan(x, adj, n_id)
                 x = F.dropout(x, p=0.5, training=self.training)
         return x.log_softmax(dim=-1)
 
+    def inference_layer(self, i: int, x: Tensor, edge_index: Tensor,
+                        size) -> Tensor:
+        r"""Layer :obj:`i` on a chunk, for :class:`LayerwiseInference`."""
+        x_target = x[:size[1]]
+        x = self.convs[i]((x, x_target), edge_index)
+        x = x + self.skips[i](x_target)
+        if i != self.num_layers - 1:
+            x = F.elu(x)
+        return x
+
     def inference(self, x_all, device, subgraph_loader):
 
         # Compute representations of nodes layer by layer, using *all*
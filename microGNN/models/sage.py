@@ -7,6 +7,7 @@ from torch_geometric.nn import SAGEConv
 
 from microGNN import History
 from microGNN.prune import prune_computation_graph
+from microGNN.utils.common_class import PrunedPlan
 
 
 # use for quiver sampler
@@ -35,6 +36,14 @@ class SAGE(torch.nn.Module):
                 # x = F.dropout(x, p=0.5, training=self.training)
         return x.log_softmax(dim=-1)
 
+    def inference_layer(self, i: int, x: Tensor, edge_index: Tensor,
+                        size) -> Tensor:
+        r"""Layer :obj:`i` on a chunk, for :class:`LayerwiseInference`."""
+        x = self.convs[i]((x, x[:size[1]]), edge_index)
+        if i != self.num_layers - 1:
+            x = F.relu(x)
+        return x
+
     @torch.no_grad()
     def inference(self, x_all, device, subgraph_loader):
         for i in range(self.num_layers):
@@ -80,22 +89,43 @@ class ScaleSAGE(torch.nn.Module):
             conv.reset_parameters()
 
     # history [0] is outer hop, [1] inner hop, [-1] is 1hop
-    def forward(self, x: Tensor, n_id: Tensor, adjs: List,
-                histories: torch.nn.ModuleList) -> Tensor:
-        pruned_adjs = prune_computation_graph(n_id, adjs, histories)
+    def forward(self,
+                x: Tensor,
+                n_id: Tensor,
+                adjs: List,
+                histories: torch.nn.ModuleList,
+                plan: Optional[PrunedPlan] = None) -> Tensor:
+        r"""With a :class:`PrunedPlan` of the nano batch, from
+        :meth:`get_nano_batch_histories`, :obj:`adjs` is not used and the
+        pass does no graph work."""
+        if plan is None:
+            pruned_adjs, computed = prune_computation_graph(
+                n_id, adjs, histories, return_computed=True)
+        else:
+            pruned_adjs = plan.layers
         for i, adj in enumerate(pruned_adjs):
-            batch_size = adjs[i].size[1]  # original batch size
+            batch_size = adj.size[1]  # original batch size
             x_target = x[:batch_size]  # nano batch layer nodes
             x = self.convs[i]((x, x_target),
                               adj.edge_index)  # non cached nodes embedding
             if i != self.num_layers - 1:  # last layer is not saved
                 x = F.relu(x)
                 history: History = histories[i]
-                x = history.pull(x, n_id[:batch_size])
-                history.push(x, n_id[:batch_size])
+                if plan is None:
+                    x = history.pull_push(x, n_id[:batch_size], computed[i])
+                else:
+                    x = history.pull_push_plan(x, adj, n_id)
                 # x = F.dropout(x, p=0.5, training=self.training)
         return x.log_softmax(dim=-1)
 
+    def inference_layer(self, i: int, x: Tensor, edge_index: Tensor,
+                        size) -> Tensor:
+        r"""Layer :obj:`i` on a chunk, for :class:`LayerwiseInference`."""
+        x = self.convs[i]((x, x[:size[1]]), edge_index)
+        if i != self.num_layers - 1:
+            x = F.relu(x)
+        return x
+
     @torch.no_grad()
     def inference(self, x_all, device, subgraph_loader):
         for i in range(self.num_layers):
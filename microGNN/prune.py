@@ -1,28 +1,48 @@
-import copy
 from typing import List
 
 import torch
 from torch import Tensor
 
-from microGNN.utils import slice_adj
 from microGNN.utils.common_class import Adj
+from microGNN.utils.plan import _needed_sources
 
 
-def prune_computation_graph(n_id: Tensor, nb_adjs: List,
-                            histories: torch.nn.ModuleList) -> List[Adj]:
-    adjs = copy.deepcopy(nb_adjs)
-    adjs.reverse()
-    pruned_adjs = [adjs[0]]
-    layernode = n_id[:adjs[0].size[0]]  # get 1 hop nodes
-    for i in range(1, len(adjs)):
-        adj = adjs[i]
-        cached_nodes_mask = histories[i - 1].cached_nodes[[layernode]]
-        layer_idx = torch.arange(len(layernode)).to(
-            cached_nodes_mask.device)  # nano batch id
-        sub_nid = layer_idx[~cached_nodes_mask]  # 7%的用时
-        layernode, sub_adjs, _ = slice_adj(sub_nid,
-                                           adj.edge_index,
-                                           relabel_nodes=False)
-        pruned_adjs.append(Adj(sub_adjs, None, (len(layernode), len(sub_nid))))
-    pruned_adjs.reverse()
+def prune_computation_graph(n_id: Tensor,
+                            nb_adjs: List,
+                            histories: torch.nn.ModuleList,
+                            return_computed: bool = False):
+    r"""Drops the edges computing embeddings which are not needed: the
+    targets cached in the history of their layer, and the nodes only
+    feeding them. One pass from the last layer inward masks the edges of
+    :obj:`nb_adjs` in place of slicing them again, node ids and sizes are
+    kept.
+
+    Args:
+        n_id (Tensor): nodes of the nano batch, ids of the histories.
+        nb_adjs (List[Adj]): adjacency matrices of the nano batch, in model
+            order, not modified.
+        histories (torch.nn.ModuleList): :obj:`histories[k]` stores the
+            output of layer :obj:`k`, one per hidden layer.
+        return_computed (bool): also return, per hidden layer in model
+            order, the mask of the output rows computed with all their
+            edges, the only ones to push to a history: the other rows are
+            read from the history or left out. (default: :obj:`False`)
+    """
+    pruned_adjs = [nb_adjs[-1]]
+    computed = []
+    device = nb_adjs[-1].edge_index.device
+    # targets of the current layer to compute, all of the last layer
+    needed = torch.ones(nb_adjs[-1].size[1], dtype=torch.bool, device=device)
+    for k in range(len(nb_adjs) - 1, 0, -1):
+        # layer k - 1 computes the sources of the kept edges and the roots
+        source_needed = _needed_sources(nb_adjs[k], pruned_adjs[0].edge_index,
+                                        needed)
+        cached = histories[k - 1].is_cached(n_id[:nb_adjs[k].size[0]])
+        needed = source_needed & ~cached.to(device)
+        computed.insert(0, needed)
+        adj = nb_adjs[k - 1]
+        keep = needed[adj.edge_index[1]]
+        pruned_adjs.insert(0, Adj(adj.edge_index[:, keep], adj.n_id, adj.size))
+    if return_computed:
+        return pruned_adjs, computed
     return pruned_adjs
@@ -0,0 +1,156 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+import torch
+from torch import Tensor
+from torch_geometric.utils.num_nodes import maybe_num_nodes
+
+from microGNN.utils.common_class import Adj
+from microGNN.utils.get_nano_batch import to_csr
+from microGNN.utils.workspace import SliceWorkspace
+
+
+def sample_offsets(deg: Tensor,
+                   k: int,
+                   generator: Optional[torch.Generator] = None) -> Tensor:
+    r"""Draws :obj:`k` distinct offsets in :obj:`[0, deg[i])` for every row
+    :obj:`i`, uniformly, with Floyd's algorithm run on all rows at once:
+    :math:`O(k^2)` per row whatever the degree, instead of a random key per
+    neighbor. Every :obj:`deg[i]` must be at least :obj:`k`.
+
+    :rtype: :class:`LongTensor` of shape :obj:`[len(deg), k]`
+    """
+    chosen = deg.new_empty(deg.size(0), k)
+    for i in range(k):
+        j = deg - k + i  # pick in [0, j], j itself if already picked
+        t = (torch.rand(deg.size(0), generator=generator, device=deg.device) *
+             (j + 1)).long().clamp_(max=j)
+        if i > 0:
+            t = torch.where((chosen[:, :i] == t.unsqueeze(1)).any(1), j, t)
+        chosen[:, i] = t
+    return chosen
+
+
+class CSRSampler:
+    r"""A CPU neighbor sampler with the :obj:`sample(seeds) -> (n_id,
+    batch_size, adjs)` contract of :obj:`quiver.pyg.GraphSageSampler`, for
+    hosts without GPU or quiver. The graph is grouped into CSR once. Each
+    hop samples up to :obj:`sizes[i]` distinct neighbors of every frontier
+    node at once (:meth:`sample_offsets`), all of them when :obj:`-1` or
+    fewer, on :obj:`num_threads` threads for large frontiers. :obj:`n_id`
+    holds the seeds first then the new nodes of each hop, and :obj:`adjs`
+    are :class:`Adj` in sampler order, the outer hop first, ready for
+    :meth:`get_nano_batch`.
+
+    Args:
+        edge_index (LongTensor): edges of the graph, the neighbors of a
+            node are the sources of its incoming edges.
+        sizes (List[int]): neighbors sampled per node for each hop, from
+            the seeds outward, :obj:`-1` for all.
+        num_nodes (int, optional): number of nodes of the graph.
+            (default: :obj:`None`)
+        num_threads (int): threads sampling a hop. (default: :obj:`1`)
+        chunk_size (int): frontier nodes per thread task.
+            (default: :obj:`16384`)
+    """
+
+    def __init__(self,
+                 edge_index: Tensor,
+                 sizes: List[int],
+                 num_nodes: Optional[int] = None,
+                 num_threads: int = 1,
+                 chunk_size: int = 16384):
+        assert chunk_size > 0, "chunk_size must be positive"
+        self.num_nodes = maybe_num_nodes(edge_index, num_nodes)
+        self.csr = to_csr(edge_index.cpu(), self.num_nodes)
+        self.sizes = list(sizes)
+        self.num_threads = num_threads
+        self.chunk_size = chunk_size
+        self._executor = None
+        if num_threads > 1:
+            self._executor = ThreadPoolExecutor(max_workers=num_threads)
+        self._local = threading.local()
+
+    def __getstate__(self):
+        # sent to sampling processes without its threads
+        state = self.__dict__.copy()
+        state["_executor"] = state["_local"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.num_threads > 1:
+            self._executor = ThreadPoolExecutor(max_workers=self.num_threads)
+        self._local = threading.local()
+
+    def _workspace(self) -> SliceWorkspace:
+        # the node map is not thread safe, every sampling thread keeps its own
+        if not hasattr(self._local, "workspace"):
+            self._local.workspace = SliceWorkspace()
+        return self._local.workspace
+
+    def _sample_hop(
+            self,
+            nodes: Tensor,
+            k: int,
+            generator: Optional[torch.Generator] = None
+    ) -> Tuple[Tensor, Tensor]:
+        # global sources and local targets of the sampled edges, by target
+        rowptr, col = self.csr.rowptr, self.csr.col
+        begin = rowptr[nodes]
+        deg = rowptr[nodes + 1] - begin
+        count = deg if k < 0 else deg.clamp(max=k)
+        first = torch.cumsum(count, 0) - count  # first edge of each target
+        target = torch.repeat_interleave(torch.arange(nodes.size(0)), count)
+        ptr = begin[target] + torch.arange(target.size(0)) - first[target]
+        if k >= 0:
+            rows = (deg > k).nonzero().view(-1)
+            if rows.numel() > 0:
+                offsets = sample_offsets(deg[rows], k, generator)
+                edges = first[rows].unsqueeze(1) + torch.arange(k)
+                ptr[edges.view(-1)] = (begin[rows].unsqueeze(1) +
+                                       offsets).view(-1)
+        return col[ptr], target
+
+    def _sample_frontier(self, nodes: Tensor, k: int) -> Tuple[Tensor, Tensor]:
+        if self._executor is None or nodes.size(0) <= self.chunk_size:
+            return self._sample_hop(nodes, k)
+        starts = range(0, nodes.size(0), self.chunk_size)
+        # one generator per task, seeded from the global one: reproducible
+        seeds = torch.randint(2**62, (len(starts), )).tolist()
+
+        def work(start, seed):
+            generator = torch.Generator().manual_seed(seed)
+            sources, target = self._sample_hop(
+                nodes[start:start + self.chunk_size], k, generator)
+            return sources, target + start
+
+        parts = list(self._executor.map(work, starts, seeds))
+        return (torch.cat([p[0]
+                           for p in parts]), torch.cat([p[1] for p in parts]))
+
+    def sample(self, seeds: Tensor) -> Tuple[Tensor, int, List[Adj]]:
+        r"""Samples the receptive field of the unique nodes :obj:`seeds`.
+
+        :rtype: (:class:`LongTensor`, int, List[:class:`Adj`])
+        """
+        n_id = seeds.view(-1).cpu().long()
+        batch_size = n_id.size(0)
+        workspace = self._workspace()
+        node_map = workspace.get("node_idx", self.num_nodes, torch.long, -1,
+                                 "cpu")
+        node_map[n_id] = torch.arange(batch_size)
+        adjs = []
+        for k in self.sizes:
+            num_targets = n_id.size(0)
+            sources, target = self._sample_frontier(n_id, k)
+            new = sources[node_map[sources] < 0].unique()
+            node_map[new] = torch.arange(num_targets,
+                                         num_targets + new.size(0))
+            n_id = torch.cat((n_id, new))
+            adjs.append(
+                Adj(torch.stack((node_map[sources], target)), None,
+                    (n_id.size(0), num_targets)))
+        workspace.reset(node_map, n_id, -1)
+        return n_id, batch_size, adjs[::-1]
@@ -0,0 +1,269 @@
+import queue
+import threading
+from concurrent.futures import Future
+from timeit import default_timer
+from typing import List, Optional, Tuple
+
+import torch
+from torch import Tensor
+
+from microGNN.history import GlobalHistory
+from microGNN.inference import LayerwiseInference
+from microGNN.utils.common_class import CSR
+from microGNN.utils.get_nano_batch import slice_adj_csr, to_csr
+from microGNN.utils.metrics import cal_metrics
+from microGNN.utils.workspace import SliceWorkspace
+
+
+def one_hop(targets: Tensor, csr: CSR) -> Tuple[Tensor, Tensor, Tuple]:
+    r"""The bipartite 1-hop graph of the sorted, unique :obj:`targets`: the
+    targets first then their other neighbors, as :class:`NeighborSampler`.
+
+    :rtype: (:class:`LongTensor`, :class:`LongTensor`, (int, int)) the
+        nodes, the edges and the size.
+    """
+    begin = csr.rowptr[targets]
+    deg = csr.rowptr[targets + 1] - begin
+    target = torch.repeat_interleave(torch.arange(targets.size(0)), deg)
+    first = torch.cumsum(deg, 0) - deg  # first edge of each target
+    edge = begin[target] + torch.arange(target.size(0)) - first[target]
+    sources = csr.col[edge]
+    # neighbors among the targets read the target rows
+    pos = torch.searchsorted(targets, sources)
+    inside = pos < targets.size(0)
+    inside[inside.clone()] = targets[pos[inside]] == sources[inside]
+    neighbors, inverse = torch.unique(sources[~inside], return_inverse=True)
+    pos[~inside] = inverse + targets.size(0)
+    n_id = torch.cat((targets, neighbors))
+    return n_id, torch.stack((pos, target)), (n_id.size(0), targets.size(0))
+
+
+class EmbeddingServer:
+    r"""Answers node classification requests of a trained :class:`SAGE` or
+    :class:`GAT` from precomputed embeddings. The output of the layer
+    before the last one is computed once for every node with
+    :class:`LayerwiseInference`, each request then only runs the last layer
+    on the 1-hop neighborhood of its nodes. Concurrent requests are
+    micro-batched: a worker thread takes the first pending request, waits
+    up to :obj:`max_wait` seconds for more until :obj:`max_batch_size`
+    nodes, and answers them with one pass.
+
+    Args:
+        model (torch.nn.Module): trained model with :meth:`inference_layer`,
+            put in eval mode.
+        x (Tensor): node features.
+        engine (LayerwiseInference): inference engine of the graph, its
+            cache is used when set.
+        max_batch_size (int): nodes of a micro batch. (default: :obj:`1024`)
+        max_wait (float): seconds a request waits for others to batch with.
+            (default: :obj:`0.002`)
+        device (torch.device, optional): device of the embeddings and the
+            last layer. Defaults to the device of :obj:`x`.
+    """
+
+    def __init__(self,
+                 model: torch.nn.Module,
+                 x: Tensor,
+                 engine: LayerwiseInference,
+                 max_batch_size: int = 1024,
+                 max_wait: float = 0.002,
+                 device: Optional[torch.device] = None):
+        assert max_batch_size > 0, "max_batch_size must be positive"
+        self.model = model.eval()
+        self.engine = engine
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.device = x.device if device is None else torch.device(device)
+        self.emb = engine.run(model, x, self.device,
+                              end=model.num_layers - 1).to(self.device)
+        self.latencies: List[float] = []
+        self.batch_sizes: List[int] = []
+        self._first = self._last = None
+        self._queue: "queue.Queue" = queue.Queue()
+        self._worker = threading.Thread(target=self._serve, daemon=True)
+        self._worker.start()
+
+    def submit(self, node_ids: Tensor) -> Future:
+        r"""Queues a request, the future holds the log probabilities of
+        :obj:`node_ids`, in order."""
+        future = Future()
+        self._queue.put((node_ids.view(-1).cpu(), future, default_timer()))
+        return future
+
+    def predict(self, node_ids: Tensor) -> Tensor:
+        r"""Answers a request, blocking, see :meth:`submit`."""
+        return self.submit(node_ids).result()
+
+    @torch.no_grad()
+    def predict_batch(self, node_ids: Tensor) -> Tensor:
+        r"""Runs the last layer for :obj:`node_ids`, without batching."""
+        targets, index = torch.unique(node_ids, return_inverse=True)
+        n_id, edge_index, size = one_hop(targets, self.engine.csr)
+        out = self.model.inference_layer(self.model.num_layers - 1,
+                                         self.emb[n_id.to(self.device)],
+                                         edge_index.to(self.device), size)
+        return out.log_softmax(dim=-1)[index.to(self.device)]
+
+    def _next_batch(self) -> Optional[List]:
+        request = self._queue.get()
+        if request is None:
+            return None
+        batch, num_nodes = [request], request[0].numel()
+        deadline = default_timer() + self.max_wait
+        while num_nodes < self.max_batch_size:
+            timeout = deadline - default_timer()
+            if timeout <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if request is None:
+                self._queue.put(None)  # stop after this batch
+                break
+            batch.append(request)
+            num_nodes += request[0].numel()
+        return batch
+
+    def _serve(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            sizes = [node_ids.numel() for node_ids, _, _ in batch]
+            try:
+                out = self.predict_batch(torch.cat([b[0] for b in batch]))
+            except Exception as e:  # noqa
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            now = default_timer()
+            self.batch_sizes.append(sum(sizes))
+            if self._first is None:
+                self._first = batch[0][2]
+            self._last = now
+            for (_, future, start), rows in zip(batch, out.split(sizes)):
+                self.latencies.append(now - start)
+                future.set_result(rows)
+
+    def metrics(self) -> dict:
+        r"""The :meth:`cal_metrics` of the request latencies in seconds,
+        with :obj:`throughput` in requests per second and
+        :obj:`mean_batch_size` in nodes."""
+        metrics = cal_metrics(self.latencies)
+        metrics["throughput"] = len(
+            self.latencies) / (self._last - self._first)
+        metrics["mean_batch_size"] = sum(self.batch_sizes) / len(
+            self.batch_sizes)
+        return metrics
+
+    def close(self):
+        r"""Answers the queued requests and stops the worker."""
+        self._queue.put(None)
+        self._worker.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class NodePredictor:
+    r"""Online node classification of a few nodes per query, computing
+    only their receptive field. The k-hop receptive field is sliced outward
+    with :meth:`slice_adj_csr`, and the output of every layer but the last
+    one is kept per node in a :class:`GlobalHistory` with LRU eviction, as
+    the nano batch histories: a node whose embedding of layer :obj:`k` was
+    computed by a recent query is read back and its own receptive field
+    below :obj:`k` is not sliced nor computed. Call :meth:`reset` when the
+    parameters change.
+
+    Args:
+        model (torch.nn.Module): trained model with :meth:`inference_layer`,
+            put in eval mode.
+        x (Tensor): node features.
+        edge_index (LongTensor): edges of the graph.
+        num_nodes (int, optional): number of nodes of the graph.
+            (default: :obj:`None`)
+        memory_budget (int): bytes of the embeddings kept per layer, which
+            bounds the LRU stores to a fraction of the graph, :obj:`0`
+            keeps none. (default: :obj:`2**28`)
+        device (torch.device, optional): device of the computation and the
+            embeddings. Defaults to the device of :obj:`x`.
+    """
+
+    def __init__(self,
+                 model: torch.nn.Module,
+                 x: Tensor,
+                 edge_index: Tensor,
+                 num_nodes: Optional[int] = None,
+                 memory_budget: int = 2**28,
+                 device: Optional[torch.device] = None):
+        assert memory_budget >= 0, "memory_budget must be non negative"
+        self.model = model.eval()
+        self.x = x
+        self.device = x.device if device is None else torch.device(device)
+        self.memory_budget = memory_budget
+        self.edge_index = edge_index.cpu()
+        self.num_nodes = x.size(0) if num_nodes is None else num_nodes
+        self.csr = to_csr(self.edge_index, self.num_nodes)
+        self.workspace = SliceWorkspace()
+        # built on the first output of each layer, its size is known then
+        self.histories: List[
+            Optional[GlobalHistory]] = [None] * (model.num_layers - 1)
+        self._lock = threading.Lock()
+
+    def reset(self):
+        r"""Drops the kept embeddings."""
+        for history in self.histories:
+            if history is not None:
+                history.reset_parameters()
+
+    def _history(self, k: int, out: Tensor) -> GlobalHistory:
+        if self.histories[k] is None:
+            self.histories[k] = GlobalHistory(self.num_nodes,
+                                              out.size(1),
+                                              memory_budget=self.memory_budget,
+                                              policy="lru",
+                                              device=self.device,
+                                              dtype=out.dtype)
+        return self.histories[k]
+
+    @torch.no_grad()
+    def predict_nodes(self, node_ids: Tensor) -> Tensor:
+        r"""Returns the log probabilities of :obj:`node_ids`, in order."""
+        with self._lock:
+            return self._predict(node_ids.view(-1).cpu())
+
+    def _predict(self, node_ids: Tensor) -> Tensor:
+        targets, index = torch.unique(node_ids, return_inverse=True)
+        layers = []  # outward: targets, inputs, edges, rows read
+        for k in range(self.model.num_layers - 1, -1, -1):
+            subset, edge_index, _ = slice_adj_csr(targets,
+                                                  self.edge_index,
+                                                  self.csr,
+                                                  relabel_nodes=True,
+                                                  workspace=self.workspace)
+            hit, cached = torch.zeros(subset.size(0), dtype=torch.bool), None
+            history = self.histories[k - 1] if k > 0 else None
+            if history is not None:  # read before any push may evict them
+                ids = subset.to(self.device)
+                hit = history.is_cached(ids).cpu()
+                cached = history.pull(
+                    torch.zeros(ids.size(0),
+                                history.embedding_dim,
+                                device=self.device), ids)
+            layers.insert(0, (targets, subset, edge_index, hit, cached))
+            targets = subset[~hit]  # outputs of layer k - 1 to compute
+        out = self.x[targets.to(self.x.device)].to(self.device)
+        for k, (targets, subset, edge_index, hit, cached) in enumerate(layers):
+            if cached is not None:  # the computed inputs and the read ones
+                cached[(~hit).to(self.device)] = out.to(cached.dtype)
+                out = cached
+            out = self.model.inference_layer(k, out,
+                                             edge_index.to(self.device),
+                                             (subset.size(0), targets.size(0)))
+            if k < len(layers) - 1:
+                self._history(k, out).push(out, targets.to(self.device))
+        return out.log_softmax(dim=-1)[index.to(self.device)]
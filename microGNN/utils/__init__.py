@@ -1,4 +1,8 @@
 from .get_nano_batch import *
+from .workspace import *
+from .partition import *
+from .memory import *
+from .plan import *
 from .common_config import *
 from .calu_similarity import *
 from .common_class import *
@@ -13,6 +13,16 @@ class Adj(NamedTuple):
         return Adj(self.edge_index.to(*args, **kwargs), n_id, self.size)
 
 
+class CSR(NamedTuple):
+    rowptr: Tensor
+    col: Tensor
+    perm: Tensor  # position of each csr entry in the origin edge_index
+
+    def to(self, *args, **kwargs):
+        return CSR(self.rowptr.to(*args, **kwargs),
+                   self.col.to(*args, **kwargs), self.perm.to(*args, **kwargs))
+
+
 class Nanobatch(NamedTuple):
     n_id: Tensor
     size: int
@@ -23,3 +33,26 @@ class Nanobatch(NamedTuple):
         for adj in self.adjs:
             adj.to(*args, **kwargs)
         return Nanobatch(n_id, self.size, self.adjs.to(*args, **kwargs))
+
+
+class LayerPlan(NamedTuple):
+    edge_index: Tensor  # kept edges, nano batch local ids
+    size: Tuple[int, int]
+    pull_rows: Tensor  # output rows read from the history
+    pull_slots: Tensor  # their rows in History.emb
+    push_rows: Tensor  # computed output rows written to the history
+    push_slots: Tensor  # their rows in History.emb
+
+    def to(self, *args, **kwargs):
+        return LayerPlan(self.edge_index.to(*args, **kwargs), self.size,
+                         *[t.to(*args, **kwargs) for t in self[2:]])
+
+
+class PrunedPlan(NamedTuple):
+    n_id: Tensor
+    size: int
+    layers: List[LayerPlan]  # in model order
+
+    def to(self, *args, **kwargs):
+        return PrunedPlan(self.n_id.to(*args, **kwargs), self.size,
+                          [layer.to(*args, **kwargs) for layer in self.layers])
@@ -1,5 +1,9 @@
+import math
+import threading
+from collections import deque
+from concurrent.futures import Executor, ThreadPoolExecutor
 from timeit import default_timer as timer
-from typing import List, Optional, Tuple, Union
+from typing import Callable, Iterator, List, Optional, Tuple, Union
 
 import torch
 from torch import Tensor
@@ -7,10 +11,18 @@ from torch_geometric.data import Data
 from torch_geometric.utils import trim_to_layer
 from torch_geometric.utils.num_nodes import maybe_num_nodes
 
-from microGNN.utils.common_class import Adj, Nanobatch
+from microGNN.utils.common_class import CSR, Adj, Nanobatch
+from microGNN.utils.memory import LayerMemory, estimate_memory
+from microGNN.utils.partition import (LayerCost, edge_cost_model,
+                                      nano_batch_sizes, partition_targets)
+from microGNN.utils.plan import plan_nano_batches
+from microGNN.utils.workspace import SliceWorkspace
 
 torch.set_printoptions(profile="full")
 
+_FIRST_FILL = torch.iinfo(torch.long).max
+_thread_local = threading.local()
+
 
 def slice_adj(
     node_idx: Union[int, List[int], Tensor],
@@ -18,6 +30,9 @@ def slice_adj(
     relabel_nodes: bool = False,
     num_nodes: Optional[int] = None,
     flow: str = "source_to_target",
+    dedup: str = "isin",
+    keep_order: bool = False,
+    workspace: Optional[SliceWorkspace] = None,
 ) -> Tuple[Tensor, Tensor, Tensor]:
     r"""Computes the nano batch edge_index of origin edge_index.
 
@@ -43,6 +58,20 @@ def slice_adj(
         flow (string, optional): The flow direction of :math:`k`-hop
             aggregation (:obj:`"source_to_target"` or
             :obj:`"target_to_source"`). (default: :obj:`"source_to_target"`)
+        dedup (string, optional): How the neighbors are deduplicated and the
+            seed nodes removed from them. :obj:`"isin"` uses
+            :meth:`torch.isin` and :meth:`torch.unique`, which sort the
+            neighbors in :math:`O(E \log E)`. :obj:`"mask"` scatters them
+            into the :obj:`num_nodes` node mask in :math:`O(E)`.
+            (default: :obj:`"isin"`)
+        keep_order (bool, optional): If set to :obj:`True`, the neighbors
+            are kept in first-seen order instead of sorted order. Only
+            supported with :obj:`dedup="mask"`. (default: :obj:`False`)
+        workspace (SliceWorkspace, optional): If set, the node mask, edge
+            mask and relabel buffers are taken from it instead of being
+            allocated, and only the touched entries are reset. The returned
+            edge mask is then overwritten by the next call.
+            (default: :obj:`None`)
 
     :rtype: (:class:`LongTensor`, :class:`LongTensor`,
              :class:`BoolTensor`)
@@ -50,45 +79,526 @@ def slice_adj(
 
     num_nodes = maybe_num_nodes(edge_index, num_nodes)
 
+    assert dedup in ["isin", "mask"]
+    assert not keep_order or dedup == "mask", "keep_order requires mask"
     assert flow in ["source_to_target", "target_to_source"]
     if flow == "target_to_source":
         target, source = edge_index
     else:
         source, target = edge_index
 
-    node_mask = target.new_empty(num_nodes, dtype=torch.bool)
-    edge_mask = target.new_empty(target.size(0), dtype=torch.bool)
+    if workspace is None:
+        node_mask = target.new_empty(num_nodes, dtype=torch.bool)
+        edge_mask = target.new_empty(target.size(0), dtype=torch.bool)
+        node_mask.fill_(False)
+    else:
+        node_mask = workspace.get("node_mask", num_nodes, torch.bool, False,
+                                  target.device)
+        edge_mask = workspace.get("edge_mask", target.size(0), torch.bool,
+                                  False, target.device)
 
     if isinstance(node_idx, (int, list, tuple)):
         node_idx = torch.tensor([node_idx], device=target.device).flatten()
     else:
         node_idx = node_idx.to(target.device)
 
-    node_mask.fill_(False)
     node_mask[node_idx] = True
     torch.index_select(node_mask, 0, target, out=edge_mask)  # select edge
     subsets = [node_idx, source[edge_mask]]
     # remove all target nodes from subsets[1].
     # subsets[0] is the target nodes , and we need place it at first.
-    mask = torch.isin(subsets[1], subsets[0])  # bottleneck
-    subsets[1] = subsets[1][~mask]
-    subset = subsets[1].unique()
+    if dedup == "isin":
+        mask = torch.isin(subsets[1], subsets[0])  # bottleneck
+        subsets[1] = subsets[1][~mask]
+        subset = subsets[1].unique()
+    elif keep_order:
+        neighbors = subsets[1][~node_mask[subsets[1]]]
+        pos = torch.arange(neighbors.size(0), device=target.device)
+        if workspace is None:
+            first = target.new_full((num_nodes, ), neighbors.size(0))
+        else:
+            first = workspace.get("first", num_nodes, torch.long, _FIRST_FILL,
+                                  target.device)
+        first.scatter_reduce_(0, neighbors, pos, reduce="amin")
+        subset = neighbors[first[neighbors] == pos]  # first occurrence
+        if workspace is not None:
+            workspace.reset(first, subset, _FIRST_FILL)
+    else:
+        node_mask[subsets[1]] = True
+        node_mask[subsets[0]] = False
+        subset = node_mask.nonzero().view(-1)
     subset = torch.cat((subsets[0], subset), 0)
 
-    node_mask.fill_(False)
-    node_mask[subset] = True  # the subgraph nodes after hop
+    if workspace is None:
+        node_mask.fill_(False)
+        node_mask[subset] = True  # the subgraph nodes after hop
+    else:
+        workspace.reset(node_mask, subset, False)  # sparse reset
 
     edge_index = edge_index[:, edge_mask]
 
     if relabel_nodes:
-        node_idx = target.new_full((num_nodes, ), -1)
+        if workspace is None:
+            node_idx = target.new_full((num_nodes, ), -1)
+        else:
+            node_idx = workspace.get("node_idx", num_nodes, torch.long, -1,
+                                     target.device)
         # tensor([ 0,  1,  2,  3, -1, -1,  4,  5, -1, -1])
         node_idx[subset] = torch.arange(subset.size(0), device=target.device)
         edge_index = node_idx[edge_index]
+        if workspace is not None:
+            workspace.reset(node_idx, subset, -1)
 
     return subset, edge_index, edge_mask
 
 
+def to_csr(
+    edge_index: Tensor,
+    num_nodes: Optional[int] = None,
+    flow: str = "source_to_target",
+) -> CSR:
+    r"""Groups the edges of :obj:`edge_index` by their target node, so that
+    the incoming edges of node :obj:`v` are
+    :obj:`col[rowptr[v]:rowptr[v + 1]]`.
+
+    Build it once per mini batch adj and reuse it for every nano batch in
+    :meth:`slice_adj_csr`.
+
+    Args:
+        edge_index (LongTensor): The edge indices.
+        num_nodes (int, optional): The number of nodes, *i.e.*
+            :obj:`max_val + 1` of :attr:`edge_index`. (default: :obj:`None`)
+        flow (string, optional): The flow direction of :math:`k`-hop
+            aggregation (:obj:`"source_to_target"` or
+            :obj:`"target_to_source"`). (default: :obj:`"source_to_target"`)
+
+    :rtype: :class:`CSR`
+    """
+    num_nodes = maybe_num_nodes(edge_index, num_nodes)
+
+    assert flow in ["source_to_target", "target_to_source"]
+    if flow == "target_to_source":
+        target, source = edge_index
+    else:
+        source, target = edge_index
+
+    if bool((target[1:] >= target[:-1]).all()):
+        # sampler adjs are already grouped by target, skip the sort.
+        perm = torch.arange(target.size(0), device=target.device)
+    else:
+        _, perm = torch.sort(target, stable=True)
+    deg = torch.bincount(target, minlength=num_nodes)
+    rowptr = target.new_zeros(num_nodes + 1)
+    torch.cumsum(deg, 0, out=rowptr[1:])
+    return CSR(rowptr, source[perm], perm)
+
+
+def slice_adj_csr(
+    node_idx: Union[int, List[int], Tensor],
+    edge_index: Tensor,
+    csr: CSR,
+    relabel_nodes: bool = False,
+    workspace: Optional[SliceWorkspace] = None,
+) -> Tuple[Tensor, Tensor, Tensor]:
+    r"""Same as :meth:`slice_adj`, but gathers the incoming edges of the seed
+    nodes through the :obj:`rowptr` ranges of :obj:`csr`, so the cost scales
+    with the edges of the nano batch instead of the whole :obj:`edge_index`.
+
+    The method returns (1) the nodes involved in the subgraph, (2) the filtered
+    :obj:`edge_index` connectivity, and (3) the ids of the preserved edges,
+    in the same order as :meth:`slice_adj` keeps them.
+
+    Args:
+        node_idx (int, list, tuple or :obj:`torch.Tensor`): The central seed
+            node(s).
+        edge_index (LongTensor): The edge indices.
+        csr (CSR): The :meth:`to_csr` of :obj:`edge_index`.
+        relabel_nodes (bool, optional): If set to :obj:`True`, the resulting
+            :obj:`edge_index` will be relabeled to hold consecutive indices
+            starting from zero. (default: :obj:`False`)
+        workspace (SliceWorkspace, optional): reuse its node buffers.
+            (default: :obj:`None`)
+
+    :rtype: (:class:`LongTensor`, :class:`LongTensor`, :class:`LongTensor`)
+    """
+    rowptr, col, perm = csr
+    if isinstance(node_idx, (int, list, tuple)):
+        node_idx = torch.tensor([node_idx], device=col.device).flatten()
+    else:
+        node_idx = node_idx.to(col.device)
+
+    start = rowptr[node_idx]
+    count = rowptr[node_idx + 1] - start
+    offset = torch.cumsum(count, 0) - count
+    ptr = torch.arange(int(count.sum()), device=col.device)
+    ptr += (start - offset).repeat_interleave(count)
+    e_id, order = perm[ptr].sort()  # keep the origin edge order
+    neighbors = col[ptr][order]
+
+    num_nodes = rowptr.size(0) - 1
+    if workspace is None:
+        node_mask = col.new_zeros(num_nodes, dtype=torch.bool)
+    else:
+        node_mask = workspace.get("node_mask", num_nodes, torch.bool, False,
+                                  col.device)
+    node_mask[neighbors] = True
+    node_mask[node_idx] = False  # seeds are placed first
+    subset = torch.cat((node_idx, node_mask.nonzero().view(-1)), 0)
+    if workspace is not None:
+        workspace.reset(node_mask, subset, False)
+
+    edge_index = edge_index[:, e_id]
+
+    if relabel_nodes:
+        if workspace is None:
+            node_map = col.new_full((num_nodes, ), -1)
+        else:
+            node_map = workspace.get("node_idx", num_nodes, torch.long, -1,
+                                     col.device)
+        node_map[subset] = torch.arange(subset.size(0), device=col.device)
+        edge_index = node_map[edge_index]
+        if workspace is not None:
+            workspace.reset(node_map, subset, -1)
+
+    return subset, edge_index, e_id
+
+
+def _slice_layer(
+    sub_nid: Tensor,
+    adj: Adj,
+    csr: Optional[CSR],
+    relabel_nodes: bool,
+    workspace: Optional[SliceWorkspace] = None,
+) -> Tuple[Tensor, Tensor]:
+    if csr is None:
+        sub_nid, edge_index, _ = slice_adj(sub_nid,
+                                           adj.edge_index,
+                                           relabel_nodes=relabel_nodes,
+                                           workspace=workspace)
+    else:
+        sub_nid, edge_index, _ = slice_adj_csr(sub_nid,
+                                               adj.edge_index,
+                                               csr,
+                                               relabel_nodes=relabel_nodes,
+                                               workspace=workspace)
+    return sub_nid, edge_index
+
+
+def _build_csrs(adjs: List[Adj], use_csr: bool) -> List[Optional[CSR]]:
+    if not use_csr:
+        return [None] * len(adjs)
+    return [
+        to_csr(adj.edge_index, max(adj.size[0],
+                                   maybe_num_nodes(adj.edge_index)))
+        for adj in adjs
+    ]
+
+
+def _thread_workspace() -> SliceWorkspace:
+    # workspaces are not thread safe, every pool thread keeps its own
+    if not hasattr(_thread_local, "workspace"):
+        _thread_local.workspace = SliceWorkspace()
+    return _thread_local.workspace
+
+
+def _slice_nano_batch(
+    sub_nid: Tensor,
+    adjs: List[Adj],
+    csrs: List[Optional[CSR]],
+    relabel_nodes: bool,
+    workspace: Optional[SliceWorkspace] = None,
+) -> Tuple[List[Tensor], List[Tensor]]:
+    # one nano batch through every layer, from the target layer outward
+    sub_nids, edge_indices = [], []
+    for adj, csr in zip(adjs, csrs):
+        sub_nid, edge_index = _slice_layer(sub_nid, adj, csr, relabel_nodes,
+                                           workspace)
+        sub_nids.append(sub_nid)
+        edge_indices.append(edge_index)
+    return sub_nids, edge_indices
+
+
+def _map_nano_batches(
+    seeds: List[Tensor],
+    adjs: List[Adj],
+    csrs: List[Optional[CSR]],
+    relabel_nodes: bool,
+    workspace: Optional[SliceWorkspace] = None,
+    num_threads: int = 1,
+    executor: Optional[Executor] = None,
+) -> List[Tuple[List[Tensor], List[Tensor]]]:
+    r"""Runs :meth:`_slice_nano_batch` for every seed set, on
+    :obj:`executor` or a pool of :obj:`num_threads` threads when given.
+    Results keep the order of :obj:`seeds`."""
+    if executor is None and num_threads <= 1:
+        return [
+            _slice_nano_batch(seed, adjs, csrs, relabel_nodes, workspace)
+            for seed in seeds
+        ]
+
+    def work(seed):
+        return _slice_nano_batch(seed, adjs, csrs, relabel_nodes,
+                                 _thread_workspace())
+
+    if executor is not None:
+        return list(executor.map(work, seeds))
+    with ThreadPoolExecutor(max_workers=num_threads) as pool:
+        return list(pool.map(work, seeds))
+
+
+def slice_nano_batches(
+    adjs: List[Adj],
+    seeds: List[Tensor],
+    num_nodes: int,
+    relabel_nodes: bool = True,
+    return_cached: bool = False,
+    workspace: Optional[SliceWorkspace] = None,
+) -> List[Tuple[List[Tensor], List[Tensor], Optional[Tensor]]]:
+    r"""Slices all nano batches in one sweep over each adj.
+
+    Every node keeps a mask of the nano batches whose receptive field it
+    belongs to, which is propagated through a layer with one gather over
+    the edges and one scatter over the sources, instead of calling
+    :meth:`slice_adj` once per nano batch and layer. The output is the same
+    as slicing each seed set with :meth:`slice_adj`.
+
+    Args:
+        adjs (List[Adj]): adjacency matrices, from the target layer outward.
+        seeds (List[Tensor]): target nodes of each nano batch.
+        num_nodes (int): number of nodes in the mini batch.
+        relabel_nodes (bool): relabel each nano batch edge_index.
+        return_cached (bool): also return the nodes of each nano batch
+            which already appear in an earlier nano batch at that layer,
+            see :meth:`get_nano_batch_histories`.
+        workspace (SliceWorkspace, optional): reuse its label buffers.
+
+    :rtype: List[(each nano batch nodes, each nano batch edge_index,
+            cached nodes)] for each layer
+    """
+    device = adjs[0].edge_index.device
+    num_nano_batch = len(seeds)
+    subsets = [seed.to(device) for seed in seeds]
+    sizes = torch.tensor([len(s) for s in subsets], device=device)
+    seed_b = torch.arange(num_nano_batch,
+                          device=device).repeat_interleave(sizes)
+    seed_pos = torch.arange(seed_b.size(0), device=device)
+    seed_pos -= (torch.cumsum(sizes, 0) - sizes)[seed_b]
+    # labels[v, b]: v is in the receptive field of nano batch b.
+    # pos[v, b]: the index of v in the nodes of nano batch b.
+    shape = (num_nodes, num_nano_batch)
+    sparse_reset = workspace is not None
+    if workspace is None:
+        workspace = SliceWorkspace()
+    labels = workspace.get("labels", num_nodes * num_nano_batch, torch.bool,
+                           False, device).view(shape)
+    pos = workspace.get("pos", num_nodes * num_nano_batch, torch.int32, -1,
+                        device).view(shape)
+    new_labels = workspace.get("new_labels", num_nodes * num_nano_batch,
+                               torch.bool, False, device).view(shape)
+    labels[torch.cat(subsets), seed_b] = True
+    pos[torch.cat(subsets), seed_b] = seed_pos.to(torch.int32)
+
+    layers = []
+    for adj in adjs:
+        source, target = adj.edge_index
+        # (nano batch, edge) pairs sorted by nano batch, then by edge id
+        pair_b, pair_e = labels[target].t().nonzero(as_tuple=True)
+        new_labels[source[pair_e], pair_b] = True  # one scatter per layer
+        new_labels &= ~labels
+        labels |= new_labels
+        # sorted by nano batch, then by node id like unique() in slice_adj
+        new_b, new_nid = new_labels.t().nonzero(as_tuple=True)
+        new_labels[new_nid, new_b] = False  # sparse reset
+        new_sizes = torch.bincount(new_b, minlength=num_nano_batch)
+        new_pos = torch.arange(new_b.size(0), device=device)
+        new_pos += (sizes - torch.cumsum(new_sizes, 0) + new_sizes)[new_b]
+        pos[new_nid, new_b] = new_pos.to(torch.int32)
+        sizes = sizes + new_sizes
+        subsets = [
+            torch.cat((s, n), 0)
+            for s, n in zip(subsets, new_nid.split(new_sizes.tolist()))
+        ]
+
+        edge_index = adj.edge_index[:, pair_e]
+        if relabel_nodes:
+            edge_index = pos[edge_index, pair_b].to(torch.long)
+        edge_indices = list(
+            edge_index.split(torch.bincount(pair_b,
+                                            minlength=num_nano_batch).tolist(),
+                             dim=1))
+
+        cached = None
+        if return_cached:
+            first = labels.to(torch.uint8).argmax(dim=1)  # first nano batch
+            flat = torch.cat(subsets)
+            subset_b = torch.arange(num_nano_batch,
+                                    device=device).repeat_interleave(sizes)
+            cached = flat[first[flat] < subset_b]
+        layers.append((subsets, edge_indices, cached))
+
+    if sparse_reset:
+        flat = torch.cat(subsets)
+        subset_b = torch.arange(num_nano_batch,
+                                device=device).repeat_interleave(sizes)
+        labels[flat, subset_b] = False
+        pos[flat, subset_b] = -1
+    return layers
+
+
+def _to_nano_batch(sub_nids: List[Tensor], edge_indices: List[Tensor],
+                   nano_batch_size: int) -> Nanobatch:
+    # nano_batch_size is the number of targets, it may differ by one
+    subadjs = []
+    target_size = nano_batch_size
+    for sub_nid, sub_adjs in zip(sub_nids, edge_indices):
+        subadjs.append(Adj(sub_adjs, None, (len(sub_nid), target_size)))
+        target_size = len(sub_nid)
+    subadjs.reverse()  # O(n) 大的在前面
+    return Nanobatch(sub_nids[-1], nano_batch_size, subadjs)
+
+
+def _to_nano_batchs(layers, seeds: List[Tensor]) -> List[Nanobatch]:
+    nano_batchs = []
+    for b, seed in enumerate(seeds):
+        target_size = len(seed)
+        subadjs = []
+        for subsets, edge_indices, _ in layers:
+            sub_nid = subsets[b]
+            subadjs.append(
+                Adj(edge_indices[b], None, (len(sub_nid), target_size)))
+            target_size = len(sub_nid)
+        subadjs.reverse()
+        nano_batchs.append(Nanobatch(sub_nid, len(seed), subadjs))
+    return nano_batchs
+
+
+def count_sliced_nodes(adjs: List[Adj], seeds: List[Tensor],
+                       num_nodes: int) -> List[int]:
+    r"""Returns the total number of nodes of all nano batches at each layer,
+    from the target layer outward, to compare partitions of the targets.
+
+    Args:
+        adjs (List[Adj]): adjacency matrices, from the target layer outward.
+        seeds (List[Tensor]): target nodes of each nano batch.
+        num_nodes (int): number of nodes in the mini batch.
+    """
+    layers = slice_nano_batches(adjs, seeds, num_nodes, relabel_nodes=False)
+    return [sum(len(s) for s in subsets) for subsets, _, _ in layers]
+
+
+def nano_batch_costs(adjs: List[Adj],
+                     seeds: List[Tensor],
+                     num_nodes: int,
+                     cost_model: Optional[List[LayerCost]] = None) -> Tensor:
+    r"""Returns the cost of each sliced nano batch, with shared neighbors
+    counted once, to check how balanced a partition of the targets is.
+
+    Args:
+        adjs (List[Adj]): adjacency matrices, from the target layer outward.
+        seeds (List[Tensor]): target nodes of each nano batch.
+        num_nodes (int): number of nodes in the mini batch.
+        cost_model (List[LayerCost], optional): see :meth:`target_cost`.
+    """
+    if cost_model is None:
+        cost_model = edge_cost_model(len(adjs))
+    layers = slice_nano_batches(adjs, seeds, num_nodes, relabel_nodes=False)
+    costs = torch.zeros(len(seeds))
+    num_targets = torch.tensor([len(seed) for seed in seeds],
+                               dtype=torch.float)
+    for (subsets, edge_indices, _), layer_cost in zip(layers,
+                                                      cost_model[::-1]):
+        num_edges = torch.tensor([e.size(1) for e in edge_indices],
+                                 dtype=torch.float)
+        costs += layer_cost.edge * num_edges + layer_cost.node * num_targets
+        num_targets = torch.tensor([len(s) for s in subsets],
+                                   dtype=torch.float)
+    return costs
+
+
+def _nano_batch_layer_sizes(
+        adjs: List[Adj], seeds: List[Tensor],
+        num_nodes: int) -> List[List[Tuple[int, int, int]]]:
+    # (input nodes, output nodes, edges) of each layer of each nano batch,
+    # in model order. The label mask of slice_nano_batches needs
+    # num_nodes x num_nano_batch bytes, slice one by one past 64MB.
+    if num_nodes * len(seeds) <= 2**26:
+        layers = slice_nano_batches(adjs, seeds, num_nodes, False)
+        sliced = [([subsets[b] for subsets, _, _ in layers],
+                   [edge_indices[b] for _, edge_indices, _ in layers])
+                  for b in range(len(seeds))]
+    else:
+        sliced = _map_nano_batches(seeds, adjs, _build_csrs(adjs, True), False)
+    layer_sizes = []
+    for seed, (sub_nids, edge_indices) in zip(seeds, sliced):
+        sizes, num_target = [], len(seed)
+        for sub_nid, edge_index in zip(sub_nids, edge_indices):
+            sizes.append((len(sub_nid), num_target, edge_index.size(1)))
+            num_target = len(sub_nid)
+        layer_sizes.append(sizes[::-1])
+    return layer_sizes
+
+
+def auto_num_nano_batch(adjs: List[Adj],
+                        batch_size: int,
+                        memory_budget: float,
+                        memory_model: List[LayerMemory],
+                        min_num_nano_batch: int = 1,
+                        partition: Union[str, Callable] = "contiguous",
+                        num_nodes: Optional[int] = None) -> int:
+    r"""Returns the smallest number of nano batches whose largest estimated
+    activation footprint, see :meth:`estimate_memory`, fits in
+    :obj:`memory_budget` bytes. Fewer nano batches recompute fewer shared
+    neighbors. Returns :obj:`batch_size` when even single targets do not
+    fit.
+
+    The search starts from the footprint of a single nano batch holding
+    every target divided by the budget, a lower bound since the nano
+    batches cover it, then doubles and bisects, slicing the nano batches at
+    every step.
+
+    Args:
+        adjs (List[Adj]): adjacency matrices, from the target layer outward.
+        batch_size (int): number of targets.
+        memory_budget (float): bytes available for activations.
+        memory_model (List[LayerMemory]): bytes of each layer, in model
+            order, e.g. :meth:`sage_memory_model`.
+        min_num_nano_batch (int): smallest number tried. (default: :obj:`1`)
+        partition (str or Callable): see :meth:`partition_targets`.
+        num_nodes (int, optional): number of nodes in the mini batch.
+    """
+    assert memory_budget > 0, "memory_budget must be positive"
+    if num_nodes is None:
+        num_nodes = adjs[-1].size[0]
+
+    def fits(num_nano_batch):
+        seeds = partition_targets(adjs, batch_size, num_nano_batch, partition)
+        return max(
+            estimate_memory(sizes, memory_model) for sizes in
+            _nano_batch_layer_sizes(adjs, seeds, num_nodes)) <= memory_budget
+
+    whole = estimate_memory(
+        _nano_batch_layer_sizes(adjs, [torch.arange(batch_size)],
+                                num_nodes)[0], memory_model)
+    lo = max(min_num_nano_batch, math.ceil(whole / memory_budget))
+    lo = min(lo, batch_size)
+    if fits(lo):
+        return lo
+    hi = lo
+    while True:  # lo does not fit
+        lo, hi = hi, min(hi * 2, batch_size)
+        if fits(hi):
+            break
+        if hi == batch_size:
+            return batch_size
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if fits(mid):
+            hi = mid
+        else:
+            lo = mid
+    return hi
+
+
 # because neighbor sampler mappping the node index in edge index.
 # so we set sub_nid, adj.edge_index, relabel_nodes=True to get same output.
 def get_nano_batch(
@@ -97,6 +607,14 @@ def get_nano_batch(
     batch_size: int,
     num_nano_batch: int = 2,
     relabel_nodes: bool = True,
+    use_csr: bool = False,
+    vectorized: bool = False,
+    workspace: Optional[SliceWorkspace] = None,
+    num_threads: int = 1,
+    executor: Optional[Executor] = None,
+    partition: Union[str, Callable] = "contiguous",
+    memory_budget: Optional[float] = None,
+    memory_model: Optional[List[LayerMemory]] = None,
 ) -> List[Nanobatch]:
     r"""Create a list of `num_nano_batch` nanobatches
     from a list of adjacency matrices `adjs`.
@@ -104,72 +622,163 @@ def get_nano_batch(
     Args:
         adjs (List[Adj]): List of each layer adjacency matrices.
         n_id (torch.Tensor): Node indices.
-        batch_size: mini batch size
+        batch_size: mini batch size, every target is kept: the first
+            :obj:`batch_size % num_nano_batch` nano batches take one more,
+            see :meth:`nano_batch_sizes`
         num_nano_batch:  nano batch number
+        use_csr: build a :class:`CSR` of each adj once and slice every
+            nano batch with :meth:`slice_adj_csr`
+        vectorized: slice all nano batches at once with
+            :meth:`slice_nano_batches`
+        workspace: reuse the buffers of a :class:`SliceWorkspace`
+        num_threads: build nano batches concurrently on a thread pool,
+            each thread with its own workspace
+        executor: build nano batches on this executor instead
+        partition: how targets are grouped into nano batches, see
+            :meth:`partition_targets`. The targets of a nano batch are
+            :obj:`nb.n_id[:nb.size]`, contiguous only for "contiguous".
+        memory_budget: pick the number of nano batches of each mini batch
+            with :meth:`auto_num_nano_batch`, :obj:`num_nano_batch` is then
+            the smallest number tried
+        memory_model: bytes of each layer, needed by :obj:`memory_budget`
 
     :rtype: List[List[Tensor,int,list]]
     """
     assert (batch_size >= num_nano_batch
             ), "batch_size must be bigger than num_nano_batch"  # noqa
     n_id = torch.arange(len(n_id))  # relabel for mini batch
-    mod = batch_size % num_nano_batch
-    if mod != 0:
-        batch_size -= mod
-    assert batch_size % num_nano_batch == 0
     if not isinstance(adjs, list):
         adjs = [adjs]
     adjs.reverse()
-    nano_batch_size = batch_size // num_nano_batch
-    nano_batchs = []
-    for i in range(num_nano_batch):
-        sub_nid = n_id[i * nano_batch_size:(i + 1) *
-                       nano_batch_size]  # 从target node开始
-        subadjs = []
-        for adj in adjs:
-            target_size = len(sub_nid)
-            sub_nid, sub_adjs, edge_mask = slice_adj(
-                sub_nid,
-                adj.edge_index,
-                relabel_nodes=relabel_nodes,
-            )
-            subadjs.append(Adj(sub_adjs, None, (len(sub_nid), target_size)))
-        subadjs.reverse()  # O(n) 大的在前面
-        nano_batchs.append(Nanobatch(sub_nid, nano_batch_size, subadjs))
-    return nano_batchs
+    if memory_budget is not None:
+        num_nano_batch = auto_num_nano_batch(adjs, batch_size, memory_budget,
+                                             memory_model, num_nano_batch,
+                                             partition, len(n_id))
+    # 从target node开始
+    seeds = partition_targets(adjs, batch_size, num_nano_batch, partition)
+    if vectorized:
+        layers = slice_nano_batches(adjs,
+                                    seeds,
+                                    len(n_id),
+                                    relabel_nodes,
+                                    workspace=workspace)
+        return _to_nano_batchs(layers, seeds)
+    csrs = _build_csrs(adjs, use_csr)
+    sliced = _map_nano_batches(seeds, adjs, csrs, relabel_nodes, workspace,
+                               num_threads, executor)
+    return [
+        _to_nano_batch(sub_nids, edge_indices, len(seed))
+        for seed, (sub_nids, edge_indices) in zip(seeds, sliced)
+    ]
+
+
+def iter_nano_batches(
+    adjs: List[Adj],
+    n_id: Tensor,
+    batch_size: int,
+    num_nano_batch: int = 2,
+    relabel_nodes: bool = True,
+    use_csr: bool = False,
+    workspace: Optional[SliceWorkspace] = None,
+    prefetch: int = 0,
+    partition: Union[str, Callable] = "contiguous",
+    memory_budget: Optional[float] = None,
+    memory_model: Optional[List[LayerMemory]] = None,
+) -> Iterator[Nanobatch]:
+    r"""Generator version of :meth:`get_nano_batch`, yields each nano batch
+    as soon as it is sliced, so the training loop can run nano batch i
+    while nano batch i+1 is sliced and only a few nano batches are alive
+    at a time. Unlike :meth:`get_nano_batch`, :obj:`adjs` is not reversed
+    in place.
+
+    Args:
+        adjs (List[Adj]): List of each layer adjacency matrices.
+        n_id (torch.Tensor): Node indices.
+        batch_size: mini batch size
+        num_nano_batch:  nano batch number
+        use_csr: slice with :meth:`slice_adj_csr`
+        workspace: reuse the buffers of a :class:`SliceWorkspace`
+        prefetch: slice up to this many nano batches ahead on a background
+            thread. Defaults 0, slice on demand.
+        partition: see :meth:`partition_targets`
+        memory_budget: see :meth:`get_nano_batch`
+        memory_model: see :meth:`get_nano_batch`
+
+    :rtype: Iterator[Nanobatch]
+    """
+    assert (batch_size >= num_nano_batch
+            ), "batch_size must be bigger than num_nano_batch"  # noqa
+    assert prefetch >= 0, "prefetch must be non negative"
+    n_id = torch.arange(len(n_id))  # relabel for mini batch
+    if not isinstance(adjs, list):
+        adjs = [adjs]
+    adjs = adjs[::-1]
+    if memory_budget is not None:
+        num_nano_batch = auto_num_nano_batch(adjs, batch_size, memory_budget,
+                                             memory_model, num_nano_batch,
+                                             partition, len(n_id))
+    csrs = _build_csrs(adjs, use_csr)
+    seeds = partition_targets(adjs, batch_size, num_nano_batch, partition)
+    if prefetch == 0:
+        for seed in seeds:
+            yield _to_nano_batch(
+                *_slice_nano_batch(seed, adjs, csrs, relabel_nodes, workspace),
+                len(seed))
+        return
+
+    def work(seed):
+        return _to_nano_batch(
+            *_slice_nano_batch(seed, adjs, csrs, relabel_nodes,
+                               _thread_workspace()), len(seed))
+
+    executor = ThreadPoolExecutor(max_workers=1)
+    pending = deque()
+    try:
+        for seed in seeds:
+            pending.append(executor.submit(work, seed))
+            if len(pending) > prefetch:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
 
 
 # get nano batch for neighbor loader
-def get_loader_nano_batch(batch: Data, num_nano_batch: int,
-                          hop: int) -> List[Data]:
+def get_loader_nano_batch(
+        batch: Data,
+        num_nano_batch: int,
+        hop: int,
+        workspace: Optional[SliceWorkspace] = None) -> List[Data]:
     r"""Create a list of `num_nano_batch` nanobatches
     from Data.
     Args:
         num_nano_batch:  nano batch number
+        workspace: reuse the buffers of a :class:`SliceWorkspace`
     :rtype: List[Data]
     """
     batch_size = batch.batch_size
     assert (batch_size >= num_nano_batch
             ), "batch_size must be bigger than num_nano_batch"  # noqa
     n_id = torch.arange(len(batch.n_id))  # relabel for mini batch
-    mod = batch_size % num_nano_batch
-    if mod != 0:
-        batch_size -= mod
-    assert batch_size % num_nano_batch == 0
-    nano_batch_size = batch_size // num_nano_batch
     nano_batchs = []
-    for i in range(num_nano_batch):
-        sub_nid = n_id[i * nano_batch_size:(i + 1) *
-                       nano_batch_size]  # 从target node开始
+    # 从target node开始
+    for seed in n_id[:batch_size].split(
+            nano_batch_sizes(batch_size, num_nano_batch)):
+        sub_nid = seed
         for i in range(hop):
             sub_nid, sub_adjs, edge_mask = slice_adj(
                 sub_nid,
                 batch.edge_index,
                 relabel_nodes=True,
+                workspace=workspace,
             )
             sub_batch = Data(
                 edge_index=sub_adjs,
                 n_id=sub_nid,
-                batch_size=nano_batch_size,
+                batch_size=len(seed),
             )
         nano_batchs.append(sub_batch)
     return nano_batchs
@@ -180,6 +789,12 @@ def get_nano_batch_withlayer(
     n_id: Tensor,
     batch_size: int,
     num_micro_batch: int = 2,
+    use_csr: bool = False,
+    vectorized: bool = False,
+    workspace: Optional[SliceWorkspace] = None,
+    num_threads: int = 1,
+    executor: Optional[Executor] = None,
+    partition: Union[str, Callable] = "contiguous",
 ) -> List[List[Tensor]]:
     r"""Returns each layer node id
 
@@ -188,28 +803,32 @@ def get_nano_batch_withlayer(
         n_id (torch.Tensor): Node indices.
         batch_size (int): mini batch size
         num_nano_batch (int ): Number of micro-batches to create. Defaults 2
+        use_csr (bool): slice with :meth:`slice_adj_csr`. Defaults False
+        vectorized (bool): slice with :meth:`slice_nano_batches`.
+            Defaults False
+        workspace (SliceWorkspace): reuse its buffers. Defaults None
+        num_threads (int): slice on a pool of threads. Defaults 1
+        executor (Executor): slice on this executor. Defaults None
+        partition (str or Callable): see :meth:`partition_targets`.
+            Defaults "contiguous"
 
     :rtype: List[ each layer node id ]
     """
     assert batch_size >= num_micro_batch, "batch_size must < num_micro_batch"
     n_id = torch.arange(len(n_id))  # relabel for mini batch
-    mod = batch_size % num_micro_batch
-    if mod != 0:
-        batch_size -= mod
-    assert batch_size % num_micro_batch == 0
     adjs.reverse()
-    micro_batch_size = batch_size // num_micro_batch
-    nanobatchs = []
-    for i in range(num_micro_batch):
-        sub_nid = n_id[i * micro_batch_size:(i + 1) * micro_batch_size]
-        subnids = []
-        for adj in adjs:
-            sub_nid, sub_adjs, edge_mask = slice_adj(sub_nid,
-                                                     adj.edge_index,
-                                                     relabel_nodes=True)
-            subnids.append(sub_nid)  # layer 0 is interal
-        nanobatchs.append(subnids)
-    return nanobatchs
+    seeds = partition_targets(adjs, batch_size, num_micro_batch, partition)
+    if vectorized:
+        layers = slice_nano_batches(adjs,
+                                    seeds,
+                                    len(n_id),
+                                    workspace=workspace)
+        return [[subsets[b] for subsets, _, _ in layers]
+                for b in range(num_micro_batch)]
+    csrs = _build_csrs(adjs, use_csr)
+    sliced = _map_nano_batches(seeds, adjs, csrs, True, workspace, num_threads,
+                               executor)
+    return [subnids for subnids, _ in sliced]  # layer 0 is interal
 
 
 def get_nano_batch_histories(
@@ -217,6 +836,15 @@ def get_nano_batch_histories(
     n_id: Tensor,
     batch_size: int,
     num_nano_batch: int = 2,
+    use_csr: bool = False,
+    vectorized: bool = False,
+    workspace: Optional[SliceWorkspace] = None,
+    num_threads: int = 1,
+    executor: Optional[Executor] = None,
+    partition: Union[str, Callable] = "contiguous",
+    memory_budget: Optional[float] = None,
+    memory_model: Optional[List[LayerMemory]] = None,
+    return_plans: bool = False,
 ):
     r"""Create a list of `num_nano_batch` nanobatches
     from a list of adjacency matrices `adjs`.
@@ -226,42 +854,68 @@ def get_nano_batch_histories(
         n_id (torch.Tensor): Node indices.
         batch_size: mini batch size
         num_nano_batch:  nano batch number
+        use_csr: slice with :meth:`slice_adj_csr`
+        vectorized: slice with :meth:`slice_nano_batches`
+        workspace: reuse the buffers of a :class:`SliceWorkspace`
+        num_threads: slice nano batches concurrently on a thread pool, the
+            cached nodes are merged afterwards in nano batch order
+        executor: slice nano batches on this executor instead
+        partition: see :meth:`partition_targets`
+        memory_budget: see :meth:`get_nano_batch`
+        memory_model: see :meth:`get_nano_batch`
+        return_plans: return :meth:`plan_nano_batches` of the nano batches
+            instead, a :class:`PrunedPlan` per nano batch and the cached
+            nodes of each layer in model order
+
+    :rtype: (List[Nanobatch], List[Tensor]) the nano batches, and the
+        cached nodes of the output of each hidden layer in model order,
+        :obj:`cached_id[k]` for :obj:`histories[k]`
     """
     assert (batch_size >= num_nano_batch
             ), "batch_size must be bigger than num_nano_batch"  # noqa
-    mod = batch_size % num_nano_batch
-    if mod != 0:
-        batch_size -= mod
-    assert batch_size % num_nano_batch == 0, "batch_size must be divisible by num_nano_batch"
     assert isinstance(adjs, list), "adjs must be a list"
     adjs.reverse()
-    nano_batch_size = batch_size // num_nano_batch
+    if memory_budget is not None:
+        num_nano_batch = auto_num_nano_batch(adjs, batch_size, memory_budget,
+                                             memory_model, num_nano_batch,
+                                             partition, len(n_id))
+    seeds = partition_targets(adjs, batch_size, num_nano_batch, partition)
+    if vectorized:
+        layers = slice_nano_batches(adjs,
+                                    seeds,
+                                    len(n_id),
+                                    return_cached=True,
+                                    workspace=workspace)
+        nano_batchs = _to_nano_batchs(layers, seeds)
+        if return_plans:
+            return plan_nano_batches(nano_batchs, len(n_id))
+        # sliced from the target layer outward, histories are in model order
+        cached_tensor = [cached for _, _, cached in layers[-2::-1]]
+        return nano_batchs, cached_tensor
+    csrs = _build_csrs(adjs, use_csr)
+    sliced = _map_nano_batches(seeds, adjs, csrs, True, workspace, num_threads,
+                               executor)  # bottleneck
+    if return_plans:  # the plans track the cached nodes themselves
+        return plan_nano_batches([
+            _to_nano_batch(sub_nids, edge_indices, len(seed))
+            for seed, (sub_nids, edge_indices) in zip(seeds, sliced)
+        ], len(n_id))
     nano_batchs = []
     num_layers = len(adjs)
-    pin_memory = n_id.device is None or str(n_id.device) == "cpu"
+    pin_memory = torch.cuda.is_available() and (n_id.device is None
+                                                or str(n_id.device) == "cpu")
     cached_nodes = torch.full((num_layers - 1, len(n_id)),
                               False,
                               dtype=torch.bool,
                               device=n_id.device,
                               pin_memory=pin_memory)
     cached_id = [[] for i in range(num_layers - 1)]
-    n_id = torch.arange(len(n_id))  # relabel for mini batch
-    for i in range(num_nano_batch):
-        sub_nid = n_id[i * nano_batch_size:(i + 1) * nano_batch_size]
-        subadjs = []
-        for j, adj in enumerate(adjs):
-            target_size = len(sub_nid)
-            sub_nid, sub_adjs, _ = slice_adj(
-                sub_nid,
-                adj.edge_index,
-                relabel_nodes=True,
-            )  # bottleneck
-            if j != num_layers - 1:
-                cache_mask = torch.logical_not(cached_nodes[j][sub_nid])
-                cached_nodes[j][sub_nid[cache_mask]] = True  # bottleneck
-                cached_id[j].append(sub_nid[torch.logical_not(cache_mask)])
-            subadjs.append(Adj(sub_adjs, None, (len(sub_nid), target_size)))
-        subadjs.reverse()  # O(n) 大的在前面
-        nano_batchs.append(Nanobatch(sub_nid, nano_batch_size, subadjs))
-    cached_tensor = [torch.cat(ids) for ids in cached_id]
+    # the cache bookkeeping depends on the nano batch order, merge in order
+    for seed, (sub_nids, edge_indices) in zip(seeds, sliced):
+        for j, sub_nid in enumerate(sub_nids[:-1]):
+            cache_mask = torch.logical_not(cached_nodes[j][sub_nid])
+            cached_nodes[j][sub_nid[cache_mask]] = True  # bottleneck
+            cached_id[j].append(sub_nid[torch.logical_not(cache_mask)])
+        nano_batchs.append(_to_nano_batch(sub_nids, edge_indices, len(seed)))
+    cached_tensor = [torch.cat(ids) for ids in reversed(cached_id)]
     return nano_batchs, cached_tensor
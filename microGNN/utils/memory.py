@@ -0,0 +1,63 @@
+from typing import List, NamedTuple, Tuple
+
+from microGNN.utils.common_class import Nanobatch
+
+
+class LayerMemory(NamedTuple):
+    source: float  # bytes kept per input node of the layer
+    target: float  # bytes kept per output node of the layer
+    edge: float  # bytes kept per edge of the layer
+
+
+def sage_memory_model(channels: List[int],
+                      element_size: int = 4) -> List[LayerMemory]:
+    r"""Activation bytes of :class:`SAGE` layers kept for backward,
+    :obj:`channels` are the input channels of each layer followed by the
+    output channels, e.g. :obj:`[in_channels, hidden_channels,
+    out_channels]`: the layer input, the gathered messages, the mean
+    aggregation, then the two linear outputs, their sum and the relu."""
+    return [
+        LayerMemory(element_size * c_in, element_size * (c_in + 4 * c_out),
+                    element_size * c_in)
+        for c_in, c_out in zip(channels[:-1], channels[1:])
+    ]
+
+
+def gat_memory_model(channels: List[int],
+                     heads: int,
+                     element_size: int = 4) -> List[LayerMemory]:
+    r"""Activation bytes of :class:`GAT` layers with :obj:`heads` heads, see
+    :meth:`sage_memory_model`: the layer input and its projection per head,
+    per edge the attention logits, softmax and dropout per head and the
+    messages, per target the output, the skip connection and the elu."""
+    memory = []
+    for i, (c_in, c_out) in enumerate(zip(channels[:-1], channels[1:])):
+        c_in = c_in if i == 0 else c_in * heads
+        memory.append(
+            LayerMemory(element_size * (c_in + heads * c_out),
+                        element_size * 3 * heads * c_out,
+                        element_size * heads * (3 + c_out)))
+    return memory
+
+
+def estimate_memory(layer_sizes: List[Tuple[int, int, int]],
+                    memory_model: List[LayerMemory]) -> float:
+    r"""Estimates the activation bytes of one forward pass.
+
+    Args:
+        layer_sizes (List[Tuple[int, int, int]]): (input nodes, output
+            nodes, edges) of each layer, in model order.
+        memory_model (List[LayerMemory]): bytes of each layer.
+    """
+    assert len(layer_sizes) == len(memory_model), "one LayerMemory per layer"
+    return sum(num_source * memory.source + num_target * memory.target +
+               num_edges * memory.edge
+               for (num_source, num_target,
+                    num_edges), memory in zip(layer_sizes, memory_model))
+
+
+def nano_batch_memory(nano_batch: Nanobatch,
+                      memory_model: List[LayerMemory]) -> float:
+    r"""Estimates the activation bytes of training on :obj:`nano_batch`."""
+    return estimate_memory([(adj.size[0], adj.size[1], adj.edge_index.size(1))
+                            for adj in nano_batch.adjs], memory_model)
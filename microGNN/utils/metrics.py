@@ -13,14 +13,17 @@ def check_memory():
 
 def cal_metrics(arr: list) -> dict:
     """Calculate metrics for a list of numbers.
-    mean, median, std, min, max, 25%, 75%, 90%, 95%, 99%
+    mean, median, std, min, max, p25, p50, p75, p90, p95, p99
     """
     nparr = np.array(arr)
 
-    return {
+    metrics = {
         "mean": nparr.mean(),
         "median": np.median(nparr),
         "std": nparr.std(),
         "min": nparr.min(),
         "max": nparr.max(),
     }
+    for q in [25, 50, 75, 90, 95, 99]:
+        metrics[f"p{q}"] = np.percentile(nparr, q)
+    return metrics
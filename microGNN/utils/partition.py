@@ -0,0 +1,268 @@
+import warnings
+from typing import Callable, List, NamedTuple, Optional, Union
+
+import torch
+from torch import Tensor
+
+from microGNN.utils.common_class import Adj
+
+
+def _sparse(edge_index: Tensor, size) -> Tensor:
+    value = torch.ones(edge_index.size(1), device=edge_index.device)
+    return torch.sparse_coo_tensor(edge_index, value, size).coalesce()
+
+
+def _spmm(a: Tensor, b: Tensor) -> Tensor:
+    with warnings.catch_warnings():
+        # coo @ coo goes through csr internally, which warns it is beta
+        warnings.filterwarnings("ignore", message="Sparse CSR tensor")
+        return torch.sparse.mm(a, b).coalesce()
+
+
+def target_affinity(adjs: List[Adj],
+                    batch_size: int,
+                    depth: int = 1) -> Tensor:
+    r"""Returns the :obj:`[batch_size, batch_size]` sparse matrix of the
+    number of nodes shared by the :obj:`depth` hop receptive fields of each
+    pair of targets, without the diagonal.
+
+    Args:
+        adjs (List[Adj]): adjacency matrices, from the target layer outward.
+        batch_size (int): targets are the nodes :obj:`0..batch_size-1`.
+        depth (int): hops of the receptive fields. (default: :obj:`1`)
+    """
+    depth = min(depth, len(adjs))
+    device = adjs[0].edge_index.device
+    source, target = adjs[0].edge_index
+    mask = target < batch_size
+    num_nodes = max(adj.size[0] for adj in adjs[:depth])
+    self_loop = torch.arange(batch_size, device=device).repeat(2, 1)
+    index = torch.cat([torch.stack([target[mask], source[mask]]), self_loop],
+                      1)
+    field = _sparse(index, (batch_size, num_nodes))
+    for adj in adjs[1:depth]:
+        source, target = adj.edge_index
+        index = torch.cat([
+            torch.stack([target, source]),
+            torch.arange(num_nodes, device=device).repeat(2, 1)
+        ], 1)
+        field = _spmm(field, _sparse(index, (num_nodes, num_nodes)))
+        field = torch.sparse_coo_tensor(field.indices(),
+                                        torch.ones_like(field.values()),
+                                        field.size())
+    affinity = _spmm(field, field.t())
+    row, col = affinity.indices()
+    mask = row != col
+    return torch.sparse_coo_tensor(affinity.indices()[:, mask],
+                                   affinity.values()[mask],
+                                   affinity.size()).coalesce()
+
+
+def _to_parts(labels: Tensor, num_nano_batch: int) -> List[Tensor]:
+    return [(labels == b).nonzero().view(-1) for b in range(num_nano_batch)]
+
+
+def nano_batch_sizes(batch_size: int, num_nano_batch: int) -> List[int]:
+    r"""Sizes of the nano batches of a mini batch, the first
+    :obj:`batch_size % num_nano_batch` ones take one more target, no target
+    is dropped."""
+    size, mod = divmod(batch_size, num_nano_batch)
+    return [size + 1] * mod + [size] * (num_nano_batch - mod)
+
+
+def contiguous_partition(adjs: List[Adj], batch_size: int,
+                         num_nano_batch: int) -> List[Tensor]:
+    r"""Splits the targets by index ranges, the default partition."""
+    return list(
+        torch.arange(batch_size).split(
+            nano_batch_sizes(batch_size, num_nano_batch)))
+
+
+def greedy_partition(adjs: List[Adj],
+                     batch_size: int,
+                     num_nano_batch: int,
+                     depth: int = 1) -> List[Tensor]:
+    r"""Grows the nano batches one by one: each starts from the smallest
+    unassigned target, then repeatedly takes the unassigned target sharing
+    the most receptive field nodes with it, see :meth:`target_affinity`.
+    Runs :obj:`batch_size` sequential steps."""
+    sizes = nano_batch_sizes(batch_size, num_nano_batch)
+    affinity = target_affinity(adjs, batch_size, depth)
+    row, col = affinity.indices()
+    value = affinity.values()
+    rowptr = torch.zeros(batch_size + 1, dtype=torch.long)
+    rowptr[1:] = torch.cumsum(torch.bincount(row, minlength=batch_size), 0)
+    rowptr = rowptr.tolist()
+    labels = torch.full((batch_size, ), num_nano_batch - 1, dtype=torch.long)
+    assigned = torch.zeros(batch_size, dtype=torch.bool)
+    score = torch.empty(batch_size)
+    for b in range(num_nano_batch - 1):  # the last one takes the rest
+        score.fill_(0)
+        v = int(torch.argmax((~assigned).to(torch.uint8)))
+        for _ in range(sizes[b]):
+            labels[v] = b
+            assigned[v] = True
+            start, end = rowptr[v], rowptr[v + 1]
+            score.index_add_(0, col[start:end], value[start:end])
+            # ties go to the smallest target
+            v = int(torch.argmax(score.masked_fill(assigned, -1)))
+    return _to_parts(labels, num_nano_batch)
+
+
+def label_propagation_partition(adjs: List[Adj],
+                                batch_size: int,
+                                num_nano_batch: int,
+                                depth: int = 1,
+                                num_iters: int = 20,
+                                seed: int = 0) -> List[Tensor]:
+    r"""Balanced label propagation: starting from the contiguous partition,
+    targets move to the nano batch they share the most receptive field
+    nodes with. Nano batches keep the :meth:`nano_batch_sizes`, the targets
+    with the highest gain are moved first. Each iteration only
+    a random half of the targets may move, so pairs of targets do not keep
+    swapping nano batches."""
+    sizes = torch.tensor(nano_batch_sizes(batch_size, num_nano_batch))
+    affinity = target_affinity(adjs, batch_size, depth)
+    row, col = affinity.indices()
+    value = affinity.values()
+    labels = torch.arange(num_nano_batch).repeat_interleave(sizes)
+    arange = torch.arange(batch_size)
+    generator = torch.Generator().manual_seed(seed)
+    for _ in range(num_iters):
+        score = torch.zeros(batch_size, num_nano_batch)
+        score.index_put_((row, labels[col]), value, accumulate=True)
+        score[arange, labels] += 0.5  # ties keep the current nano batch
+        gain, pref = score.max(dim=1)
+        if torch.equal(pref, labels):
+            break
+        frozen = torch.rand(batch_size, generator=generator) < 0.5
+        pref[frozen] = labels[frozen]
+        gain[frozen] = float("inf")  # frozen targets keep their place
+        order = torch.argsort(-gain, stable=True)
+        order = order[torch.argsort(pref[order], stable=True)]
+        counts = torch.bincount(pref, minlength=num_nano_batch)
+        rank = arange - (torch.cumsum(counts, 0) - counts)[pref[order]]
+        accept = rank < sizes[pref[order]]
+        labels = torch.empty_like(labels)
+        labels[order[accept]] = pref[order[accept]]
+        free = sizes - torch.bincount(pref[order[accept]],
+                                      minlength=num_nano_batch)
+        slots = torch.arange(num_nano_batch).repeat_interleave(free)
+        labels[order[~accept]] = slots
+    return _to_parts(labels, num_nano_batch)
+
+
+class LayerCost(NamedTuple):
+    edge: float  # cost of aggregating one edge
+    node: float  # cost of updating one target node
+
+
+def edge_cost_model(num_layers: int) -> List[LayerCost]:
+    r"""Counts edges, balancing it equalizes the total edges."""
+    return [LayerCost(1.0, 0.0)] * num_layers
+
+
+def sage_cost_model(channels: List[int]) -> List[LayerCost]:
+    r"""FLOPs of :class:`SAGEConv` layers, :obj:`channels` are the input
+    channels of each layer followed by the output channels, e.g.
+    :obj:`[in_channels, hidden_channels, out_channels]`: mean aggregation
+    of the neighbors, then the root and neighbor linear layers."""
+    return [
+        LayerCost(float(c_in), 4.0 * c_in * c_out)
+        for c_in, c_out in zip(channels[:-1], channels[1:])
+    ]
+
+
+def gat_cost_model(channels: List[int], heads: int) -> List[LayerCost]:
+    r"""FLOPs of :class:`GATConv` layers with :obj:`heads` heads, see
+    :meth:`sage_cost_model`. Each edge computes an attention coefficient
+    and aggregates a message per head, each node is transformed per head.
+    Hidden layers take the concatenated heads as input."""
+    cost = []
+    for i, (c_in, c_out) in enumerate(zip(channels[:-1], channels[1:])):
+        c_in = c_in if i == 0 else c_in * heads
+        cost.append(LayerCost(heads * 3.0 * c_out, 2.0 * heads * c_in * c_out))
+    return cost
+
+
+def target_cost(adjs: List[Adj],
+                batch_size: int,
+                cost_model: Optional[List[LayerCost]] = None) -> Tensor:
+    r"""Estimates the cost of each target from the fan-in of its receptive
+    field tree, computed bottom-up with one scatter per layer. Nodes shared
+    by several targets are counted once per target.
+
+    Args:
+        adjs (List[Adj]): adjacency matrices, from the target layer outward.
+        batch_size (int): targets are the nodes :obj:`0..batch_size-1`.
+        cost_model (List[LayerCost], optional): cost of each layer, in
+            model order (the first layer consumes the input features).
+            Defaults to :meth:`edge_cost_model`.
+    """
+    if cost_model is None:
+        cost_model = edge_cost_model(len(adjs))
+    assert len(cost_model) == len(adjs), "one LayerCost per layer"
+    device = adjs[0].edge_index.device
+    cost = torch.zeros(adjs[-1].size[0], device=device)
+    # adjs[j] is consumed by the layer len(adjs) - 1 - j
+    for adj, layer_cost in zip(reversed(adjs), cost_model):
+        source, target = adj.edge_index
+        new_cost = torch.full((adj.size[1], ), layer_cost.node, device=device)
+        new_cost.index_add_(0, target, cost[source] + layer_cost.edge)
+        cost = new_cost
+    return cost[:batch_size]
+
+
+def balanced_partition(
+        adjs: List[Adj],
+        batch_size: int,
+        num_nano_batch: int,
+        cost_model: Optional[List[LayerCost]] = None) -> List[Tensor]:
+    r"""Balances the estimated cost of the nano batches, see
+    :meth:`target_cost`, so no straggler dominates the iteration time.
+    Longest processing time first under equal nano batch sizes: in each
+    round the :obj:`num_nano_batch` most expensive remaining targets go to
+    the nano batches, the most expensive one to the cheapest nano batch.
+    The last round may be short, then sizes differ by one."""
+    cost = target_cost(adjs, batch_size, cost_model).cpu()
+    order = torch.argsort(cost, descending=True, stable=True)
+    labels = torch.empty(batch_size, dtype=torch.long)
+    load = torch.zeros(num_nano_batch, dtype=cost.dtype)
+    for targets in order.split(num_nano_batch):
+        lightest = torch.argsort(load, stable=True)[:len(targets)]
+        labels[targets] = lightest
+        load[lightest] += cost[targets]
+    return _to_parts(labels, num_nano_batch)
+
+
+PARTITIONERS = {
+    "contiguous": contiguous_partition,
+    "greedy": greedy_partition,
+    "label_propagation": label_propagation_partition,
+    "balanced": balanced_partition,
+}
+
+
+def partition_targets(
+        adjs: List[Adj],
+        batch_size: int,
+        num_nano_batch: int,
+        strategy: Union[str, Callable] = "contiguous") -> List[Tensor]:
+    r"""Splits the targets :obj:`0..batch_size-1` into
+    :obj:`num_nano_batch` nano batches whose sizes differ by at most one.
+
+    Args:
+        adjs (List[Adj]): adjacency matrices, from the target layer outward.
+        batch_size (int): number of targets.
+        num_nano_batch (int): nano batch number.
+        strategy (str or Callable): a key of :obj:`PARTITIONERS`, or a
+            function with the same signature as :meth:`contiguous_partition`.
+
+    :rtype: List[Tensor] the sorted targets of each nano batch
+    """
+    assert (batch_size >= num_nano_batch
+            ), "batch_size must be bigger than num_nano_batch"  # noqa
+    if isinstance(strategy, str):
+        assert strategy in PARTITIONERS, f"unknown partition {strategy}"
+        strategy = PARTITIONERS[strategy]
+    return strategy(adjs, batch_size, num_nano_batch)
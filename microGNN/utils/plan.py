@@ -0,0 +1,96 @@
+from typing import List, Tuple
+
+import torch
+from torch import Tensor
+
+from microGNN.utils.common_class import Adj, LayerPlan, Nanobatch, PrunedPlan
+
+
+def _needed_sources(adj: Adj, edge_index: Tensor, needed: Tensor) -> Tensor:
+    # inputs of a layer feeding its kept edges and its needed roots
+    source_needed = torch.zeros(adj.size[0],
+                                dtype=torch.bool,
+                                device=needed.device)
+    source_needed[edge_index[0]] = True
+    source_needed[:adj.size[1]] |= needed
+    return source_needed
+
+
+def _compact_inputs(n_id: Tensor,
+                    layer: LayerPlan) -> Tuple[Tensor, LayerPlan]:
+    # drops the inputs of the first layer feeding no kept edge, its targets
+    # stay first as their rows are the outputs of the layer
+    keep = torch.zeros(layer.size[0], dtype=torch.bool, device=n_id.device)
+    keep[:layer.size[1]] = True
+    keep[layer.edge_index[0]] = True
+    num_inputs = int(keep.sum())
+    if num_inputs == layer.size[0]:
+        return n_id, layer
+    index = torch.cumsum(keep, 0) - 1  # new row of the kept inputs
+    edge_index = torch.stack((index[layer.edge_index[0]], layer.edge_index[1]))
+    return n_id[keep], layer._replace(edge_index=edge_index,
+                                      size=(num_inputs, layer.size[1]))
+
+
+def plan_nano_batches(nano_batchs: List[Nanobatch],
+                      num_nodes: int) -> Tuple[List[PrunedPlan], List[Tensor]]:
+    r"""Precomputes :meth:`prune_computation_graph` for every nano batch,
+    run in order on histories only written by the earlier nano batches.
+    Each :class:`PrunedPlan` holds per layer the kept edges, the output
+    rows read from the history and the computed rows written to it, with
+    their history slots, so the forward pass does no graph work. Only
+    computed rows are written, rows left out by pruning are not. The
+    inputs only feeding pruned nodes are dropped from :obj:`PrunedPlan.n_id`
+    and the first layer edges relabeled, so gathering the features and the
+    first layer shrink with the pruning.
+
+    Args:
+        nano_batchs (List[Nanobatch]): nano batches, in training order.
+        num_nodes (int): number of nodes of the mini batch.
+
+    :rtype: (List[PrunedPlan], List[Tensor]) the plans, and the sorted
+        nodes to build :obj:`History(cached_id[k], num_nodes, ...)` from
+        for the output of layer :obj:`k`: the outputs of several nano
+        batches.
+    """
+    num_layers = len(nano_batchs[0].adjs)
+    device = nano_batchs[0].n_id.device
+    cached_id, slots, pushed = [], [], []
+    for k in range(num_layers - 1):
+        count = torch.zeros(num_nodes, dtype=torch.long, device=device)
+        for nb in nano_batchs:
+            count[nb.n_id[:nb.adjs[k].size[1]]] += 1
+        ids = (count > 1).nonzero().view(-1)
+        slot = torch.full((num_nodes, ), -1, dtype=torch.long, device=device)
+        slot[ids] = torch.arange(len(ids), device=device)  # as History
+        cached_id.append(ids)
+        slots.append(slot)
+        pushed.append(torch.zeros(num_nodes, dtype=torch.bool, device=device))
+
+    plans = []
+    empty = torch.empty(0, dtype=torch.long, device=device)
+    for nb in nano_batchs:
+        last = nb.adjs[-1]
+        layers = [
+            LayerPlan(last.edge_index, last.size, empty, empty, empty, empty)
+        ]
+        needed = torch.ones(last.size[1], dtype=torch.bool, device=device)
+        for k in range(num_layers - 1, 0, -1):
+            source_needed = _needed_sources(nb.adjs[k], layers[0].edge_index,
+                                            needed)
+            ids = nb.n_id[:nb.adjs[k].size[0]]  # outputs of layer k - 1
+            cached = pushed[k - 1][ids]
+            needed = source_needed & ~cached
+            slot = slots[k - 1][ids]
+            pull_rows = (source_needed & cached).nonzero().view(-1)
+            push_rows = (needed & (slot >= 0)).nonzero().view(-1)
+            pushed[k - 1][ids[push_rows]] = True
+            adj = nb.adjs[k - 1]
+            layers.insert(
+                0,
+                LayerPlan(adj.edge_index[:, needed[adj.edge_index[1]]],
+                          adj.size, pull_rows, slot[pull_rows], push_rows,
+                          slot[push_rows]))
+        n_id, layers[0] = _compact_inputs(nb.n_id, layers[0])
+        plans.append(PrunedPlan(n_id, nb.size, layers))
+    return plans, cached_id
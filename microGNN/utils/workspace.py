@@ -0,0 +1,64 @@
+from typing import Dict, Tuple
+
+import torch
+from torch import Tensor
+
+
+class SliceWorkspace:
+    r"""Reusable buffers for :meth:`slice_adj` and the
+    :meth:`get_nano_batch` family.
+
+    Every buffer is kept filled with its fill value between calls: a caller
+    gets a clean view from :meth:`get`, and resets only the entries it
+    touched (sparse reset) before returning, instead of allocating and
+    filling a :obj:`num_nodes` sized tensor on every call. Buffers grow
+    geometrically by :obj:`growth`.
+
+    A workspace is not thread safe, use one per thread.
+
+    Args:
+        growth (float, optional): capacity multiplier when a buffer is too
+            small. (default: :obj:`2.0`)
+        dense_reset_ratio (int, optional): :meth:`reset` fills the whole
+            view when more than :obj:`1 / dense_reset_ratio` of it was
+            touched. (default: :obj:`8`)
+    """
+
+    def __init__(self, growth: float = 2.0, dense_reset_ratio: int = 8):
+        assert growth >= 1.0, "growth must be at least 1"
+        self.growth = growth
+        self.dense_reset_ratio = dense_reset_ratio
+        self._buffers: Dict[str, Tuple[Tensor, object]] = {}
+        self.num_allocs = 0
+
+    def get(self, name: str, size: int, dtype: torch.dtype, fill,
+            device) -> Tensor:
+        r"""Returns a view of :obj:`size` entries of buffer :obj:`name`, all
+        equal to :obj:`fill`."""
+        buf, buf_fill = self._buffers.get(name, (None, None))
+        if (buf is None or buf.numel() < size or buf.dtype != dtype
+                or buf.device != torch.device(device) or buf_fill != fill):
+            capacity = size
+            if buf is not None and buf.dtype == dtype:
+                capacity = max(size, int(buf.numel() * self.growth))
+            buf = torch.full((capacity, ), fill, dtype=dtype, device=device)
+            self._buffers[name] = (buf, fill)
+            self.num_allocs += 1
+        return buf[:size]
+
+    def reset(self, buf: Tensor, index: Tensor, fill):
+        r"""Sets the touched entries :obj:`index` of a view returned by
+        :meth:`get` back to :obj:`fill`. Falls back to filling the whole
+        view when most of it was touched, a memset is cheaper then."""
+        if index.numel() * self.dense_reset_ratio >= buf.size(0):
+            buf.fill_(fill)
+        else:
+            buf[index] = fill
+
+    def nbytes(self) -> int:
+        return sum(buf.numel() * buf.element_size()
+                   for buf, _ in self._buffers.values())
+
+    def __repr__(self) -> str:
+        return (f"{self.__class__.__name__}(buffers={list(self._buffers)}, "
+                f"nbytes={self.nbytes()})")
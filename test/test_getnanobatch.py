@@ -1,10 +1,16 @@
+from concurrent.futures import ThreadPoolExecutor
+
 import torch
 from torch import Tensor
 from torch_geometric.loader import NeighborSampler
 from torch_geometric.nn.conv import SAGEConv
 
 from microGNN.models import SAGE
-from microGNN.utils import get_nano_batch, get_nano_batch_histories, slice_adj
+from microGNN.utils import (SliceWorkspace, get_nano_batch,
+                            get_nano_batch_histories, get_nano_batch_withlayer,
+                            iter_nano_batches, nano_batch_memory,
+                            sage_memory_model, slice_adj, slice_adj_csr,
+                            to_csr)
 from microGNN.utils.common_class import Adj, Nanobatch
 
 hop = [-1, -1]
@@ -44,6 +50,238 @@ def test_slice_adj():
     assert edge_mask.tolist() == [True, False, False, True]
 
 
+def test_slice_adj_mask_dedup():
+    edge_index = torch.tensor([
+        [5, 1, 2, 5, 4, 0],
+        [2, 2, 4, 4, 6, 6],
+    ])
+    for node_idx in [6, [4, 6], [2, 6]]:
+        expected = slice_adj(node_idx, edge_index, relabel_nodes=True)
+        out = slice_adj(node_idx, edge_index, relabel_nodes=True, dedup="mask")
+        for a, b in zip(expected, out):
+            assert torch.equal(a, b)
+
+    subset, edge_index, _ = slice_adj([2, 4],
+                                      edge_index,
+                                      relabel_nodes=True,
+                                      dedup="mask",
+                                      keep_order=True)
+    assert subset.tolist() == [2, 4, 5, 1]
+    assert edge_index.tolist() == [[2, 3, 0, 2], [0, 0, 1, 1]]
+
+
+def test_slice_adj_csr():
+    torch.manual_seed(0)
+    edge_index = torch.randint(0, 50, (2, 400))
+    csr = to_csr(edge_index, 50)
+    for node_idx in [6, [0, 6], torch.randperm(50)[:10]]:
+        subset, sub_edge_index, edge_mask = slice_adj(node_idx,
+                                                      edge_index,
+                                                      relabel_nodes=True,
+                                                      num_nodes=50)
+        csr_subset, csr_edge_index, e_id = slice_adj_csr(node_idx,
+                                                         edge_index,
+                                                         csr,
+                                                         relabel_nodes=True)
+        assert torch.equal(subset, csr_subset)
+        assert torch.equal(sub_edge_index, csr_edge_index)
+        assert torch.equal(edge_mask.nonzero().view(-1), e_id)
+
+
+def test_get_nano_batch_csr():
+    edge1 = torch.tensor([[2, 3, 3, 4], [0, 0, 1, 1]])
+    edge2 = torch.tensor([[2, 3, 3, 4, 5, 6, 7], [0, 0, 1, 1, 2, 3, 4]])
+    adjs = [Adj(edge2, None, (8, 5)), Adj(edge1, None, (5, 2))]
+    nano_batchs = get_nano_batch(list(adjs), mb_n_id, 2, 2)
+    csr_nano_batchs = get_nano_batch(list(adjs), mb_n_id, 2, 2, use_csr=True)
+    for nb, csr_nb in zip(nano_batchs, csr_nano_batchs):
+        assert torch.equal(nb.n_id, csr_nb.n_id)
+        for adj, csr_adj in zip(nb.adjs, csr_nb.adjs):
+            assert torch.equal(adj.edge_index, csr_adj.edge_index)
+            assert adj.size == csr_adj.size
+
+
+def random_adjs(sizes=(12, 40, 120, 300), degree=5):
+    adjs = []
+    for target_size, source_size in zip(sizes[:-1], sizes[1:]):
+        target = torch.arange(target_size).repeat_interleave(degree)
+        source = torch.randint(0, source_size, (target_size * degree, ))
+        adjs.append(
+            Adj(torch.stack([source, target]), None,
+                (source_size, target_size)))
+    adjs.reverse()
+    return adjs
+
+
+def test_get_nano_batch_vectorized():
+    torch.manual_seed(1)
+    adjs = random_adjs()
+    n_id = torch.arange(300)
+    nano_batchs = get_nano_batch(list(adjs), n_id, 12, 4)
+    vec_nano_batchs = get_nano_batch(list(adjs), n_id, 12, 4, vectorized=True)
+    for nb, vec_nb in zip(nano_batchs, vec_nano_batchs):
+        assert torch.equal(nb.n_id, vec_nb.n_id)
+        assert nb.size == vec_nb.size
+        for adj, vec_adj in zip(nb.adjs, vec_nb.adjs):
+            assert torch.equal(adj.edge_index, vec_adj.edge_index)
+            assert adj.size == vec_adj.size
+
+    _, cached_id = get_nano_batch_histories(list(adjs),
+                                            n_id,
+                                            12,
+                                            4,
+                                            vectorized=True)
+    layernodes = get_nano_batch_withlayer(list(adjs), n_id, 12, 4)
+    for j in range(len(adjs) - 1):
+        seen, expected = set(), []
+        for nb_layernodes in layernodes:
+            nodes = nb_layernodes[j].tolist()
+            expected += [node for node in nodes if node in seen]
+            seen.update(nodes)
+        # cached_id is in model order, the layer nodes from the targets
+        assert cached_id[len(adjs) - 2 - j].tolist() == expected
+
+
+def test_get_nano_batch_workspace():
+    torch.manual_seed(1)
+    adjs = random_adjs()
+    n_id = torch.arange(300)
+    workspace = SliceWorkspace()
+    for kwargs in [{}, {"use_csr": True}, {"vectorized": True}]:
+        nano_batchs = get_nano_batch(list(adjs), n_id, 12, 4, **kwargs)
+        for _ in range(2):
+            ws_nano_batchs = get_nano_batch(list(adjs),
+                                            n_id,
+                                            12,
+                                            4,
+                                            workspace=workspace,
+                                            **kwargs)
+            for nb, ws_nb in zip(nano_batchs, ws_nano_batchs):
+                assert torch.equal(nb.n_id, ws_nb.n_id)
+                for adj, ws_adj in zip(nb.adjs, ws_nb.adjs):
+                    assert torch.equal(adj.edge_index, ws_adj.edge_index)
+    num_allocs = workspace.num_allocs
+    get_nano_batch(list(adjs), n_id, 12, 4, workspace=workspace)
+    assert workspace.num_allocs == num_allocs
+    # buffers are handed back clean
+    assert not workspace.get("node_mask", 300, torch.bool, False, "cpu").any()
+    assert (workspace.get("node_idx", 300, torch.long, -1, "cpu") == -1).all()
+    assert not workspace.get("labels", 300 * 4, torch.bool, False, "cpu").any()
+
+
+def test_get_nano_batch_threads():
+    torch.manual_seed(1)
+    adjs = random_adjs()
+    n_id = torch.arange(300)
+    for kwargs in [{}, {"use_csr": True}]:
+        nano_batchs, cached_id = get_nano_batch_histories(
+            list(adjs), n_id, 12, 4, **kwargs)
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            for threads in [{"num_threads": 4}, {"executor": executor}]:
+                thread_nano_batchs, thread_cached_id = (
+                    get_nano_batch_histories(list(adjs), n_id, 12, 4,
+                                             **threads, **kwargs))
+                for nb, thread_nb in zip(nano_batchs, thread_nano_batchs):
+                    assert torch.equal(nb.n_id, thread_nb.n_id)
+                    for adj, thread_adj in zip(nb.adjs, thread_nb.adjs):
+                        assert torch.equal(adj.edge_index,
+                                           thread_adj.edge_index)
+                        assert adj.size == thread_adj.size
+                for ids, thread_ids in zip(cached_id, thread_cached_id):
+                    assert torch.equal(ids, thread_ids)
+
+
+def test_iter_nano_batches():
+    torch.manual_seed(1)
+    adjs = random_adjs()
+    n_id = torch.arange(300)
+    nano_batchs = get_nano_batch(list(adjs), n_id, 12, 4)
+    for prefetch in [0, 2]:
+        iter_nano_batchs = iter_nano_batches(adjs,
+                                             n_id,
+                                             12,
+                                             4,
+                                             prefetch=prefetch)
+        assert adjs[0].size == (300, 120)  # lazy, adjs is not reversed
+        count = 0
+        for nb, iter_nb in zip(nano_batchs, iter_nano_batchs):
+            assert torch.equal(nb.n_id, iter_nb.n_id)
+            assert nb.size == iter_nb.size
+            for adj, iter_adj in zip(nb.adjs, iter_nb.adjs):
+                assert torch.equal(adj.edge_index, iter_adj.edge_index)
+                assert adj.size == iter_adj.size
+            count += 1
+        assert count == 4
+    # stopping early shuts the prefetch thread down
+    iter_nano_batchs = iter_nano_batches(adjs, n_id, 12, 4, prefetch=1)
+    next(iter_nano_batchs)
+    iter_nano_batchs.close()
+
+
+def test_get_nano_batch_uneven():
+    torch.manual_seed(1)
+    adjs = random_adjs((10, 40, 120, 300))
+    n_id = torch.arange(300)
+    nano_batchs = get_nano_batch(list(adjs), n_id, 10, 4)
+    assert [nb.size for nb in nano_batchs] == [3, 3, 2, 2]
+    targets = torch.cat([nb.n_id[:nb.size] for nb in nano_batchs])
+    assert targets.tolist() == list(range(10))  # no target is dropped
+    for nb in nano_batchs:
+        assert nb.adjs[-1].size[1] == nb.size
+    for kwargs in [{"vectorized": True}, {"use_csr": True}]:
+        other_nano_batchs = get_nano_batch(list(adjs), n_id, 10, 4, **kwargs)
+        for nb, other_nb in zip(nano_batchs, other_nano_batchs):
+            assert torch.equal(nb.n_id, other_nb.n_id)
+            assert nb.size == other_nb.size
+            for adj, other_adj in zip(nb.adjs, other_nb.adjs):
+                assert adj.size == other_adj.size
+    _, cached_id = get_nano_batch_histories(list(adjs), n_id, 10, 4)
+    _, vec_cached_id = get_nano_batch_histories(list(adjs),
+                                                n_id,
+                                                10,
+                                                4,
+                                                vectorized=True)
+    for ids, vec_ids in zip(cached_id, vec_cached_id):
+        assert torch.equal(ids, vec_ids)
+
+
+def test_auto_num_nano_batch():
+    torch.manual_seed(1)
+    adjs = random_adjs((64, 300, 1200), degree=4)
+    memory_model = sage_memory_model([16, 8, 4])
+    n_id = torch.arange(1200)
+
+    def largest(num_nano_batch):
+        nano_batchs = get_nano_batch(list(adjs), n_id, 64, num_nano_batch)
+        return max(nano_batch_memory(nb, memory_model) for nb in nano_batchs)
+
+    whole = largest(1)
+    for budget in [whole, whole / 3, whole / 10]:
+        nano_batchs = get_nano_batch(list(adjs),
+                                     n_id,
+                                     64,
+                                     1,
+                                     memory_budget=budget,
+                                     memory_model=memory_model)
+        num_nano_batch = len(nano_batchs)
+        assert largest(num_nano_batch) <= budget
+        assert num_nano_batch == 1 or largest(num_nano_batch - 1) > budget
+    assert len(
+        get_nano_batch(list(adjs),
+                       n_id,
+                       64,
+                       4,
+                       memory_budget=whole,
+                       memory_model=memory_model)) == 4
+    assert len(
+        get_nano_batch(list(adjs),
+                       n_id,
+                       64,
+                       1,
+                       memory_budget=1,
+                       memory_model=memory_model)) == 64
+
+
 def test_get_nano_batch_histories():
     n_id = torch.arange(node_num)
     edge1 = torch.tensor([[2, 3, 3, 4], [0, 0, 1, 1]])
@@ -0,0 +1,89 @@
+import torch
+from torch_geometric.loader import NeighborSampler
+from torch_geometric.utils import coalesce
+
+from microGNN import LayerwiseInference
+from microGNN.models import GAT, SAGE
+
+num_nodes = 50
+in_channels = 8
+hidden_channels = 4
+out_channels = 3
+
+
+def graph():
+    torch.manual_seed(12345)
+    edge_index = torch.randint(0, num_nodes, (2, 300))
+    return coalesce(edge_index, num_nodes=num_nodes)
+
+
+def test_layerwise_inference_sage():
+    edge_index = graph()
+    x = torch.randn(num_nodes, in_channels)
+    model = SAGE(in_channels, hidden_channels, out_channels, 3).eval()
+    loader = NeighborSampler(edge_index,
+                             sizes=[-1],
+                             batch_size=16,
+                             shuffle=False)
+    expected = model.inference(x, "cpu", loader)
+    engine = LayerwiseInference(edge_index, num_nodes, chunk_size=16)
+    assert len(engine.chunks) == 4
+    assert torch.allclose(engine.run(model, x), expected, atol=1e-5)
+    # layer ranges continue from a previous output
+    hidden = engine.run(model, x, end=1)
+    assert hidden.size() == (num_nodes, hidden_channels)
+    assert torch.allclose(engine.run(model, hidden, start=1),
+                          expected,
+                          atol=1e-5)
+
+
+def test_layerwise_inference_gat_mmap(tmp_path):
+    edge_index = graph()
+    x = torch.randn(num_nodes, in_channels)
+    model = GAT(in_channels, hidden_channels, out_channels, 2, 2).eval()
+    loader = NeighborSampler(edge_index,
+                             sizes=[-1],
+                             batch_size=7,
+                             shuffle=False)
+    with torch.no_grad():
+        expected = model.inference(x, "cpu", loader)
+    engine = LayerwiseInference(edge_index,
+                                num_nodes,
+                                chunk_size=7,
+                                num_threads=3,
+                                out_dir=str(tmp_path))
+    out = engine.run(model, x)
+    assert torch.allclose(out, expected, atol=1e-5)
+    assert (tmp_path /
+            "layer0.bin").stat().st_size == (num_nodes * hidden_channels * 2 *
+                                             4)
+    assert (tmp_path / "layer1.bin").exists()
+
+
+def test_layerwise_inference_cache(tmp_path):
+    edge_index = graph()
+    x = torch.randn(num_nodes, in_channels)
+    model = SAGE(in_channels, hidden_channels, out_channels, 3).eval()
+    engine = LayerwiseInference(edge_index,
+                                num_nodes,
+                                chunk_size=16,
+                                cache_dir=str(tmp_path))
+    expected = engine.run(model, x)
+    assert (engine.cache_hits, engine.cache_misses) == (0, 2)
+    assert len(list(tmp_path.glob("*.npy"))) == 2
+    assert torch.allclose(engine.run(model, x), expected)
+    assert (engine.cache_hits, engine.cache_misses) == (1, 2)
+    # a new head only recomputes the last layer
+    with torch.no_grad():
+        model.convs[2].lin_l.weight.mul_(2)
+    fresh = LayerwiseInference(edge_index, num_nodes, chunk_size=16)
+    assert torch.allclose(engine.run(model, x), fresh.run(model, x), atol=1e-6)
+    assert (engine.cache_hits, engine.cache_misses) == (2, 2)
+    # a changed middle layer reuses the first one only
+    with torch.no_grad():
+        model.convs[1].lin_l.weight.mul_(2)
+    assert torch.allclose(engine.run(model, x), fresh.run(model, x), atol=1e-6)
+    assert (engine.cache_hits, engine.cache_misses) == (3, 3)
+    # another input misses every layer
+    engine.run(model, x + 1)
+    assert (engine.cache_hits, engine.cache_misses) == (3, 5)
@@ -0,0 +1,120 @@
+import pytest
+import torch
+
+from microGNN.utils import (LayerCost, count_sliced_nodes, gat_cost_model,
+                            get_nano_batch, nano_batch_costs,
+                            partition_targets, sage_cost_model,
+                            target_affinity, target_cost)
+from microGNN.utils.common_class import Adj
+
+
+def two_community_adjs():
+    # targets 0, 2 share the neighbors 4, 6 and targets 1, 3 share 5, 7
+    edge1 = torch.tensor([[4, 6, 4, 6, 5, 7, 5, 7], [0, 0, 2, 2, 1, 1, 3, 3]])
+    adjs1 = Adj(edge1, None, (8, 4))
+    edge2 = torch.tensor([[8, 9, 10, 11], [4, 6, 5, 7]])
+    adjs2 = Adj(edge2, None, (12, 8))
+    return [adjs1, adjs2]  # from the target layer outward
+
+
+def test_target_affinity():
+    adjs = two_community_adjs()
+    affinity = target_affinity(adjs, 4).to_dense()
+    assert affinity.tolist() == [[0, 0, 2, 0], [0, 0, 0, 2], [2, 0, 0, 0],
+                                 [0, 2, 0, 0]]
+    affinity = target_affinity(adjs, 4, depth=2).to_dense()
+    assert affinity[0, 2] == 4
+
+
+@pytest.mark.parametrize("strategy",
+                         ["contiguous", "greedy", "label_propagation"])
+def test_partition_targets(strategy):
+    adjs = two_community_adjs()
+    seeds = partition_targets(adjs, 4, 2, strategy)
+    assert torch.cat(seeds).sort().values.tolist() == [0, 1, 2, 3]
+    assert [len(seed) for seed in seeds] == [2, 2]
+    if strategy == "contiguous":
+        assert count_sliced_nodes(adjs, seeds, 12) == [12, 20]
+    else:
+        assert sorted(seed.tolist() for seed in seeds) == [[0, 2], [1, 3]]
+        assert count_sliced_nodes(adjs, seeds, 12) == [8, 12]
+
+
+@pytest.mark.parametrize(
+    "strategy", ["contiguous", "greedy", "label_propagation", "balanced"])
+def test_partition_uneven(strategy):
+    torch.manual_seed(1)
+    source = torch.randint(0, 60, (70, ))
+    target = torch.arange(14).repeat_interleave(5)
+    adjs = [Adj(torch.stack([source, target]), None, (60, 14))]
+    seeds = partition_targets(adjs, 14, 4, strategy)
+    assert torch.cat(seeds).sort().values.tolist() == list(range(14))
+    assert sorted(len(seed) for seed in seeds) == [3, 3, 4, 4]
+
+
+def test_get_nano_batch_partition():
+    adjs = two_community_adjs()
+    nano_batchs = get_nano_batch(adjs[::-1],
+                                 torch.arange(12),
+                                 4,
+                                 2,
+                                 partition="greedy")
+    assert nano_batchs[0].n_id[:nano_batchs[0].size].tolist() == [0, 2]
+    assert nano_batchs[0].n_id.tolist() == [0, 2, 4, 6, 8, 9]
+    assert nano_batchs[1].n_id.tolist() == [1, 3, 5, 7, 10, 11]
+    nano_batchs = get_nano_batch(
+        adjs[::-1],
+        torch.arange(12),
+        4,
+        2,
+        partition=lambda adjs, batch_size, num:
+        [torch.tensor([3, 1]), torch.tensor([0, 2])])
+    assert nano_batchs[0].n_id[:nano_batchs[0].size].tolist() == [3, 1]
+
+
+def skewed_adjs():
+    # target 0 has 4 neighbors, each with 2 neighbors, the others 1 and 1
+    edge1 = torch.tensor([[4, 5, 6, 7, 8, 9, 10], [0, 0, 0, 0, 1, 2, 3]])
+    adjs1 = Adj(edge1, None, (11, 4))
+    source = torch.arange(11, 25)
+    target = torch.tensor([4, 4, 5, 5, 6, 6, 7, 7, 8, 9, 10, 1, 2, 3])
+    adjs2 = Adj(torch.stack([source, target]), None, (25, 11))
+    return [adjs1, adjs2]
+
+
+def test_target_cost():
+    adjs = skewed_adjs()
+    assert target_cost(adjs, 4).tolist() == [12, 2, 2, 2]
+    cost_model = [LayerCost(1.0, 10.0), LayerCost(2.0, 0.0)]
+    # first layer node 4: 10 + 2 * 1 and node 8: 10 + 1,
+    # target 0: 4 * (12 + 2), target 1: 11 + 2
+    assert target_cost(adjs, 4, cost_model).tolist() == [56, 13, 13, 13]
+    assert len(sage_cost_model([8, 4, 2])) == 2
+    assert gat_cost_model([8, 4, 2], heads=2)[1].node == 2 * 2 * 8 * 2
+
+
+def test_balanced_partition():
+    adjs = skewed_adjs()
+    seeds = partition_targets(adjs, 4, 2, "contiguous")
+    assert nano_batch_costs(adjs, seeds, 25).tolist() == [15, 6]
+    # round one puts 0 and 1 apart, round two gives 2 to the cheaper one
+    seeds = partition_targets(adjs, 4, 2, "balanced")
+    assert [seed.tolist() for seed in seeds] == [[0, 3], [1, 2]]
+    assert nano_batch_costs(adjs, seeds, 25).tolist() == [15, 6]
+
+    # power-law fan-in, heavy targets first
+    torch.manual_seed(1)
+    adjs = []
+    for target_size, source_size in [(64, 400), (400, 2000)]:
+        degree = torch.rand(target_size).pow(-1.0).long().clamp(1, 50)
+        degree = degree.sort(descending=True).values
+        target = torch.arange(target_size).repeat_interleave(degree)
+        source = torch.randint(0, source_size, (target.size(0), ))
+        adjs.append(
+            Adj(torch.stack([source, target]), None,
+                (source_size, target_size)))
+    costs = [
+        nano_batch_costs(adjs, partition_targets(adjs, 64, 4, strategy), 2000)
+        for strategy in ["contiguous", "balanced"]
+    ]
+    assert costs[1].max() < costs[0].max()
@@ -1,7 +1,10 @@
 import torch
+from torch_geometric.loader import NeighborSampler
 from torch_geometric.nn.conv import SAGEConv
+from torch_geometric.utils import coalesce
 
-from microGNN import History
+from microGNN import CSRSampler, History
+from microGNN.models import SAGE, ScaleSAGE
 from microGNN.prune import prune_computation_graph
 from microGNN.utils import get_nano_batch, get_nano_batch_histories
 from microGNN.utils.common_class import Adj
@@ -92,3 +95,157 @@ def test_prune_computatition_graph():
     pruned_adjs = prune_computation_graph(nb.n_id, nb.adjs, histories)
     assert pruned_adjs[0].edge_index.tolist() == [[1, 2, 4], [0, 0, 2]]
     assert pruned_adjs[1].edge_index.tolist() == [[1, 2], [0, 0]]
+
+
+def test_plan_nano_batches():
+    mb_n_id = torch.arange(8)
+    edge1 = torch.tensor([[2, 3, 3, 4], [0, 0, 1, 1]])
+    edge2 = torch.tensor([[2, 3, 3, 4, 5, 6, 7], [0, 0, 1, 1, 2, 3, 4]])
+    adjs = [Adj(edge2, None, (8, 5)), Adj(edge1, None, (5, 2))]
+    nano_batchs = get_nano_batch(list(adjs),
+                                 mb_n_id,
+                                 batch_size=2,
+                                 num_nano_batch=2)
+    plans, cached_id = get_nano_batch_histories(list(adjs),
+                                                mb_n_id,
+                                                batch_size=2,
+                                                num_nano_batch=2,
+                                                return_plans=True)
+    assert [ids.tolist() for ids in cached_id] == [[3]]
+    histories = torch.nn.ModuleList([
+        History(cacheid, node_num, hidden_channels, 'cpu')
+        for cacheid in cached_id
+    ])
+    # the first nano batch computes node 3 and writes it to slot 0
+    first, second = plans[0].layers[0], plans[1].layers[0]
+    assert plans[0].n_id[first.push_rows].tolist() == [3]
+    assert first.push_slots.tolist() == [0] and first.pull_rows.numel() == 0
+    # the second one reads it and drops the edge computing it
+    assert plans[1].n_id[second.pull_rows].tolist() == [3]
+    assert second.pull_slots.tolist() == [0]
+    assert second.push_rows.numel() == 0
+    # node 6 only fed node 3, its input row is dropped
+    assert plans[1].n_id.tolist() == [1, 3, 4, 7]
+    assert second.edge_index.tolist() == [[1, 2, 3], [0, 0, 2]]
+    assert second.size == (4, 3)
+    # same edges as pruning at forward time on the filled histories
+    for plan, nb in zip(plans, nano_batchs):
+        pruned_adjs = prune_computation_graph(nb.n_id, nb.adjs, histories)
+        for adj, layer in zip(pruned_adjs, plan.layers):
+            assert torch.equal(nb.n_id[adj.edge_index],
+                               plan.n_id[layer.edge_index])
+        x = torch.randn(len(plan.n_id), hidden_channels)
+        histories[0].pull_push_plan(x, plan.layers[0], plan.n_id)
+
+
+def test_prune_three_layers():
+    torch.manual_seed(5)
+    num_nodes = 40
+    edge_index = torch.randint(0, num_nodes, (2, 160))
+    loader = NeighborSampler(edge_index,
+                             sizes=[-1, -1, -1],
+                             batch_size=6,
+                             shuffle=False)
+    batch_size, n_id, adjs = next(iter(loader))
+    nano_batchs, cached_id = get_nano_batch_histories(adjs,
+                                                      torch.arange(len(n_id)),
+                                                      batch_size,
+                                                      num_nano_batch=3)
+    histories = torch.nn.ModuleList([
+        History(cacheid, len(n_id), hidden_channels, 'cpu')
+        for cacheid in cached_id
+    ])
+    model1 = ScaleSAGE(in_channels, hidden_channels, out_channels, 3)
+    model2 = SAGE(in_channels, hidden_channels, out_channels, 3)
+    model2.load_state_dict(model1.state_dict())
+    x = torch.randn(num_nodes, in_channels)[n_id]
+    num_pruned = 0
+    for nb in nano_batchs:
+        edges = [adj.edge_index.clone() for adj in nb.adjs]
+        pruned_adjs = prune_computation_graph(nb.n_id, nb.adjs, histories)
+        for edge, adj in zip(edges, nb.adjs):  # not modified
+            assert torch.equal(edge, adj.edge_index)
+        num_pruned += sum(
+            adj.edge_index.size(1) - pruned.edge_index.size(1)
+            for adj, pruned in zip(nb.adjs, pruned_adjs))
+        out1 = model1(x[nb.n_id], nb.n_id, nb.adjs, histories)
+        out2 = model2(x[nb.n_id], nb.adjs)
+        assert torch.allclose(out1, out2, atol=1e-6)
+    assert num_pruned > 0
+
+
+def test_plan_three_layers():
+    torch.manual_seed(5)
+    num_nodes = 40
+    edge_index = torch.randint(0, num_nodes, (2, 160))
+    loader = NeighborSampler(edge_index,
+                             sizes=[-1, -1, -1],
+                             batch_size=6,
+                             shuffle=False)
+    batch_size, n_id, adjs = next(iter(loader))
+    plans, cached_id = get_nano_batch_histories(list(adjs),
+                                                torch.arange(len(n_id)),
+                                                batch_size,
+                                                num_nano_batch=3,
+                                                return_plans=True)
+    histories = torch.nn.ModuleList([
+        History(cacheid, len(n_id), hidden_channels, 'cpu')
+        for cacheid in cached_id
+    ])
+    model1 = ScaleSAGE(in_channels, hidden_channels, out_channels, 3)
+    model2 = SAGE(in_channels, hidden_channels, out_channels, 3)
+    model2.load_state_dict(model1.state_dict())
+    x = torch.randn(num_nodes, in_channels)[n_id]
+    nano_batchs = get_nano_batch(list(adjs), torch.arange(len(n_id)),
+                                 batch_size, 3)
+    num_pulled, num_dropped = 0, 0
+    for plan, nb in zip(plans, nano_batchs):
+        num_dropped += len(nb.n_id) - len(plan.n_id)
+        assert torch.equal(plan.n_id[:plan.layers[0].size[1]],
+                           nb.n_id[:nb.adjs[0].size[1]])
+        out1 = model1(x[plan.n_id], plan.n_id, None, histories, plan=plan)
+        out2 = model2(x[nb.n_id], nb.adjs)
+        assert torch.allclose(out1, out2, atol=1e-6)
+        num_pulled += sum(layer.pull_rows.numel() for layer in plan.layers)
+        for layer in plan.layers:  # rows are either read or computed
+            assert not set(layer.pull_rows.tolist()) & set(
+                layer.push_rows.tolist())
+    assert num_pulled > 0 and num_dropped > 0
+
+
+def test_prune_three_layers_model_order():
+    torch.manual_seed(6)
+    num_nodes = 60
+    edge_index = coalesce(torch.randint(0, num_nodes, (2, 200)),
+                          num_nodes=num_nodes)
+    sampler = CSRSampler(edge_index, [-1, -1, -1], num_nodes)
+    n_id, batch_size, adjs = sampler.sample(torch.arange(6))
+    _, plan_cached_id = get_nano_batch_histories(list(adjs),
+                                                 torch.arange(len(n_id)),
+                                                 batch_size,
+                                                 num_nano_batch=3,
+                                                 return_plans=True)
+    for kwargs in [{}, {"vectorized": True}]:
+        nano_batchs, cached_id = get_nano_batch_histories(
+            list(adjs), torch.arange(len(n_id)), batch_size, 3, **kwargs)
+        # cached_id[k] holds outputs of layer k, as the plans and pruning
+        for ids, plan_ids in zip(cached_id, plan_cached_id):
+            assert torch.equal(torch.unique(ids), plan_ids)
+        histories = torch.nn.ModuleList([
+            History(cacheid, len(n_id), hidden_channels, 'cpu')
+            for cacheid in cached_id
+        ])
+        model1 = ScaleSAGE(in_channels, hidden_channels, out_channels, 3)
+        model2 = SAGE(in_channels, hidden_channels, out_channels, 3)
+        model2.load_state_dict(model1.state_dict())
+        x = torch.randn(num_nodes, in_channels)[n_id]
+        num_pruned = 0
+        for nb in nano_batchs:
+            pruned_adjs = prune_computation_graph(nb.n_id, nb.adjs, histories)
+            num_pruned += sum(
+                adj.edge_index.size(1) - pruned.edge_index.size(1)
+                for adj, pruned in zip(nb.adjs, pruned_adjs))
+            out1 = model1(x[nb.n_id], nb.n_id, nb.adjs, histories)
+            out2 = model2(x[nb.n_id], nb.adjs)
+            assert torch.allclose(out1, out2, atol=1e-6)
+        assert num_pruned > 0
@@ -0,0 +1,92 @@
+import pickle
+
+import torch
+from torch_geometric.utils import coalesce
+
+from microGNN import CSRSampler
+from microGNN.models import SAGE
+from microGNN.sampler import sample_offsets
+from microGNN.utils import get_nano_batch
+
+num_nodes = 60
+
+
+def graph():
+    torch.manual_seed(12345)
+    return coalesce(torch.randint(0, num_nodes, (2, 600)), num_nodes=num_nodes)
+
+
+def check_adjs(edge_index, n_id, batch_size, adjs, sizes):
+    edges = set(map(tuple, edge_index.t().tolist()))
+    assert n_id.unique().numel() == n_id.numel()
+    num_targets = batch_size
+    for adj, k in zip(adjs[::-1], sizes):  # from the seeds outward
+        assert adj.size[1] == num_targets
+        source, target = n_id[adj.edge_index]
+        assert set(zip(source.tolist(), target.tolist())) <= edges
+        count = torch.bincount(adj.edge_index[1], minlength=num_targets)
+        deg = torch.bincount(edge_index[1], minlength=num_nodes)
+        assert torch.equal(
+            count,
+            deg[n_id[:num_targets]].clamp(max=k if k >= 0 else num_nodes))
+        # sampled neighbors are distinct
+        assert adj.edge_index.t().unique(dim=0).size(0) == count.sum()
+        num_targets = adj.size[0]
+    assert num_targets == n_id.numel()
+
+
+def test_sample_offsets():
+    torch.manual_seed(0)
+    deg = torch.tensor([3, 5, 100, 3])
+    offsets = sample_offsets(deg, 3)
+    for row, d in zip(offsets.tolist(), deg.tolist()):
+        assert len(set(row)) == 3 and 0 <= min(row) and max(row) < d
+    # uniform: every offset of a degree 4 row is drawn about k / 4 times
+    offsets = sample_offsets(torch.full((4000, ), 4), 2)
+    counts = torch.bincount(offsets.view(-1), minlength=4)
+    assert ((counts - 2000).abs() < 150).all()
+
+
+def test_csr_sampler():
+    edge_index = graph()
+    seeds = torch.tensor([3, 7, 11, 40])
+    for sizes in [[2, 3], [-1, 4], [3, 3, -1]]:
+        sampler = CSRSampler(edge_index, sizes, num_nodes)
+        n_id, batch_size, adjs = sampler.sample(seeds)
+        assert batch_size == 4 and torch.equal(n_id[:4], seeds)
+        assert len(adjs) == len(sizes)
+        check_adjs(edge_index, n_id, batch_size, adjs, sizes)
+    # the node map is clean for the next mini batch
+    n_id, batch_size, adjs = sampler.sample(torch.tensor([5]))
+    check_adjs(edge_index, n_id, batch_size, adjs, sizes)
+
+
+def test_csr_sampler_threads():
+    edge_index = graph()
+    seeds = torch.arange(0, num_nodes, 2)
+    sampler = CSRSampler(edge_index, [3, 2],
+                         num_nodes,
+                         num_threads=3,
+                         chunk_size=4)
+    torch.manual_seed(1)
+    n_id, batch_size, adjs = sampler.sample(seeds)
+    check_adjs(edge_index, n_id, batch_size, adjs, [3, 2])
+    torch.manual_seed(1)
+    assert torch.equal(sampler.sample(seeds)[0], n_id)
+    # sent to sampling processes
+    torch.manual_seed(1)
+    assert torch.equal(
+        pickle.loads(pickle.dumps(sampler)).sample(seeds)[0], n_id)
+
+
+def test_csr_sampler_nano_batch():
+    edge_index = graph()
+    sampler = CSRSampler(edge_index, [4, 3], num_nodes)
+    n_id, batch_size, adjs = sampler.sample(torch.arange(8))
+    x = torch.randn(num_nodes, 5)
+    model = SAGE(5, 4, 2, 2)
+    out = model(x[n_id], adjs)
+    nano_batchs = get_nano_batch(list(adjs), n_id, batch_size, 2)
+    nano_out = torch.cat(
+        [model(x[n_id][nb.n_id], nb.adjs) for nb in nano_batchs])
+    assert torch.allclose(out, nano_out, atol=1e-6)
@@ -0,0 +1,111 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+from torch_geometric.loader import NeighborSampler
+from torch_geometric.utils import coalesce
+
+from microGNN import EmbeddingServer, LayerwiseInference, NodePredictor
+from microGNN.models import GAT, SAGE
+from microGNN.serving import one_hop
+from microGNN.utils import cal_metrics
+
+num_nodes = 50
+in_channels = 8
+hidden_channels = 4
+out_channels = 3
+
+
+def setup(model):
+    torch.manual_seed(12345)
+    edge_index = coalesce(torch.randint(0, num_nodes, (2, 300)),
+                          num_nodes=num_nodes)
+    x = torch.randn(num_nodes, in_channels)
+    loader = NeighborSampler(edge_index,
+                             sizes=[-1],
+                             batch_size=num_nodes,
+                             shuffle=False)
+    with torch.no_grad():
+        expected = model.eval().inference(x, "cpu", loader).log_softmax(-1)
+    engine = LayerwiseInference(edge_index, num_nodes, chunk_size=16)
+    return x, edge_index, engine, expected
+
+
+def test_one_hop():
+    edge_index = torch.tensor([[1, 2, 3, 4, 0, 4], [0, 0, 2, 2, 3, 3]])
+    engine = LayerwiseInference(edge_index, 5)
+    n_id, edges, size = one_hop(torch.tensor([0, 3]), engine.csr)
+    assert n_id.tolist() == [0, 3, 1, 2, 4]
+    assert edges.tolist() == [[2, 3, 0, 4], [0, 0, 1, 1]]
+    assert size == (5, 2)
+
+
+def test_embedding_server():
+    model = SAGE(in_channels, hidden_channels, out_channels, 3)
+    x, edge_index, engine, expected = setup(model)
+    with EmbeddingServer(model, x, engine, max_wait=0.5) as server:
+        node_ids = [torch.randint(0, num_nodes, (5, )) for _ in range(8)]
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            outs = list(pool.map(server.predict, node_ids))
+        for ids, out in zip(node_ids, outs):
+            assert torch.allclose(out, expected[ids], atol=1e-5)
+        # concurrent requests share passes
+        assert len(server.batch_sizes) < len(node_ids)
+        assert sum(server.batch_sizes) == 40
+        metrics = server.metrics()
+    assert metrics["p50"] <= metrics["p99"] <= metrics["max"]
+    assert metrics["throughput"] > 0
+
+
+def test_embedding_server_gat():
+    model = GAT(in_channels, hidden_channels, out_channels, 2, 2)
+    x, edge_index, engine, expected = setup(model)
+    with EmbeddingServer(model, x, engine, max_wait=0) as server:
+        ids = torch.tensor([7, 3, 7, 49])
+        assert torch.allclose(server.predict(ids), expected[ids], atol=1e-5)
+        assert server.batch_sizes == [4]
+
+
+def test_cal_metrics_percentiles():
+    metrics = cal_metrics(list(range(101)))
+    assert metrics["p50"] == metrics["median"] == 50
+    assert metrics["p99"] == 99
+
+
+def test_node_predictor():
+    model = SAGE(in_channels, hidden_channels, out_channels, 3)
+    x, edge_index, engine, expected = setup(model)
+    predictor = NodePredictor(model, x, edge_index, num_nodes)
+    ids = torch.tensor([5, 1, 5])
+    assert torch.allclose(predictor.predict_nodes(ids),
+                          expected[ids],
+                          atol=1e-5)
+    assert [h.hits for h in predictor.histories] == [0, 0]
+    # overlapping queries read the kept embeddings
+    ids = torch.tensor([1, 2, 30])
+    assert torch.allclose(predictor.predict_nodes(ids),
+                          expected[ids],
+                          atol=1e-5)
+    assert all(h.hits > 0 for h in predictor.histories)
+    # a tiny budget evicts, the results stay exact
+    predictor = NodePredictor(model,
+                              x,
+                              edge_index,
+                              num_nodes,
+                              memory_budget=4 * hidden_channels * 3)
+    for _ in range(2):
+        ids = torch.randint(0, num_nodes, (6, ))
+        assert torch.allclose(predictor.predict_nodes(ids),
+                              expected[ids],
+                              atol=1e-5)
+    assert predictor.histories[0].capacity == 3
+
+
+def test_node_predictor_gat():
+    model = GAT(in_channels, hidden_channels, out_channels, 2, 2)
+    x, edge_index, engine, expected = setup(model)
+    predictor = NodePredictor(model, x, edge_index)
+    for ids in [torch.tensor([0, 9]), torch.tensor([9, 10, 0])]:
+        assert torch.allclose(predictor.predict_nodes(ids),
+                              expected[ids],
+                              atol=1e-5)
+    assert predictor.histories[0].hits > 0
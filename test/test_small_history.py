@@ -1,15 +1,19 @@
 from timeit import default_timer as timer
 
+import numpy as np
+import pytest
 import torch
 import torch.nn.functional as F
 from torch_geometric.loader import NeighborSampler
 from torch_geometric.nn.conv import SAGEConv
 from torch_geometric.testing.decorators import withCUDA
+from torch_geometric.utils import coalesce
 
-from microGNN import History
+from microGNN import (CSRSampler, GlobalHistory, History, HistoryPool,
+                      MmapHistory)
 from microGNN.models import SAGE, ScaleSAGE
 from microGNN.prune import prune_computation_graph
-from microGNN.utils import get_nano_batch_histories
+from microGNN.utils import get_nano_batch, get_nano_batch_histories
 from microGNN.utils.common_class import Adj
 
 hop = [-1, -1]
@@ -337,6 +341,329 @@ def test_init_history():
                        torch.tensor([-1, -1, -1, 0, -1, -1, -1, -1]))
 
 
+def test_pull_push():
+    torch.manual_seed(0)
+    target_id = torch.tensor([0, 3, 5, 1, 6])
+    fused = History(torch.tensor([3, 1, 6]), node_num, hidden_channels, 'cpu')
+    unfused = History(torch.tensor([3, 1, 6]), node_num, hidden_channels,
+                      'cpu')
+    for step in range(3):
+        x = torch.randn(5, hidden_channels, requires_grad=True)
+        y = x.detach().clone().requires_grad_()
+        out = fused.pull_push(x, target_id)
+        out_ref = unfused.pull(y, target_id)
+        unfused.push(out_ref, target_id)
+        assert torch.allclose(out, out_ref)
+        assert torch.equal(fused.emb, unfused.emb)
+        assert torch.equal(fused.cached_nodes, unfused.cached_nodes)
+        out.sum().backward()
+        out_ref.sum().backward()
+        assert torch.equal(x.grad, y.grad)
+        # from the second step node 3 is cached, no gradient flows back to x
+        assert torch.equal(x.grad[1],
+                           torch.full((hidden_channels, ), float(step == 0)))
+
+
+def test_compact_history():
+    cached_id = torch.tensor([6, 3, 1, 3])  # duplicates share one slot
+    compact = History(cached_id, node_num, hidden_channels, 'cpu', True)
+    dense = History(cached_id, node_num, hidden_channels, 'cpu')
+    assert compact.cached_id.dtype == torch.int32
+    assert compact.emb.size() == (3, hidden_channels)
+    node_id = torch.arange(node_num)
+    assert torch.equal(compact.lookup(node_id) >= 0, dense.emb_idx >= 0)
+    assert torch.equal(compact.lookup(node_id),
+                       torch.tensor([-1, 0, -1, 1, -1, -1, 2, -1]))
+    target_id = torch.tensor([0, 3, 5, 1, 6])
+    for _ in range(3):
+        x = torch.randn(5, hidden_channels)
+        assert torch.equal(compact.pull_push(x, target_id),
+                           dense.pull_push(x, target_id))
+        assert torch.equal(compact.is_cached(node_id), dense.cached_nodes)
+    x = torch.randn(5, hidden_channels)
+    assert torch.equal(compact.pull(x, target_id), dense.pull(x, target_id))
+    empty = History(torch.tensor([], dtype=torch.long), node_num,
+                    hidden_channels, 'cpu', True)
+    assert torch.equal(empty.pull_push(x, target_id), x)
+    assert not empty.is_cached(node_id).any()
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_history_pool(compact):
+    torch.manual_seed(1)
+    pool = HistoryPool(2, hidden_channels, 'cpu', compact)
+    for num_embeddings in [8, 20, 5, 20]:  # grows, shrinks, reuses
+        cached_id = [
+            torch.randperm(num_embeddings)[:num_embeddings // 2]
+            for _ in range(2)
+        ]
+        histories = pool.reset(cached_id, num_embeddings)
+        assert histories is pool
+        target_id = torch.randperm(num_embeddings)[:4]
+        for history, ids in zip(histories, cached_id):
+            fresh = History(ids, num_embeddings, hidden_channels, 'cpu',
+                            compact)
+            node_id = torch.arange(num_embeddings)
+            assert torch.equal(history.lookup(node_id), fresh.lookup(node_id))
+            assert not history.is_cached(node_id).any()
+            for _ in range(2):
+                x = torch.randn(4, hidden_channels)
+                assert torch.equal(history.pull_push(x, target_id),
+                                   fresh.pull_push(x, target_id))
+            assert torch.equal(history.is_cached(node_id),
+                               fresh.is_cached(node_id))
+    assert pool[0]._emb.size(0) == 10
+
+
+# largest rounding error relative to the largest magnitude of the row
+@pytest.mark.parametrize("dtype,tol", [(torch.float16, 2**-11),
+                                       (torch.bfloat16, 2**-8),
+                                       (torch.int8, 0.5 / 127)])
+def test_history_dtype(dtype, tol):
+    torch.manual_seed(2)
+    cached_id = torch.tensor([3, 1, 6])
+    history = History(cached_id, node_num, hidden_channels, 'cpu', dtype=dtype)
+    exact = History(cached_id, node_num, hidden_channels, 'cpu')
+    assert history.emb.dtype == dtype
+    target_id = torch.tensor([0, 3, 5, 1, 6])
+    x = torch.randn(5, hidden_channels)
+    history.push(x, target_id)
+    exact.push(x, target_id)
+    y = torch.randn(5, hidden_channels)
+    out = history.pull_push(y, target_id)
+    out_exact = exact.pull_push(y, target_id)
+    assert out.dtype == y.dtype
+    bound = tol * out_exact.abs().amax(dim=1, keepdim=True) + 1e-7
+    assert ((out - out_exact).abs() <= bound).all()
+    assert torch.equal(out[[0, 2]], y[[0, 2]])  # not cached, not rounded
+
+    # the rounding error of the histories stays small in the model output
+    train_loader = NeighborSampler(edge_index,
+                                   sizes=hop,
+                                   batch_size=2,
+                                   shuffle=False,
+                                   drop_last=True)
+    batch_size, n_id, adjs = next(iter(train_loader))
+    nano_batchs, cached_id = get_nano_batch_histories(adjs,
+                                                      mb_n_id,
+                                                      batch_size=2,
+                                                      num_nano_batch=2)
+    model1 = ScaleSAGE(in_channels, hidden_channels, out_channels, num_layers)
+    model2 = SAGE(in_channels, hidden_channels, out_channels, num_layers)
+    model2.load_state_dict(model1.state_dict())
+    histories = torch.nn.ModuleList([
+        History(cacheid, len(n_id), hidden_channels, 'cpu', dtype=dtype)
+        for cacheid in cached_id
+    ])
+    x = torch.tensor(features, dtype=torch.float)
+    for nb in nano_batchs:
+        out1 = model1(x[n_id][nb.n_id], nb.n_id, nb.adjs, histories)
+        out2 = model2(x[n_id][nb.n_id], nb.adjs)
+        assert torch.allclose(out1, out2, atol=10 * tol)
+    assert histories[0].emb.abs().sum() > 0  # a non zero row was pulled
+
+
+def test_global_history_same_out():
+    train_loader = NeighborSampler(edge_index,
+                                   sizes=hop,
+                                   batch_size=2,
+                                   shuffle=False,
+                                   drop_last=True)
+    batch_size, n_id, adjs = next(iter(train_loader))
+    nano_batchs = get_nano_batch(adjs, n_id, batch_size=2, num_nano_batch=2)
+    model1 = ScaleSAGE(in_channels, hidden_channels, out_channels, num_layers)
+    model2 = SAGE(in_channels, hidden_channels, out_channels, num_layers)
+    model2.load_state_dict(model1.state_dict())
+    history = GlobalHistory(node_num, hidden_channels)
+    histories = [history.bind(n_id)]  # n_id maps to the global ids
+    x = torch.tensor(features, dtype=torch.float)
+    for nb in nano_batchs:
+        out1 = model1(x[n_id][nb.n_id], nb.n_id, nb.adjs, histories)
+        out2 = model2(x[n_id][nb.n_id], nb.adjs)
+        assert torch.allclose(out1, out2)
+    # node 3 feeds both nano batches, the second one reads it
+    assert history.hits > 0 and history.is_cached(torch.tensor([3]))
+
+
+def test_global_history_staleness():
+    history = GlobalHistory(node_num, hidden_channels, max_staleness=1)
+    node_id = torch.tensor([2, 5])
+    x = torch.randn(2, hidden_channels)
+    history.push(x, node_id)
+    history.tick()
+    assert torch.equal(history.pull(torch.zeros(2, hidden_channels), node_id),
+                       x)
+    # a reused embedding is not pushed again, it expires one step later
+    out = history.pull_push(torch.zeros(3, hidden_channels),
+                            torch.tensor([2, 5, 7]))
+    assert torch.equal(out[:2], x)
+    history.tick()
+    assert torch.equal(history.is_cached(torch.tensor([2, 5, 7])),
+                       torch.tensor([False, False, True]))
+    assert (history.hits, history.misses) == (4, 1)
+
+
+@pytest.mark.parametrize("policy,evicted", [("lru", 0), ("lfu", 1)])
+def test_global_history_eviction(policy, evicted):
+    row_bytes = 4 * hidden_channels
+    history = GlobalHistory(node_num,
+                            hidden_channels,
+                            max_staleness=10,
+                            memory_budget=2 * row_bytes,
+                            policy=policy)
+    assert history.capacity == 2
+    history.push(torch.randn(2, hidden_channels), torch.tensor([0, 1]))
+    history.tick()
+    for _ in range(2):  # node 0 is read more often, node 1 more recently
+        history.pull(torch.zeros(1, hidden_channels), torch.tensor([0]))
+    history.tick()
+    history.pull(torch.zeros(1, hidden_channels), torch.tensor([1]))
+    history.push(torch.randn(1, hidden_channels), torch.tensor([2]))
+    cached = history.is_cached(torch.tensor([0, 1, 2]))
+    assert cached.tolist() == [i != evicted for i in range(3)]
+    # without room for all, only some new nodes are stored
+    history.push(torch.randn(3, hidden_channels), torch.tensor([3, 4, 5]))
+    assert int(history.is_cached(torch.arange(node_num)).sum()) == 2
+
+
+def test_global_history_free_slots():
+    row_bytes = 4 * hidden_channels
+    history = GlobalHistory(node_num,
+                            hidden_channels,
+                            memory_budget=3 * row_bytes)
+    history.push(torch.randn(2, hidden_channels), torch.tensor([0, 1]))
+    assert history.num_used == 2
+    history.tick()  # 0 and 1 expire
+    history.push(torch.randn(1, hidden_channels), torch.tensor([0]))
+    # the free slot is taken first, then an expired one
+    x = torch.randn(2, hidden_channels)
+    history.push(x, torch.tensor([2, 3]))
+    assert history.num_used == 3
+    cached = history.is_cached(torch.arange(4))
+    assert cached.tolist() == [True, False, True, True]
+    assert torch.equal(
+        history.pull(torch.zeros(2, hidden_channels), torch.tensor([2, 3])), x)
+
+
+def test_mmap_history(tmp_path):
+    torch.manual_seed(3)
+    num_nodes, path = 100, str(tmp_path / "emb.bin")
+    history = MmapHistory(num_nodes, hidden_channels, path, buffer_size=8)
+    emb = torch.randn(num_nodes, hidden_channels)
+    for node_id in torch.randperm(num_nodes).split(7):  # crosses flushes
+        history.push(emb[node_id], node_id)
+    assert 0 < history._buf_len < 8
+    history.push(emb[[5]] + 1, torch.tensor([5]))  # the last push wins
+    emb[5] += 1
+    node_id = torch.randperm(num_nodes)[:30]
+    out = history.pull(torch.zeros(30, hidden_channels), node_id)
+    assert torch.equal(out, emb[node_id])
+    history.flush()
+    on_disk = np.memmap(path,
+                        dtype=np.float32,
+                        mode="r",
+                        shape=(num_nodes, hidden_channels))
+    assert torch.equal(torch.from_numpy(np.array(on_disk)), emb)
+    history.tick()
+    assert not history.is_cached(node_id).any()  # max_staleness=0
+
+
+def test_mmap_history_same_out(tmp_path):
+    train_loader = NeighborSampler(edge_index,
+                                   sizes=hop,
+                                   batch_size=2,
+                                   shuffle=False,
+                                   drop_last=True)
+    batch_size, n_id, adjs = next(iter(train_loader))
+    nano_batchs = get_nano_batch(adjs, n_id, batch_size=2, num_nano_batch=2)
+    model1 = ScaleSAGE(in_channels, hidden_channels, out_channels, num_layers)
+    model2 = SAGE(in_channels, hidden_channels, out_channels, num_layers)
+    model2.load_state_dict(model1.state_dict())
+    history = MmapHistory(node_num, hidden_channels, str(tmp_path / "emb.bin"))
+    histories = [history.bind(n_id)]
+    x = torch.tensor(features, dtype=torch.float)
+    for nb in nano_batchs:
+        out1 = model1(x[n_id][nb.n_id], nb.n_id, nb.adjs, histories)
+        out2 = model2(x[n_id][nb.n_id], nb.adjs)
+        assert torch.allclose(out1, out2)
+    assert history.hits > 0
+
+
+@pytest.mark.parametrize("store", ["staleness", "budget", "mmap"])
+def test_graph_history_exact(store, tmp_path):
+    # with fixed parameters and full neighborhoods, every stored embedding
+    # is the full graph output of its layer, over several mini batches
+    torch.manual_seed(0)
+    num_nodes = 200
+    graph = coalesce(torch.randint(0, num_nodes, (2, 800)),
+                     num_nodes=num_nodes)
+    model = ScaleSAGE(in_channels, hidden_channels, out_channels, 3)
+    x = torch.randn(num_nodes, in_channels)
+    exact, h = [], x
+    with torch.no_grad():
+        for i in range(2):
+            h = model.inference_layer(i, h, graph, (num_nodes, num_nodes))
+            exact.append(h)
+    if store == "mmap":
+        histories = [
+            MmapHistory(num_nodes,
+                        hidden_channels,
+                        str(tmp_path / f"emb{i}.bin"),
+                        max_staleness=2) for i in range(2)
+        ]
+    else:
+        budget = 60 * 4 * hidden_channels if store == "budget" else None
+        histories = [
+            GlobalHistory(num_nodes,
+                          hidden_channels,
+                          max_staleness=2,
+                          memory_budget=budget) for _ in range(2)
+        ]
+    sampler = CSRSampler(graph, [-1, -1, -1], num_nodes)
+    with torch.no_grad():
+        for seeds in torch.randperm(num_nodes).split(10):
+            n_id, batch_size, adjs = sampler.sample(seeds)
+            bound = [history.bind(n_id) for history in histories]
+            for nb in get_nano_batch(adjs, n_id, batch_size, 3):
+                model(x[n_id][nb.n_id], nb.n_id, nb.adjs, bound)
+            for history, emb in zip(histories, exact):
+                if store == "mmap":
+                    history.flush()
+                    node_id = (history.written >= 0).nonzero().view(-1)
+                    stored = history.emb[node_id]
+                else:
+                    node_id = history.slot_node[history.slot_node >= 0]
+                    stored = history.emb[history.slot_node >= 0]
+                assert node_id.numel() > 0
+                assert torch.allclose(stored, emb[node_id], atol=1e-5)
+                history.tick()
+    assert all(history.hits > 0 for history in histories)
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_async_push(compact):
+    torch.manual_seed(4)
+    cached_id = torch.tensor([3, 1, 6])
+    history = History(cached_id,
+                      node_num,
+                      hidden_channels,
+                      'cpu',
+                      compact,
+                      async_push=True)
+    sync = History(cached_id, node_num, hidden_channels, 'cpu', compact)
+    target_id = torch.tensor([0, 3, 5, 1, 6])
+    for _ in range(5):  # each pull must see the previous push
+        x = torch.randn(5, hidden_channels)
+        assert torch.equal(history.pull_push(x, target_id),
+                           sync.pull_push(x, target_id))
+        history.push(x, target_id[:2])
+        sync.push(x, target_id[:2])
+    history.synchronize()
+    assert not history._pending
+    assert torch.equal(history.emb, sync.emb)
+    assert torch.equal(history.is_cached(target_id), sync.is_cached(target_id))
+
+
 if __name__ == "__main__":
     # test_small_save_embedding()
     # test_small_histfunction()